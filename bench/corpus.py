@@ -0,0 +1,117 @@
+"""
+    Synthetic corpora served by the stand-in upstreams of the benchmark. Records are generated from their index,
+    so the same corpus is served in every run and large corpora are never kept in memory.
+"""
+
+from datetime import datetime, timedelta
+
+
+# Sizes of the corpora run by default
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Date of the first record of every corpus: each next one is one hour newer
+FIRST_DATE = datetime(2015, 1, 1)
+
+FIELDS = ['Genomics', 'Proteomics', 'Systems Biology', 'Bioinformatics', 'Epigenomics', 'Biostatistics',
+          'Structural Biology', 'Metabolomics']
+CITIES = [('Bilbao', 'Spain'), ('Hinxton', 'United Kingdom'), ('Heidelberg', 'Germany'), ('Lausanne', 'Switzerland')]
+PROVIDERS = ['CNIO', 'EMBL-EBI', 'SIB', 'ELIXIR']
+AUDIENCES = ['Students', 'Researchers', 'Developers']
+RESOURCE_TYPES = ['Tool (analysis)', 'Database', 'Workflow', 'Web service']
+
+# Every how many iAnn events one was submitted again, some days after it began
+RESUBMITTED_EVERY = 7
+
+
+def get_date(index):
+    """
+        * index {int} index of one record.
+        * {datetime} Return the date of the record.
+    """
+    return FIRST_DATE+timedelta(hours=index)
+
+
+def get_terms(values, index, count):
+    """
+        * {list} Return 'count' values chosen from 'values' for one record.
+    """
+    return [values[(index+offset) % len(values)] for offset in range(count)]
+
+
+def get_description(index):
+    """
+        * {string} Return a description of a few hundred bytes, as the real ones.
+    """
+    return ('Synthetic record '+str(index)+' of the import benchmark. ')*8
+
+
+def get_iann_event(index, link_base):
+    """
+        Get one iAnn event, as returned by its Solr select endpoint.
+        * index {int} index of the event.
+        * link_base {string} base url of the links of the records.
+        * {dict} Return the event.
+    """
+    start = get_date(index)
+    (city, country) = CITIES[index % len(CITIES)]
+    submission_dates = [start-timedelta(days=30)]
+    if index % RESUBMITTED_EVERY == 0:
+        submission_dates.append(start+timedelta(days=10))
+    return {
+        'id': 'event%08d' % index,
+        'title': 'Event '+str(index),
+        'start': [start.strftime('%Y-%m-%dT%H:%M:%SZ')],
+        'end': [(start+timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%SZ')],
+        'city': [city],
+        'country': [country],
+        'field': get_terms(FIELDS, index, 1+index % 3),
+        'provider': [PROVIDERS[index % len(PROVIDERS)]],
+        'link': link_base+'event/'+str(index),
+        'submission_date': [date.strftime('%Y-%m-%dT%H:%M:%SZ') for date in submission_dates],
+        'keyword': ['keyword'+str(number) for number in range(20)],
+        'description': get_description(index)
+        }
+
+
+def get_material_name(index):
+    """
+        * {string} Return the name of one CKAN training material.
+    """
+    return 'material%08d' % index
+
+
+def get_ckan_material(index, link_base):
+    """
+        Get one CKAN training material, as returned by package_show and package_search.
+        * index {int} index of the training material.
+        * link_base {string} base url of the links of the records.
+        * {dict} Return the training material.
+    """
+    created = get_date(index)
+    return {
+        'name': get_material_name(index),
+        'title': 'Training material '+str(index),
+        'notes': get_description(index),
+        'url': link_base+'material/'+str(index),
+        'tags': [{'display_name': term} for term in get_terms(FIELDS, index, 1+index % 3)],
+        'metadata_created': created.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+        'metadata_modified': (created+timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S.%f'),
+        'resources': [{'audience': str(get_terms(AUDIENCES, index, 1+index % 2))}]
+        }
+
+
+def get_biotools_tool(index, link_base):
+    """
+        Get one bio.tools tool, as returned by its tool list.
+        * index {int} index of the tool.
+        * link_base {string} base url of the links of the records.
+        * {dict} Return the tool.
+    """
+    return {
+        'name': 'Tool '+str(index),
+        'description': get_description(index),
+        'homepage': link_base+'tool/'+str(index),
+        'topic': [{'term': term, 'uri': 'http://edamontology.org/topic_'+str(number)}
+                  for (number, term) in enumerate(get_terms(FIELDS, index, 1+index % 3))],
+        'resourceType': get_terms(RESOURCE_TYPES, index, 1+index % 2)
+        }
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""
+    Local stand-ins for the services the importing scripts read from, serving the synthetic corpora of corpus.py.
+    The size of the corpus is the first part of the path, so one server serves all of them:
+        /<size>/solr/select                     iAnn Solr select endpoint (rows, cursorMark or start, fl, fq)
+        /<size>/api/3/action/package_list       CKAN (TeSS) names of all training materials
+        /<size>/api/3/action/package_show       CKAN training material (id)
+        /<size>/api/3/action/package_search     CKAN page of training materials (start, rows)
+        /<size>/api/tool                        bio.tools page of tools (page)
+        /links/...                              links of the records, always available
+    Filter queries (fq) are ignored, except the submission_date range of incremental iAnn runs. Responses are gzip-compressed when the client
+    accepts it, as the real services do. Latencies, errors, hangs, slow-drip bodies and connection resets can be
+    injected in each endpoint, see faults.py.
+
+    Run it by hand with: python fake_upstreams.py [--port PORT] [--faults JSON_OR_FILE] [--seed SEED]
+"""
+
+import re
+import sys
+import time
+import gzip
+import json
+import struct
+import socket
+import argparse
+import threading
+import urlparse
+import StringIO
+import BaseHTTPServer
+import SocketServer
+
+import corpus
+import faults
+
+
+# Tools in each page of the bio.tools list
+BIOTOOLS_PAGE_SIZE = 50
+
+# Rows returned by Solr and CKAN package_search when they aren't requested
+DEFAULT_ROWS = 10
+
+# Submission date range of the filter query of incremental iAnn runs
+SUBMISSION_DATE_FILTER = re.compile(r'submission_date:\[(\S+) TO \*\]')
+
+
+class UpstreamsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Responses are sent in one write: small writes make keep-alive clients wait for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        parts = url.path.strip('/').split('/')
+        fault = self.server.fault_profile.draw(get_endpoint(parts))
+        if fault.latency > 0:
+            time.sleep(fault.latency)
+        if fault.reset:
+            self.reset_connection()
+            return
+        if fault.hang_seconds > 0:
+            # The client has usually given up when we answer
+            time.sleep(fault.hang_seconds)
+        if fault.error_status is not None:
+            self.send_error(fault.error_status)
+            return
+        try:
+            if parts[0] == 'links':
+                body = ''
+            else:
+                size = int(parts[0])
+                path = '/'.join(parts[1:])
+                if path.startswith('solr/select'):
+                    body = get_solr_select(size, query, self.server.link_base)
+                elif path.startswith('api/3/action/'):
+                    body = get_ckan_action(size, parts[-1], query, self.server.link_base)
+                elif path.startswith('api/tool'):
+                    body = get_biotools_page(size, query, self.server.link_base)
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(body)
+        except (ValueError, KeyError, IndexError):
+            self.send_error(400)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if len(body) > 0 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buffer = StringIO.StringIO()
+            gzip_file = gzip.GzipFile(fileobj=buffer, mode='w', compresslevel=1)
+            gzip_file.write(body)
+            gzip_file.close()
+            body = buffer.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if head:
+            return
+        if fault.drip_bytes is None:
+            self.wfile.write(body)
+            return
+        # Slow-drip body: the client receives a few bytes at a time, never waiting long enough to time out
+        for position in range(0, len(body), fault.drip_bytes):
+            self.wfile.write(body[position:position+fault.drip_bytes])
+            self.wfile.flush()
+            time.sleep(fault.drip_seconds)
+
+    def reset_connection(self):
+        """
+            Closes the connection with a TCP reset, without answering.
+        """
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.connection.close()
+        self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class UpstreamsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, port=0, fault_profile=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), UpstreamsHandler)
+        self.base_url = 'http://127.0.0.1:'+str(self.server_port)+'/'
+        self.link_base = self.base_url+'links/'
+        self.fault_profile = fault_profile or faults.FaultProfile()
+
+    def handle_error(self, request, client_address):
+        # Clients that time out close their connections while we are answering them: that's expected
+        pass
+
+
+def get_endpoint(parts):
+    """
+        * parts {list} parts of the path of one request.
+        * {string} Return the endpoint requested, one of faults.ENDPOINTS. None if it's unknown.
+    """
+    if parts[0] == 'links':
+        return 'links'
+    path = '/'.join(parts[1:])
+    if path.startswith('solr/select'):
+        return 'solr'
+    if path.startswith('api/3/action/'):
+        return parts[-1]
+    if path.startswith('api/tool'):
+        return 'biotools'
+    return None
+
+
+def get_page_bounds(size, start, rows):
+    """
+        * {list} Return the indexes of the records of one page.
+    """
+    return range(min(max(0, start), size), min(max(0, start)+max(0, rows), size))
+
+
+def get_solr_select(size, query, link_base):
+    """
+        Get one page of iAnn events, following cursorMark when it's requested. Our cursorMark is the index of the
+        first event of the page. numFound is always the size of the corpus, even when events are filtered.
+    """
+    rows = int(query.get('rows', DEFAULT_ROWS))
+    cursor_mark = query.get('cursorMark')
+    if cursor_mark is None:
+        start = int(query.get('start', 0))
+    elif cursor_mark == '*':
+        start = 0
+    else:
+        start = int(cursor_mark)
+    date_filter = SUBMISSION_DATE_FILTER.search(query.get('fq', ''))
+    if date_filter is None:
+        docs = [corpus.get_iann_event(index, link_base) for index in get_page_bounds(size, start, rows)]
+        end = start+len(docs)
+    else:
+        (docs, end) = get_filtered_iann_events(size, start, rows, date_filter.group(1), link_base)
+    if 'fl' in query:
+        fields = query['fl'].split(',')
+        docs = [dict([(field, value) for (field, value) in doc.items() if field in fields]) for doc in docs]
+    response = {'responseHeader': {'status': 0}, 'response': {'numFound': size, 'start': start, 'docs': docs}}
+    if cursor_mark is not None:
+        if end > start:
+            response['nextCursorMark'] = str(end)
+        else:
+            response['nextCursorMark'] = cursor_mark
+    return response
+
+
+def get_filtered_iann_events(size, start, rows, from_date, link_base):
+    """
+        Get one page of the iAnn events matching "submission_date:[from_date TO *]": as in Solr, an event matches
+        when any of its submission dates is from_date or later.
+        * {tuple} Return (docs, end): the events, and the index following the last event scanned.
+    """
+    docs = []
+    index = max(0, start)
+    while index < size and len(docs) < rows:
+        doc = corpus.get_iann_event(index, link_base)
+        # Dates have the same format, so they are compared as strings
+        if max(doc['submission_date']) >= from_date:
+            docs.append(doc)
+        index += 1
+    return (docs, index)
+
+
+def get_ckan_action(size, action, query, link_base):
+    """
+        Get the response of one CKAN action.
+    """
+    if action == 'package_list':
+        return {'success': True, 'result': [corpus.get_material_name(index) for index in range(size)]}
+    if action == 'package_show':
+        index = int(query['id'].replace('material', ''))
+        if index >= size:
+            return {'success': False, 'error': {'message': 'Not found'}}
+        return {'success': True, 'result': corpus.get_ckan_material(index, link_base)}
+    if action == 'package_search':
+        results = [corpus.get_ckan_material(index, link_base)
+                   for index in get_page_bounds(size, int(query.get('start', 0)), int(query.get('rows', DEFAULT_ROWS)))]
+        return {'success': True, 'result': {'count': size, 'results': results}}
+    raise KeyError(action)
+
+
+def get_biotools_page(size, query, link_base):
+    """
+        Get one page of the bio.tools list, numbered from 1.
+    """
+    page = int(query.get('page', 1))
+    start = (page-1)*BIOTOOLS_PAGE_SIZE
+    next_page = None
+    if start+BIOTOOLS_PAGE_SIZE < size:
+        next_page = '?page='+str(page+1)
+    return {'count': size, 'next': next_page,
+            'list': [corpus.get_biotools_tool(index, link_base) for index in get_page_bounds(size, start, BIOTOOLS_PAGE_SIZE)]}
+
+
+def start_server(port=0, fault_profile=None):
+    """
+        Starts the stand-in upstreams in a background thread.
+        * port {int} port to listen on, any free one if it's 0.
+        * fault_profile {FaultProfile} faults to inject, none if it's None.
+        * {UpstreamsServer} Return the server. The corpus of 'size' records is served under base_url+str(size).
+    """
+    server = UpstreamsServer(port, fault_profile)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-ins for the upstreams of the importing scripts')
+    parser.add_argument('--port', type=int, default=0, help='port to listen on, any free one by default')
+    parser.add_argument('--faults', help='JSON object with the faults to inject, or path of a file with it')
+    parser.add_argument('--seed', type=int, help='seed of the random faults')
+    args = parser.parse_args()
+    server = UpstreamsServer(args.port, faults.FaultProfile(faults.load_faults(args.faults), args.seed))
+    # The benchmark harness reads the url of the server from the first line
+    print server.base_url
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
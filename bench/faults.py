@@ -0,0 +1,123 @@
+"""
+    Faults injected by the stand-in upstreams of fake_upstreams.py, to see how the importing scripts behave when the
+    services are slow or flaky. They are configured with a JSON object with the faults of each endpoint:
+        {
+            "package_show": {"latency": {"distribution": "fixed", "seconds": 2}},
+            "links": {"hang_rate": 0.1, "hang_seconds": 15},
+            "*": {"reset_rate": 0.01}
+        }
+    Endpoints are 'solr', 'package_list', 'package_show', 'package_search', 'biotools' and 'links'. The faults of
+    '*' apply to the endpoints without their own ones. The faults of one endpoint are:
+        latency         distribution of the time waited before answering:
+                            {"distribution": "fixed", "seconds": s}
+                            {"distribution": "uniform", "min": a, "max": b}
+                            {"distribution": "exponential", "mean": m}
+                            {"distribution": "lognormal", "median": m, "sigma": s}
+        error_rate      share of requests answered with error_status (default 503)
+        hang_rate       share of requests that wait hang_seconds (default 30) before answering, so clients time out
+        reset_rate      share of requests whose connection is reset without answering
+        drip_bytes      if set, bodies are sent in chunks of drip_bytes...
+        drip_seconds    ...every drip_seconds (default 1)
+"""
+
+import math
+import json
+import random
+import threading
+
+
+DEFAULT_ERROR_STATUS = 503
+DEFAULT_HANG_SECONDS = 30
+DEFAULT_DRIP_SECONDS = 1
+
+ENDPOINTS = ['solr', 'package_list', 'package_show', 'package_search', 'biotools', 'links']
+ANY_ENDPOINT = '*'
+
+
+class Fault(object):
+    """
+        Faults decided for one request.
+    """
+
+    def __init__(self):
+        self.latency = 0.0
+        self.reset = False
+        self.hang_seconds = 0.0
+        self.error_status = None
+        self.drip_bytes = None
+        self.drip_seconds = DEFAULT_DRIP_SECONDS
+
+
+class FaultProfile(object):
+    """
+        Faults of every endpoint. Requests draw their faults from one random generator, so runs with the same seed
+        and the same requests get the same faults.
+    """
+
+    def __init__(self, faults=None, seed=None):
+        self.faults = faults or {}
+        for endpoint in self.faults:
+            if endpoint != ANY_ENDPOINT and endpoint not in ENDPOINTS:
+                raise ValueError('Unknown endpoint: '+endpoint)
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def get_endpoint_faults(self, endpoint):
+        """
+            * endpoint {string} one of ENDPOINTS.
+            * {dict} Return the faults configured for the endpoint.
+        """
+        return self.faults.get(endpoint, self.faults.get(ANY_ENDPOINT, {}))
+
+    def get_latency(self, latency):
+        """
+            * latency {dict} distribution of the latency, as described above.
+            * {float} Return one latency drawn from the distribution, in seconds.
+        """
+        distribution = latency.get('distribution', 'fixed')
+        if distribution == 'fixed':
+            return float(latency.get('seconds', 0))
+        if distribution == 'uniform':
+            return self.random.uniform(latency.get('min', 0), latency['max'])
+        if distribution == 'exponential':
+            return self.random.expovariate(1.0/latency['mean'])
+        if distribution == 'lognormal':
+            return self.random.lognormvariate(math.log(latency['median']), latency.get('sigma', 1.0))
+        raise ValueError('Unknown latency distribution: '+str(distribution))
+
+    def draw(self, endpoint):
+        """
+            Decides the faults of one request.
+            * endpoint {string} endpoint requested, one of ENDPOINTS.
+            * {Fault} Return the faults of the request.
+        """
+        fault = Fault()
+        endpoint_faults = self.get_endpoint_faults(endpoint)
+        if len(endpoint_faults) == 0:
+            return fault
+        with self.random_lock:
+            if 'latency' in endpoint_faults:
+                fault.latency = max(0.0, self.get_latency(endpoint_faults['latency']))
+            if self.random.random() < endpoint_faults.get('reset_rate', 0):
+                fault.reset = True
+            elif self.random.random() < endpoint_faults.get('hang_rate', 0):
+                fault.hang_seconds = endpoint_faults.get('hang_seconds', DEFAULT_HANG_SECONDS)
+            elif self.random.random() < endpoint_faults.get('error_rate', 0):
+                fault.error_status = endpoint_faults.get('error_status', DEFAULT_ERROR_STATUS)
+        fault.drip_bytes = endpoint_faults.get('drip_bytes')
+        fault.drip_seconds = endpoint_faults.get('drip_seconds', DEFAULT_DRIP_SECONDS)
+        return fault
+
+
+def load_faults(specification):
+    """
+        Reads the faults to inject.
+        * specification {string} JSON object with the faults, or path of a file with it.
+        * {dict} Return the faults of every endpoint.
+    """
+    if specification is None:
+        return {}
+    if specification.strip().startswith('{'):
+        return json.loads(specification)
+    with open(specification) as faults_file:
+        return json.load(faults_file)
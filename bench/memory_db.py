@@ -0,0 +1,99 @@
+"""
+    In-memory DB manager with the interface of the managers returned by DBFactory, so the importing scripts can be
+    benchmarked without a database: the time spent in the DB is left out of the results.
+"""
+
+import threading
+
+
+class MemoryManager(object):
+    """
+        Dataset kept in a list, with the methods of the DB managers used by the importing scripts, and the bulk
+        insert_data_list used by bulk_writer.BulkWriter when a manager has it. Conditions are
+        lists of ['EQ', field, value] and ['AND', conditions]; values ending with '*' match as prefixes.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+        self.calls = {'insert_data': 0, 'insert_data_list': 0, 'get_data_by_conditions': 0,
+                      'count_data_by_conditions': 0, 'delete_data_by_conditions': 0}
+
+    def insert_data(self, data):
+        with self.lock:
+            self.calls['insert_data'] += 1
+            self.records.append(dict(data))
+        return True
+
+    def insert_data_list(self, data_list):
+        with self.lock:
+            self.calls['insert_data_list'] += 1
+            self.records.extend([dict(data) for data in data_list])
+        return [True]*len(data_list)
+
+    def get_data_by_conditions(self, conditions):
+        with self.lock:
+            self.calls['get_data_by_conditions'] += 1
+            return [dict(record) for record in self.records if matches(record, conditions)]
+
+    def count_data_by_conditions(self, conditions):
+        with self.lock:
+            self.calls['count_data_by_conditions'] += 1
+            return len([record for record in self.records if matches(record, conditions)])
+
+    def delete_data_by_conditions(self, conditions):
+        with self.lock:
+            self.calls['delete_data_by_conditions'] += 1
+            self.records = [record for record in self.records if not matches(record, conditions)]
+        return True
+
+
+def matches(record, conditions):
+    """
+        * record {dict} record of the dataset.
+        * conditions {list} conditions, all of them have to be met.
+        * {boolean} Return if the record meets the conditions.
+    """
+    for condition in conditions:
+        if condition[0] == 'AND':
+            if not matches(record, condition[1]):
+                return False
+        elif condition[0] == 'EQ':
+            value = record.get(condition[1])
+            expected = condition[2]
+            if isinstance(expected, basestring) and expected.endswith('*'):
+                if not (isinstance(value, basestring) and value.startswith(expected[:-1])):
+                    return False
+            elif value != expected:
+                return False
+        else:
+            raise ValueError('Unsupported condition: '+str(condition[0]))
+    return True
+
+
+# Datasets of this process, by name
+managers = {}
+managers_lock = threading.Lock()
+
+
+def get_manager(ds_name):
+    """
+        * ds_name {string} name of the dataset.
+        * {MemoryManager} Return the manager of the dataset, created empty the first time.
+    """
+    with managers_lock:
+        if ds_name not in managers:
+            managers[ds_name] = MemoryManager()
+        return managers[ds_name]
+
+
+class DBFactory(object):
+    """
+        Stand-in for DBFactory of resource-contextualization-import-db.
+    """
+
+    def get_default_db_manager_with_username(self, ds_name, user, passw):
+        return get_manager(ds_name)
+
+    def get_default_db_manager(self, ds_name):
+        return get_manager(ds_name)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+"""
+    Micro-benchmark of the getters that transform every record fetched by the importing scripts. Each getter runs
+    over a generated corpus with the shapes of the decoded JSON of the upstreams (lists of unicode strings, nested
+    topic dicts, stringified audience lists, some non-ASCII values and quotes), and its cost is reported in
+    nanoseconds per record: the best of several passes over the whole corpus, with the garbage collector disabled.
+    Batch getters run over the corpus split into pages, and their outputs are digested record by record, so their
+    digest is the one of the getter of single records they replace.
+
+    Results are compared with a stored baseline: getters slower than the baseline by more than the threshold are
+    reported as regressions, and getters whose output differs from the baseline as changed. Baselines depend on the
+    machine and the Python version, so they are only comparable on the same ones. Usage:
+        python micro_benchmark.py [--records 2000] [--repeat 9] [--filter get_field]
+                                  [--baseline baselines/micro_benchmark.json] [--save-baseline] [--threshold 0.25]
+    It exits with status 1 if there is any regression or changed output.
+"""
+
+import os
+import sys
+import gc
+import json
+import hashlib
+import itertools
+import argparse
+import platform
+import timeit
+from datetime import datetime
+
+import corpus
+import run_benchmark
+
+
+DEFAULT_RECORDS = 2000
+DEFAULT_REPEAT = 9
+DEFAULT_THRESHOLD = 0.25
+
+# Number of records of the pages of the batch getters, and suffix of the names of their corpora
+PAGE_SIZE = 500
+PAGES_SUFFIX = '_pages'
+DEFAULT_BASELINE = os.path.join(run_benchmark.BENCH_DIRECTORY, 'baselines', 'micro_benchmark.json')
+
+# One of every UNUSUAL_EVERY records has non-ASCII values, and one of every QUOTED_EVERY has values with quotes
+UNUSUAL_EVERY = 10
+QUOTED_EVERY = 50
+
+# Base url of the links of the generated records
+LINK_BASE = 'http://example.org/'
+
+
+def decode(data):
+    """
+        * {dict} Return the data as the importing scripts get it: decoded from JSON, with unicode strings.
+    """
+    return json.loads(json.dumps(data))
+
+
+def get_iann_events(size):
+    """
+        * size {int} number of events.
+        * {list} Return the events, as returned by the Solr server of iAnn.
+    """
+    events = []
+    for index in range(size):
+        event = corpus.get_iann_event(index, LINK_BASE)
+        if index % UNUSUAL_EVERY == 0:
+            event['field'] = [u'Bioinform\xe1tica']+event['field']
+        if index % QUOTED_EVERY == 0:
+            event['field'] = event['field']+[u"Children's health"]
+        events.append(decode(event))
+    return events
+
+
+def get_ckan_materials(size):
+    """
+        * size {int} number of training materials.
+        * {list} Return the training materials, as returned by package_show and package_search.
+    """
+    materials = []
+    for index in range(size):
+        material = corpus.get_ckan_material(index, LINK_BASE)
+        if index % UNUSUAL_EVERY == 0:
+            material['tags'].append({'display_name': u'An\xe1lisis de datos'})
+            material['resources'][0]['audience'] = str([u'Estudiantes de m\xe1ster'])
+        materials.append(decode({'success': True, 'result': material}))
+    return materials
+
+
+def get_biotools_tools(size):
+    """
+        * size {int} number of tools.
+        * {list} Return the tools, as returned by the bio.tools list.
+    """
+    tools = []
+    for index in range(size):
+        tool = corpus.get_biotools_tool(index, LINK_BASE)
+        if index % UNUSUAL_EVERY == 0:
+            tool['topic'].append({'term': u'Prote\xf3mica', 'uri': 'http://edamontology.org/topic_0121'})
+        if index % QUOTED_EVERY == 0:
+            tool['resourceType'].append(u"Researcher's tool")
+        tools.append(decode(tool))
+    return tools
+
+
+def get_getters(iannData, ckanData, registryData):
+    """
+        Get the getters benchmarked.
+        * {list} Return (name, source, function) tuples: each function is called with one record of the source, or
+            with one page of records if the source ends with PAGES_SUFFIX.
+    """
+    return [
+        ('(call overhead)', 'iann', lambda data: None),
+        ('iannData.get_one_field_from_iann_data[title]', 'iann', lambda data: iannData.get_one_field_from_iann_data(data, 'title')),
+        ('iannData.get_one_field_from_iann_data[field]', 'iann', lambda data: iannData.get_one_field_from_iann_data(data, 'field')),
+        ('iannData.remove_unicode_chars', 'iann_field', iannData.remove_unicode_chars),
+        ('iannData.get_field', 'iann', iannData.get_field),
+        ('iannData.get_creation_date_field', 'iann', iannData.get_creation_date_field),
+        ('iannData.get_iann_record', 'iann', iannData.get_iann_record),
+        ('iannData.transform_batch', 'iann'+PAGES_SUFFIX, iannData.transform_batch),
+        ('ckanData.get_field', 'ckan', ckanData.get_field),
+        ('ckanData.get_audience', 'ckan', ckanData.get_audience),
+        ('ckanData.get_created', 'ckan', ckanData.get_created),
+        ('ckanData.get_ckan_record', 'ckan', ckanData.get_ckan_record),
+        ('ckanData.transform_batch', 'ckan'+PAGES_SUFFIX, ckanData.transform_batch),
+        ('registryData.get_field', 'registry', registryData.get_field),
+        ('registryData.get_resource_type_field', 'registry', registryData.get_resource_type_field),
+        ('registryData.get_registry_record', 'registry', registryData.get_registry_record),
+        ('registryData.transform_batch', 'registry'+PAGES_SUFFIX, registryData.transform_batch)
+        ]
+
+
+def get_output_digest(outputs):
+    """
+        * outputs {list} outputs of one getter for the whole corpus.
+        * {string} Return a digest of the outputs, leaving out the insertion dates of records, which change in every run.
+    """
+    digest = hashlib.md5()
+    for output in outputs:
+        if isinstance(output, dict):
+            output = sorted([(key, value) for (key, value) in output.items() if key != 'insertion_date'])
+        digest.update(repr(output))
+    return digest.hexdigest()
+
+
+def get_pages(records):
+    """
+        * records {list} records of one corpus.
+        * {list} Return the records split into pages of PAGE_SIZE records.
+    """
+    return [records[start:start+PAGE_SIZE] for start in range(0, len(records), PAGE_SIZE)]
+
+
+def time_getter(function, inputs, repeat, records=None):
+    """
+        * function {function} getter.
+        * inputs {list} records, or pages of records, the getter is called with.
+        * repeat {int} number of passes over the records.
+        * records {int} number of records of the inputs, len(inputs) if it's None.
+        * {float} Return the nanoseconds per record of the fastest pass.
+    """
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for iteration in range(repeat):
+            start = timeit.default_timer()
+            for data in inputs:
+                function(data)
+            elapsed = timeit.default_timer()-start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best*1e9/(records or len(inputs))
+
+
+def run_micro_benchmark(records, repeat, name_filter=None):
+    """
+        Runs every getter over generated corpora.
+        * records {int} number of records of each corpus.
+        * repeat {int} number of passes over each corpus.
+        * name_filter {string} only getters whose name contains it are run, all if it's None.
+        * {dict} Return the 'ns_per_record' and 'digest' of the output of every getter, by name.
+    """
+    import iannData
+    import ckanData
+    import registryData
+    for module in [iannData, ckanData, registryData]:
+        module.init_logger()
+    iann_events = get_iann_events(records)
+    corpora = {
+        'iann': iann_events,
+        'iann_field': [format(event['field']) for event in iann_events],
+        'ckan': get_ckan_materials(records),
+        'registry': get_biotools_tools(records)
+        }
+    for source in ['iann', 'ckan', 'registry']:
+        corpora[source+PAGES_SUFFIX] = get_pages(corpora[source])
+    results = {}
+    for (name, source, function) in get_getters(iannData, ckanData, registryData):
+        if name_filter is not None and name_filter not in name:
+            continue
+        inputs = corpora[source]
+        # The first pass warms up caches, and its outputs tell if the getter still returns the same
+        outputs = [function(data) for data in inputs]
+        input_records = len(inputs)
+        if source.endswith(PAGES_SUFFIX):
+            input_records = sum([len(page) for page in inputs])
+            outputs = list(itertools.chain.from_iterable(outputs))
+        results[name] = {'ns_per_record': round(time_getter(function, inputs, repeat, input_records), 1),
+                         'digest': get_output_digest(outputs)}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+        Prints the results, compared with the baseline.
+        * results {dict} results of run_micro_benchmark.
+        * baseline {dict} results of a previous run, None if there isn't any.
+        * threshold {float} relative slowdown reported as a regression.
+        * {boolean} Return True if there is any regression or changed output.
+    """
+    failed = False
+    print '%-48s %12s %12s %9s' % ('getter', 'ns/record', 'baseline', 'change')
+    for name in sorted(results):
+        result = results[name]
+        line = '%-48s %12.1f' % (name, result['ns_per_record'])
+        previous = None
+        if baseline is not None:
+            previous = baseline.get(name)
+        if previous is None:
+            print line
+            continue
+        change = (result['ns_per_record']-previous['ns_per_record'])/previous['ns_per_record']
+        line = line+' %12.1f %+8.1f%%' % (previous['ns_per_record'], change*100)
+        if change > threshold and name != '(call overhead)':
+            line = line+'  REGRESSION'
+            failed = True
+        if result['digest'] != previous['digest']:
+            line = line+'  OUTPUT CHANGED'
+            failed = True
+        print line
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the getters of the importing scripts')
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS, help='number of records of each corpus')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='number of passes over each corpus')
+    parser.add_argument('--filter', help='only getters whose name contains this text are run')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file with the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='stores the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown reported as a regression, e.g. 0.25 for 25%%')
+    args = parser.parse_args()
+    baseline_path = os.path.abspath(args.baseline)
+
+    root = run_benchmark.enter_sandbox()
+    try:
+        results = run_micro_benchmark(args.records, args.repeat, args.filter)
+    finally:
+        run_benchmark.leave_sandbox(root)
+
+    baseline = None
+    if os.path.isfile(baseline_path):
+        with open(baseline_path) as baseline_file:
+            stored_baseline = json.load(baseline_file)
+        if stored_baseline.get('records') == args.records:
+            baseline = stored_baseline['results']
+        else:
+            print 'Baseline of '+str(stored_baseline.get('records'))+' records, not comparable'
+    failed = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        if not os.path.isdir(os.path.dirname(baseline_path)):
+            os.makedirs(os.path.dirname(baseline_path))
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump({'revision': run_benchmark.get_revision(), 'python': platform.python_version(),
+                       'platform': platform.platform(), 'date': datetime.now().isoformat(), 'records': args.records,
+                       'results': results}, baseline_file, indent=2, sort_keys=True)
+        print 'Baseline stored in '+baseline_path
+    elif failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+"""
+    End-to-end benchmark of the importing scripts. Each one runs a full import (main_options) of synthetic corpora
+    served by local stand-in upstreams (fake_upstreams.py) into an in-memory DB (memory_db.py), so neither the live
+    services nor a database are needed. For every source and corpus size it reports:
+        throughput          records inserted per second
+        stage latencies     p50, p99 and maximum of every stage of the importing pipeline, from the metrics of the run
+        link checks         p50, p99 and maximum time spent checking each link, if any
+        peak RSS            peak resident memory of the process that ran the import
+    Latencies and faults can be injected in the upstreams with --faults, see faults.py.
+
+    Every import runs in its own process, with its own state, cache and log directories, so they don't share
+    caches or memory peaks. Usage:
+        python run_benchmark.py [--sources iann,ckan,registry] [--sizes 1000,10000,100000]
+                                [--options '{"queue_size": 4}'] [--output results.json] [--compare baseline.json]
+                                [--faults faults.json] [--seed 1]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+import corpus
+
+
+BENCH_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(BENCH_DIRECTORY)
+
+"""
+    Importing scripts benchmarked, by source token: (module, attribute with the url of the upstream, path of the
+    upstream in fake_upstreams.py).
+"""
+SOURCES = {
+    'iann': ('iannData', 'IANN_SOLR_URL', 'solr/'),
+    'ckan': ('ckanData', 'TESS_API_URL', 'api/3/action/'),
+    'registry': ('registryData', 'BIOTOOLS_API_URL', 'api/tool')
+    }
+DEFAULT_SOURCES = ['iann', 'ckan', 'registry']
+
+# Dataset of the in-memory DB where records are inserted
+BENCH_DS_NAME = 'benchmark'
+
+# Prefix of the lines with the results of one import in the output of its process
+RESULT_PREFIX = 'BENCHMARK RESULT '
+
+
+def create_sandbox():
+    """
+        Creates the directories where one import runs, with the same layout as a deployment: the working directory
+        is <root>/work/specific, so the relative paths of the scripts (logs, DB abstraction...) are inside <root>.
+        * {tuple} Return (root, working directory).
+    """
+    root = tempfile.mkdtemp(prefix='import-benchmark-')
+    work_directory = os.path.join(root, 'work', 'specific')
+    os.makedirs(work_directory)
+    os.makedirs(os.path.join(root, 'resource-contextualization-logs'))
+    # db_managers imports DBFactory from this directory
+    db_directory = os.path.join(root, 'resource-contextualization-import-db', 'abstraction')
+    os.makedirs(db_directory)
+    with open(os.path.join(db_directory, 'DB_Factory.py'), 'w') as factory_file:
+        factory_file.write('from memory_db import DBFactory\n')
+    with open(os.path.join(work_directory, 'ConfigFile.properties'), 'w') as config_file:
+        config_file.write('[CacheSection]\nurl_cache.directory='+os.path.join(root, 'cache')+'\n\n'
+                          '[StateSection]\nstate.directory='+os.path.join(root, 'state')+'\n\n'
+                          '[MetricsSection]\nmetrics.format=none\n')
+    return (root, work_directory)
+
+
+def enter_sandbox():
+    """
+        Creates a sandbox with create_sandbox, and moves this process into it so the importing scripts and the utils
+        can be imported. The working directory is changed, so it has to be called in a process of its own.
+        * {string} Return the root of the sandbox, to be removed at the end.
+    """
+    (root, work_directory) = create_sandbox()
+    os.chdir(work_directory)
+    sys.path.insert(0, BENCH_DIRECTORY)
+    sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, 'util'))
+    sys.path.insert(0, os.path.join(REPOSITORY_DIRECTORY, 'specific'))
+    return root
+
+
+def leave_sandbox(root):
+    """
+        Moves this process out of a sandbox created by enter_sandbox, and removes it.
+        * root {string} root of the sandbox.
+    """
+    os.chdir(BENCH_DIRECTORY)
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def get_latencies(summary):
+    """
+        * summary {dict} summary of one histogram, as returned by metrics.Histogram.get_summary.
+        * {dict} Return its 'count', and its 'p50', 'p99' and 'max' seconds.
+    """
+    return {'count': summary['count'], 'p50': summary['p50'], 'p99': summary['p99'], 'max': summary['max']}
+
+
+def get_stage_latencies(snapshot):
+    """
+        * snapshot {dict} metrics of one import, as returned by metrics.get_snapshot.
+        * {dict} Return the latencies of every stage of the importing pipeline, as get_latencies does.
+    """
+    stages = {}
+    for (name, summary) in snapshot['histograms'].items():
+        if name.startswith('stage_') and name.endswith('_seconds'):
+            stages[name[len('stage_'):-len('_seconds')]] = get_latencies(summary)
+    return stages
+
+
+def run_import(source, size, base_url, options):
+    """
+        Runs one import in this process. It changes the working directory, so it has to run in its own process.
+        * source {string} source token, one of SOURCES.
+        * size {int} number of records of the corpus.
+        * base_url {string} url of the stand-in upstreams.
+        * options {dict} options of main_options, added to the ones of a full import.
+        * {dict} Return the results of the import.
+    """
+    root = enter_sandbox()
+    try:
+        (module_name, url_attribute, upstream_path) = SOURCES[source]
+        module = __import__(module_name)
+        import metrics
+        import memory_db
+        setattr(module, url_attribute, base_url+str(size)+'/'+upstream_path)
+
+        my_options = {'ds_name': BENCH_DS_NAME, 'delete_all_old_data': True, 'updateRegistries': True}
+        my_options.update(options)
+        start_time = time.time()
+        records = module.main_options(my_options)
+        seconds = time.time()-start_time
+
+        snapshot = metrics.get_snapshot()
+        return {
+            'source': source,
+            'size': size,
+            'records': records,
+            'stored': len(memory_db.get_manager(BENCH_DS_NAME).records),
+            'seconds': round(seconds, 3),
+            'records_per_second': round((records or 0)/seconds, 1),
+            'stages': get_stage_latencies(snapshot),
+            'link_checks': get_latencies(snapshot['histograms']['link_check_seconds'])
+                if 'link_check_seconds' in snapshot['histograms'] else None,
+            'links_available': snapshot['counters'].get('links_available', 0),
+            'http_requests': snapshot['counters'].get('http_requests', 0),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            }
+    finally:
+        leave_sandbox(root)
+
+
+def run_import_process(source, size, base_url, options, log_path):
+    """
+        Runs one import in a new process.
+        * {dict} Return the results of the import, None if it failed.
+    """
+    with open(log_path, 'a') as log_file:
+        import_process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--single', source, str(size),
+                                           '--base-url', base_url, '--options', json.dumps(options)],
+                                          stdout=subprocess.PIPE, stderr=log_file, cwd=BENCH_DIRECTORY)
+        (output, error) = import_process.communicate()
+    for line in output.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return None
+
+
+def format_seconds(seconds):
+    """
+        * {string} Return a latency in milliseconds, '-' if it's unknown.
+    """
+    if seconds is None:
+        return '-'
+    return str(round(seconds*1000, 1))+'ms'
+
+
+def print_result(result, baseline=None):
+    """
+        Prints the results of one import, compared with the same import of a baseline if there is one.
+        * result {dict} results of the import, as returned by run_import.
+        * baseline {dict} results of the same import in a previous benchmark, if any.
+    """
+    line = '%-9s %8d records  %8.2f s  %9.1f records/s  peak RSS %7.1f MB  %6d requests' % (
+        result['source'], result['records'] or 0, result['seconds'], result['records_per_second'],
+        result['peak_rss_kb']/1024.0, result['http_requests'])
+    if baseline is not None and baseline['records_per_second'] > 0:
+        change = 100.0*(result['records_per_second']-baseline['records_per_second'])/baseline['records_per_second']
+        line = line+'  (%+.1f%% throughput, %+.1f MB peak RSS)' % (change, (result['peak_rss_kb']-baseline['peak_rss_kb'])/1024.0)
+    print line
+    if result['stored'] != result['size']:
+        print '    WARNING: '+str(result['stored'])+' records stored, '+str(result['size'])+' expected'
+    for stage_name in sorted(result['stages']):
+        stage = result['stages'][stage_name]
+        print '    stage %-10s %7d calls  p50 %10s  p99 %10s  max %10s' % (
+            stage_name, stage['count'], format_seconds(stage['p50']), format_seconds(stage['p99']), format_seconds(stage['max']))
+    if result.get('link_checks') is not None:
+        link_checks = result['link_checks']
+        print '    %-16s %7d calls  p50 %10s  p99 %10s  max %10s  (%d available)' % (
+            'link checks', link_checks['count'], format_seconds(link_checks['p50']), format_seconds(link_checks['p99']),
+            format_seconds(link_checks['max']), result['links_available'])
+    sys.stdout.flush()
+
+
+def run_benchmark(sources, sizes, options, log_path, baseline_results=None, faults=None, seed=None):
+    """
+        Runs the imports of every source and corpus size against the stand-in upstreams, printing their results.
+        * sources {list} source tokens.
+        * sizes {list} numbers of records of the corpora.
+        * options {dict} options of main_options, added to the ones of a full import.
+        * log_path {string} file where the logs of the imports are written.
+        * baseline_results {list} results of a previous benchmark, to compare with.
+        * faults {string} faults injected in the upstreams: JSON object or path of a file with it, see faults.py.
+        * seed {int} seed of the random faults.
+        * {list} Return the results of every import.
+    """
+    upstreams_arguments = [sys.executable, os.path.join(BENCH_DIRECTORY, 'fake_upstreams.py')]
+    if faults is not None:
+        upstreams_arguments.extend(['--faults', faults])
+    if seed is not None:
+        upstreams_arguments.extend(['--seed', str(seed)])
+    upstreams_process = subprocess.Popen(upstreams_arguments, stdout=subprocess.PIPE, cwd=BENCH_DIRECTORY)
+    results = []
+    try:
+        base_url = upstreams_process.stdout.readline().strip()
+        for size in sizes:
+            for source in sources:
+                result = run_import_process(source, size, base_url, options, log_path)
+                if result is None:
+                    print '%-9s %8d records  FAILED, see %s' % (source, size, log_path)
+                    continue
+                baseline = None
+                for baseline_result in baseline_results or []:
+                    if baseline_result['source'] == source and baseline_result['size'] == size:
+                        baseline = baseline_result
+                print_result(result, baseline)
+                results.append(result)
+    finally:
+        upstreams_process.terminate()
+        upstreams_process.wait()
+    return results
+
+
+def get_revision():
+    """
+        * {string} Return the git commit of the benchmarked scripts, None if it's unknown.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIRECTORY).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of the importing scripts')
+    parser.add_argument('--sources', default=','.join(DEFAULT_SOURCES), help='comma separated sources to benchmark')
+    parser.add_argument('--sizes', default=','.join([str(size) for size in corpus.DEFAULT_SIZES]),
+                        help='comma separated numbers of records of the corpora')
+    parser.add_argument('--options', default='{}', help='JSON options of main_options, e.g. {"queue_size": 4}')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--compare', help='JSON file with the results of a previous benchmark')
+    parser.add_argument('--log', default=os.devnull, help='file where the logs of the imports are written')
+    parser.add_argument('--faults', help='JSON object with the faults injected in the upstreams, or path of a file with it')
+    parser.add_argument('--seed', type=int, help='seed of the random faults')
+    parser.add_argument('--single', nargs=2, metavar=('SOURCE', 'SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    options = json.loads(args.options)
+
+    if args.single is not None:
+        result = run_import(args.single[0], int(args.single[1]), args.base_url, options)
+        print RESULT_PREFIX+json.dumps(result)
+        return
+
+    sources = [source.strip() for source in args.sources.split(',') if source.strip()]
+    for source in sources:
+        if source not in SOURCES:
+            parser.error('unknown source '+source+', use some of '+', '.join(DEFAULT_SOURCES))
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    baseline_results = None
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline_results = json.load(baseline_file)['results']
+
+    faults = args.faults
+    if faults is not None and not faults.strip().startswith('{'):
+        faults = os.path.abspath(faults)
+    results = run_benchmark(sources, sizes, options, os.path.abspath(args.log), baseline_results, faults, args.seed)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump({'revision': get_revision(), 'python': platform.python_version(), 'options': options,
+                       'faults': args.faults, 'date': datetime.now().isoformat(), 'results': results},
+                      output_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
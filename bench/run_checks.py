@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+"""
+    Checks of the behaviour of the importing scripts that the benchmark can't show by itself, run against the
+    stand-in upstreams (fake_upstreams.py) and the in-memory DB (memory_db.py) as run_benchmark.py does:
+        iann_incremental_checkpoint     incremental iAnn runs don't insert again events submitted more than once
+        ckan_incremental_checkpoint     incremental CKAN runs get the training materials modified since the last one
+        profiled_import                 profiles of imports include the work done by the threads of the pipeline
+        registry_failed_page            reconciling runs whose fetch fails halfway don't delete any record
+        registry_failed_staged_page     staged runs whose fetch fails halfway are not promoted
+        registry_resumed_reconcile      resumed reconciling runs don't delete the records of the pages they skip
+    Every check runs in its own process and sandbox. Usage:
+        python run_checks.py [--checks iann_incremental_checkpoint,registry_failed_page] [--log checks.log]
+    It exits with status 1 if any check fails.
+"""
+
+import os
+import sys
+import json
+import argparse
+import pstats
+import subprocess
+from datetime import timedelta
+
+import corpus
+import run_benchmark
+
+
+# Prefix of the lines with the result of one check in the output of its process
+RESULT_PREFIX = 'CHECK RESULT '
+
+
+def import_source(source, size, base_url):
+    """
+        Imports the importing script of one source, reading the corpus of one size from the stand-in upstreams.
+        * source {string} source token, one of run_benchmark.SOURCES.
+        * size {int} number of records of the corpus.
+        * base_url {string} url of the stand-in upstreams.
+        * {module} Return the module of the importing script.
+    """
+    (module_name, url_attribute, upstream_path) = run_benchmark.SOURCES[source]
+    module = __import__(module_name)
+    setattr(module, url_attribute, base_url+str(size)+'/'+upstream_path)
+    return module
+
+
+def check_iann_incremental_checkpoint(base_url):
+    """
+        Runs a full iAnn import with checkpoint, and then two incremental ones. Some events of the corpus were
+        submitted again after the first submission of the newest one (corpus.RESUBMITTED_EVERY), and Solr keeps
+        matching them, so the incremental runs must skip them as already ingested.
+        * base_url {string} url of the stand-in upstreams.
+        * {tuple} Return (passed, message).
+    """
+    size = 1000
+    module = import_source('iann', size, base_url)
+    import memory_db
+    options = {'ds_name': run_benchmark.BENCH_DS_NAME, 'updateRegistries': True, 'use_checkpoint': True}
+
+    full_options = dict(options)
+    full_options['delete_all_old_data'] = True
+    inserted = [module.main_options(full_options)]
+    for run in range(2):
+        inserted.append(module.main_options(dict(options)))
+    stored = len(memory_db.get_manager(run_benchmark.BENCH_DS_NAME).records)
+    message = 'inserted %s records in each run, %d stored' % (inserted, stored)
+    return (inserted == [size, 0, 0] and stored == size, message)
+
+
+def check_ckan_incremental_checkpoint(base_url):
+    """
+        Runs a full CKAN import with checkpoint, and then an incremental one in which some old training materials
+        were modified after the checkpoint. They must be inserted again, although they were created before it.
+        * base_url {string} url of the stand-in upstreams.
+        * {tuple} Return (passed, message).
+    """
+    size = 1000
+    module = import_source('ckan', size, base_url)
+    options = {'ds_name': run_benchmark.BENCH_DS_NAME, 'updateRegistries': True, 'use_checkpoint': True}
+
+    full_options = dict(options)
+    full_options['delete_all_old_data'] = True
+    inserted = [module.main_options(full_options)]
+    # Newer than the modification date of every training material of the corpus
+    modified = (corpus.get_date(size)+timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%S.%f')
+    modified_names = set([corpus.get_material_name(index) for index in range(10)])
+    get_materials_offset_pages = module.get_materials_offset_pages
+    def get_modified_materials_pages(*args):
+        for (start, materials) in get_materials_offset_pages(*args):
+            for material in materials:
+                if material['result']['name'] in modified_names:
+                    material['result']['metadata_modified'] = modified
+            yield (start, materials)
+    module.get_materials_offset_pages = get_modified_materials_pages
+    inserted.append(module.main_options(dict(options)))
+    return (inserted == [size, len(modified_names)], 'inserted %s records in each run' % inserted)
+
+
+def check_profiled_import(base_url):
+    """
+        Runs an iAnn import profiled as the synchronizer does. Events are transformed and inserted by the threads
+        of the importing pipeline, so its profile must include transform_batch and insert_data.
+        * base_url {string} url of the stand-in upstreams.
+        * {tuple} Return (passed, message).
+    """
+    size = 1000
+    module = import_source('iann', size, base_url)
+    import profiling
+    options = {'ds_name': run_benchmark.BENCH_DS_NAME, 'delete_all_old_data': True, 'updateRegistries': True}
+
+    profiler = profiling.JobProfiler(module.__name__+'.main_options', profiling.DEFAULT_PROFILES_DIRECTORY)
+    profiler.start()
+    try:
+        module.main_options(options)
+    finally:
+        report = profiler.stop()
+    pstats_files = [path for path in report['files'] if path.endswith('.pstats')]
+    if len(pstats_files) == 0:
+        return (False, 'no .pstats file written')
+    function_names = set([function[2] for function in pstats.Stats(pstats_files[0]).stats.keys()])
+    missing = [name for name in ['transform_batch', 'insert_data'] if name not in function_names]
+    if len(missing) > 0:
+        return (False, 'functions missing from the profile: '+', '.join(missing))
+    return (True, 'transform_batch and insert_data profiled')
+
+
+def check_registry_failed_page(base_url):
+    """
+        Runs a full bio.tools import with reconcile, as mainFullUpdating does, and then another one whose page 13
+        can't be got. The second fetch is incomplete, so the registries of the pages after it must not be deleted.
+        * base_url {string} url of the stand-in upstreams.
+        * {tuple} Return (passed, message).
+    """
+    size = 1000
+    module = import_source('registry', size, base_url)
+    import memory_db
+    options = {'ds_name': run_benchmark.BENCH_DS_NAME, 'updateRegistries': True, 'reconcile': True}
+
+    module.main_options(dict(options))
+    stored = [len(memory_db.get_manager(run_benchmark.BENCH_DS_NAME).records)]
+    get_records_page = module.get_records_page
+    module.get_records_page = lambda page: None if page == 13 else get_records_page(page)
+    module.main_options(dict(options))
+    stored.append(len(memory_db.get_manager(run_benchmark.BENCH_DS_NAME).records))
+    return (stored == [size, size], 'stored %s records after each run' % stored)
+
+
+def check_registry_failed_staged_page(base_url):
+    """
+        Runs a full bio.tools import, and then a staged one whose page 13 can't be got, as mainStagedFullUpdating
+        does. The staged fetch is incomplete, so it must not be promoted, whatever the number of records staged.
+        * base_url {string} url of the stand-in upstreams.
+        * {tuple} Return (passed, message).
+    """
+    size = 1000
+    module = import_source('registry', size, base_url)
+    import memory_db
+    options = {'ds_name': run_benchmark.BENCH_DS_NAME, 'updateRegistries': True, 'reconcile': True}
+
+    module.main_options(dict(options))
+    get_records_page = module.get_records_page
+    module.get_records_page = lambda page: None if page == 13 else get_records_page(page)
+    staged_options = {'ds_name': run_benchmark.BENCH_DS_NAME, 'updateRegistries': True, 'staging_ds_name': 'staging'}
+    module.main_options(staged_options)
+    live = len(memory_db.get_manager(run_benchmark.BENCH_DS_NAME).records)
+    staged = len(memory_db.get_manager('staging').records)
+    return (live == size, '%d live records, %d staged records kept' % (live, staged))
+
+
+class RunKilled(Exception):
+    """
+        Raised to stop an import halfway, as if its process had died.
+    """
+    pass
+
+
+def check_registry_resumed_reconcile(base_url):
+    """
+        Runs a full bio.tools import with reconcile, then another one that dies at page 10, and then resumes it.
+        The resumed run skips the pages loaded before, whose registries were unchanged and so never committed, and
+        it must not delete them as missing.
+        * base_url {string} url of the stand-in upstreams.
+        * {tuple} Return (passed, message).
+    """
+    size = 1000
+    module = import_source('registry', size, base_url)
+    import memory_db
+    options = {'ds_name': run_benchmark.BENCH_DS_NAME, 'updateRegistries': True, 'reconcile': True, 'resume': True}
+
+    module.main_options(dict(options))
+    load_page = module.RegistrySource.load_page
+    def load_page_until_killed(source, page):
+        if page[0] == 10:
+            raise RunKilled()
+        return load_page(source, page)
+    module.RegistrySource.load_page = load_page_until_killed
+    try:
+        module.main_options(dict(options))
+    except RunKilled:
+        pass
+    module.RegistrySource.load_page = load_page
+    module.main_options(dict(options))
+    stored = len(memory_db.get_manager(run_benchmark.BENCH_DS_NAME).records)
+    return (stored == size, '%d records stored after the resumed run' % stored)
+
+
+"""
+    Checks, by name.
+"""
+CHECKS = {
+    'ckan_incremental_checkpoint': check_ckan_incremental_checkpoint,
+    'iann_incremental_checkpoint': check_iann_incremental_checkpoint,
+    'profiled_import': check_profiled_import,
+    'registry_failed_page': check_registry_failed_page,
+    'registry_failed_staged_page': check_registry_failed_staged_page,
+    'registry_resumed_reconcile': check_registry_resumed_reconcile
+    }
+
+
+def run_check(name, base_url):
+    """
+        Runs one check in this process, in a sandbox of its own. It changes the working directory, so it has to run
+        in its own process.
+        * name {string} name of the check, one of CHECKS.
+        * base_url {string} url of the stand-in upstreams.
+        * {tuple} Return (passed, message).
+    """
+    root = run_benchmark.enter_sandbox()
+    try:
+        return CHECKS[name](base_url)
+    finally:
+        run_benchmark.leave_sandbox(root)
+
+
+def run_check_process(name, base_url, log_path):
+    """
+        Runs one check in a new process.
+        * {tuple} Return (passed, message). The check fails if its process dies.
+    """
+    with open(log_path, 'a') as log_file:
+        check_process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--single', name,
+                                          '--base-url', base_url],
+                                         stdout=subprocess.PIPE, stderr=log_file, cwd=run_benchmark.BENCH_DIRECTORY)
+        (output, error) = check_process.communicate()
+    for line in output.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return tuple(json.loads(line[len(RESULT_PREFIX):]))
+    return (False, 'the check died, see '+log_path)
+
+
+def run_checks(names, log_path):
+    """
+        Runs some checks against the stand-in upstreams, printing their results.
+        * names {list} names of the checks.
+        * log_path {string} file where the logs of the imports are written.
+        * {boolean} Return True if all of them passed.
+    """
+    upstreams_process = subprocess.Popen([sys.executable, os.path.join(run_benchmark.BENCH_DIRECTORY, 'fake_upstreams.py')],
+                                         stdout=subprocess.PIPE, cwd=run_benchmark.BENCH_DIRECTORY)
+    all_passed = True
+    try:
+        base_url = upstreams_process.stdout.readline().strip()
+        for name in names:
+            (passed, message) = run_check_process(name, base_url, log_path)
+            print '%-30s %s  %s' % (name, 'OK    ' if passed else 'FAILED', message)
+            all_passed = all_passed and passed
+    finally:
+        upstreams_process.terminate()
+        upstreams_process.wait()
+    return all_passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks of the importing scripts against the stand-in upstreams')
+    parser.add_argument('--checks', default=','.join(sorted(CHECKS.keys())), help='comma separated checks to run')
+    parser.add_argument('--log', default=os.devnull, help='file where the logs of the imports are written')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print RESULT_PREFIX+json.dumps(run_check(args.single, args.base_url))
+        return
+
+    names = [name.strip() for name in args.checks.split(',') if name.strip()]
+    for name in names:
+        if name not in CHECKS:
+            parser.error('unknown check '+name+', use some of '+', '.join(sorted(CHECKS.keys())))
+    if not run_checks(names, os.path.abspath(args.log)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+    Runs the benchmark of run_benchmark.py under the faults of some scenarios, to see how the total run time and the
+    memory of the importing scripts scale when the upstreams are slow or flaky. Scenarios are JSON files, see the
+    ones in the 'scenarios' folder:
+        description     what the scenario simulates
+        sources         sources to import
+        sizes           numbers of records of the corpora, to see how the results scale with them
+        options         options of main_options, added to the ones of a full import
+        faults          faults injected in the upstreams, see faults.py
+        seed            seed of the random faults, so runs are repeatable
+    Usage:
+        python run_scenarios.py [scenarios/link_timeouts.json ...] [--output-directory results] [--log scenarios.log]
+    All the scenarios of the 'scenarios' folder are run if none is given.
+"""
+
+import os
+import glob
+import json
+import argparse
+
+import run_benchmark
+
+
+SCENARIOS_DIRECTORY = os.path.join(run_benchmark.BENCH_DIRECTORY, 'scenarios')
+
+
+def print_scaling(results):
+    """
+        Prints how the run time and the peak memory of every source grow with the size of the corpus: a time ratio
+        equal to the size ratio means the run time grows linearly.
+        * results {list} results of the imports of one scenario, as returned by run_benchmark.run_benchmark.
+    """
+    sources = []
+    for result in results:
+        if result['source'] not in sources:
+            sources.append(result['source'])
+    for source in sources:
+        source_results = sorted([result for result in results if result['source'] == source], key=lambda result: result['size'])
+        line = '  %-9s' % source
+        for (previous, result) in zip(source_results, source_results[1:]):
+            line = line+'  %dx records: %.2fx time, %+.1f MB peak RSS' % (
+                result['size']/previous['size'], result['seconds']/max(previous['seconds'], 0.001),
+                (result['peak_rss_kb']-previous['peak_rss_kb'])/1024.0)
+        not_stored = ['%d of %d stored' % (result['stored'], result['size']) for result in source_results if result['stored'] != result['size']]
+        if len(not_stored) > 0:
+            line = line+'  (records not stored: '+', '.join(not_stored)+')'
+        print line
+
+
+def run_scenario(path, log_path, output_directory=None):
+    """
+        Runs the benchmark under the faults of one scenario.
+        * path {string} path of the scenario file.
+        * log_path {string} file where the logs of the imports are written.
+        * output_directory {string} directory where the results are written as <scenario>.json, if any.
+        * {list} Return the results of every import.
+    """
+    with open(path) as scenario_file:
+        scenario = json.load(scenario_file)
+    name = os.path.splitext(os.path.basename(path))[0]
+    print '== '+name+': '+scenario.get('description', '')
+    results = run_benchmark.run_benchmark(scenario.get('sources', run_benchmark.DEFAULT_SOURCES), scenario['sizes'],
+                                          scenario.get('options', {}), log_path,
+                                          faults=json.dumps(scenario.get('faults', {})), seed=scenario.get('seed'))
+    print 'Scaling:'
+    print_scaling(results)
+    print
+    if output_directory is not None:
+        if not os.path.isdir(output_directory):
+            os.makedirs(output_directory)
+        with open(os.path.join(output_directory, name+'.json'), 'w') as output_file:
+            json.dump({'revision': run_benchmark.get_revision(), 'scenario': scenario, 'results': results},
+                      output_file, indent=2, sort_keys=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the importing scripts under slow or flaky upstreams')
+    parser.add_argument('scenarios', nargs='*', help='scenario files, all the ones of the scenarios folder by default')
+    parser.add_argument('--output-directory', help='directory where the results of every scenario are written')
+    parser.add_argument('--log', default=os.devnull, help='file where the logs of the imports are written')
+    args = parser.parse_args()
+    scenarios = args.scenarios or sorted(glob.glob(os.path.join(SCENARIOS_DIRECTORY, '*.json')))
+    for path in scenarios:
+        run_scenario(path, os.path.abspath(args.log), args.output_directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,17 +9,65 @@
 # See CRON documentation at : http://apscheduler.readthedocs.org/en/latest/modules/triggers/cron.html
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 
 import multiprocessing as mp
 import time
 import logging
 import sys
+import threading
+import traceback
 from datetime import datetime, timedelta, date
 from logging.handlers import TimedRotatingFileHandler
 
+import ConfigParser
 
-MAX_THREADS = min(2, mp.cpu_count()) 
 
+# Default number of worker processes. It can be configured with 'synchronizer.max_threads' in the
+# 'SynchronizerSection' of ConfigFile.properties
+DEFAULT_MAX_THREADS = min(2, mp.cpu_count())
+
+def get_max_threads():
+    """
+        Get the number of worker processes that execute the importing scripts.
+        * {int} Return the configured number, or DEFAULT_MAX_THREADS if it isn't configured.
+    """
+    config = ConfigParser.RawConfigParser()
+    config.read('ConfigFile.properties')
+    if config.has_option('SynchronizerSection', 'synchronizer.max_threads'):
+        return max(1, config.getint('SynchronizerSection', 'synchronizer.max_threads'))
+    return DEFAULT_MAX_THREADS
+
+MAX_THREADS = get_max_threads()
+
+# A warning is logged when a job lasts more than this share of the time between two of its executions. It can be
+# configured with 'synchronizer.overrun_warning_ratio' in the 'SynchronizerSection' of ConfigFile.properties
+DEFAULT_OVERRUN_WARNING_RATIO = 0.8
+
+def get_overrun_warning_ratio():
+    """
+        Get the share of the interval of a job that it can last before a warning is logged.
+        * {float} Return the configured ratio, or DEFAULT_OVERRUN_WARNING_RATIO if it isn't configured.
+    """
+    config = ConfigParser.RawConfigParser()
+    config.read('ConfigFile.properties')
+    if config.has_option('SynchronizerSection', 'synchronizer.overrun_warning_ratio'):
+        return config.getfloat('SynchronizerSection', 'synchronizer.overrun_warning_ratio')
+    return DEFAULT_OVERRUN_WARNING_RATIO
+
+OVERRUN_WARNING_RATIO = get_overrun_warning_ratio()
+
+# Worker processes are kept alive between executions, so they are created only once
+worker_pool = None
+worker_pool_lock = threading.Lock()
+
+
+# Importing utils
+sys.path.insert(0, '../util')
+import http_client
+import db_managers
+import job_history
+import profiling
 
 # Importing specific scripts
 sys.path.insert(0, '../specific')
@@ -32,17 +80,20 @@ import registryData
 # Functions to be executed every hour for partial updatings
 #UPDATING_1H_PROCESSES = [iannData.mainUpdating,ckanData.mainUpdating]
 UPDATING_1H_PROCESSES = [iannData.mainUpdating]
+UPDATING_1H_INTERVAL = 60*60
 def getPastHour():
     return datetime.now()-timedelta(hours=1)
     
 # Functions to be executed every day for full updatings
 FULL_UPDATING_1D_PROCESSES = [registryData.mainFullUpdating]
+FULL_UPDATING_1D_INTERVAL = 24*60*60
 def getPastDay():  # For now this function is not being used because of the full updating
     return datetime.now()-timedelta(days=1)
 
 # Functions to be executed every week for full updatings
 FULL_UPDATING_1W_PROCESSES = [iannData.mainFullUpdating]
 # FULL_UPDATING_1W_PROCESSES = [iannData.mainFullUpdating, ckanData.mainFullUpdating]
+FULL_UPDATING_1W_INTERVAL = 7*24*60*60
 def getPastWeek(): # For now this function is not being used because of the full updating
     return datetime.now()-timedelta(days=7)
  
@@ -80,37 +131,227 @@ def init_logger():
 
 
 
+def init_worker():
+    """
+        Initialises each worker process once, when the pool is created: it opens the HTTP session and the DB manager
+        of the default dataset, which are reused by all the scripts executed by the process.
+    """
+    init_logger()
+    init_start = time.time()
+    try:
+        http_client.get_session()
+        db_managers.get_db_manager(None)
+    except Exception as e:
+        # Scripts will try it again when they need them
+        logger.error('Exception initialising worker process')
+        logger.error(e)
+    logger.info('SYNCHRONIZING PROCESS... worker process initialised in '+str(round(time.time()-init_start, 3))+' s')
+
+
+def get_worker_pool():
+    """
+        Get the pool of worker processes, creating it the first time.
+        * {tuple} Return (pool, created): the pool, and True if it has just been created.
+    """
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is None:
+            worker_pool = mp.Pool(MAX_THREADS, initializer=init_worker)
+            return (worker_pool, True)
+        return (worker_pool, False)
+
+
+def close_worker_pool():
+    """
+        Waits for the scripts being executed and stops the worker processes.
+    """
+    global worker_pool
+    with worker_pool_lock:
+        if worker_pool is not None:
+            worker_pool.close()
+            worker_pool.join()
+            worker_pool = None
+
+
+def get_process_name(process):
+    """
+        * process {function} specific script.
+        * {string} Return the name of the script, with its module.
+    """
+    return str(getattr(process, '__module__', None))+'.'+str(getattr(process, '__name__', process))
+
+
+def run_process(process, args, submitted_time, profile_directory=None):
+    """
+        Executes one specific script in a worker process. Exceptions are caught here, so they are reported
+        to the synchronizer instead of being lost in the pool.
+        * process {function} script to be executed.
+        * args {list} arguments of the script.
+        * submitted_time {float} time when the script was sent to the pool.
+        * profile_directory {string} directory where the profile of the script is written, None to not profile it.
+        * {dict} Return the outcome of the execution:
+            'job' {string} name of the script;
+            'start', 'end' {string} times when the script started and finished;
+            'duration' {float} seconds the script lasted;
+            'wait' {float} seconds the script waited in the pool before starting;
+            'records' {int} number of registries inserted, None if unknown or the script was skipped;
+            'error' {string} exception raised by the script, None if there wasn't any;
+            'profile' {dict} report of the profile, as returned by JobProfiler.stop, only if it was profiled.
+    """
+    profiler = None
+    if profile_directory is not None:
+        profiler = profiling.JobProfiler(get_process_name(process), profile_directory)
+        profiler.start()
+    start_time = time.time()
+    records = None
+    error = None
+    try:
+        records = process(*args)
+    except Exception:
+        error = traceback.format_exc()
+    end_time = time.time()
+    outcome = {
+        'job': get_process_name(process),
+        'start': datetime.fromtimestamp(start_time).isoformat(),
+        'end': datetime.fromtimestamp(end_time).isoformat(),
+        'duration': round(end_time-start_time, 3),
+        'wait': round(start_time-submitted_time, 3),
+        'records': records,
+        'error': error
+        }
+    if profiler is not None:
+        outcome['profile'] = profiler.stop()
+    return outcome
+
+
+def report_profile(outcome):
+    """
+        Reports the overhead of profiling one execution of a specific script: the time spent writing its profile,
+        and how much longer it lasted than its last executions without profiling.
+        * outcome {dict} outcome of the profiled execution, as returned by run_process.
+    """
+    profile = outcome['profile']
+    message = ('SYNCHRONIZING PROCESS... '+outcome['job']+' profiled into '+', '.join(profile['files'])+': '
+               +str(profile['overhead'])+' s writing the profile, peak memory '+str(profile['max_rss_kb'])+' KB')
+    unprofiled_durations = [entry['duration'] for entry in job_history.read_history(outcome['job'])
+                            if 'profile' not in entry and entry.get('error') is None][-10:]
+    if len(unprofiled_durations) > 0 and outcome['error'] is None:
+        mean_duration = sum(unprofiled_durations)/len(unprofiled_durations)
+        message = (message+', '+str(round(outcome['duration']-mean_duration, 3))+' s longer than the mean of its last '
+                   +str(len(unprofiled_durations))+' executions without profiling')
+    logger.info(message)
+
+
+def record_outcome(outcome, interval=None):
+    """
+        Reports the outcome of one execution of a specific script, and keeps it in the job history.
+        * outcome {dict} outcome of the execution, as returned by run_process.
+        * interval {int} seconds between two executions of the script, if it's scheduled.
+    """
+    if outcome['error'] is not None:
+        logger.error('SYNCHRONIZING PROCESS... '+outcome['job']+' failed after '+str(outcome['duration'])+' s: '+outcome['error'])
+    else:
+        logger.info('SYNCHRONIZING PROCESS... '+outcome['job']+' finished in '+str(outcome['duration'])+' s, '
+                    +str(outcome['records'])+' registries inserted')
+    if interval is not None and outcome['duration'] > OVERRUN_WARNING_RATIO*interval:
+        logger.warning('SYNCHRONIZING PROCESS... '+outcome['job']+' lasted '+str(outcome['duration'])+' s, more than '
+                       +str(int(OVERRUN_WARNING_RATIO*100))+'% of the '+str(interval)+' s between two of its executions')
+    if 'profile' in outcome:
+        try:
+            report_profile(outcome)
+        except Exception as e:
+            logger.error('Exception reporting profile')
+            logger.error(e)
+    try:
+        job_history.add_entry(dict(outcome, interval=interval))
+    except Exception as e:
+        logger.error('Exception storing job history')
+        logger.error(e)
+
+
 def scripts_async_execution(params):
     """
         Function that executes asynchronously all specific synchronisation scripts passed as params.
         * params:
         *       processes {list} processes to be executed asynchronously.
         *       retrievingTimeFunction {function} Function that returns a datetimeobject from wich get last results.
+                    None if the processes don't need it.
+        *       interval {int} seconds between two executions of the processes, to warn when they last too long.
+        Processes are profiled if it's enabled in the 'ProfilingSection' of ConfigFile.properties, or switched on
+        by sending profiling.TOGGLE_SIGNAL to the synchronizer.
     """
     processes = params[0]
         
     updatingTime = None
     if (len(params)>1):
         updatingTime = params[1]
+    interval = None
+    if (len(params)>2):
+        interval = params[2]
     
-    global MAX_THREADS
-    # print MAX_THREADS
-    pool = mp.Pool(MAX_THREADS)
+    tick_start = time.time()
+    (pool, created) = get_worker_pool()
+    pool_seconds = time.time()-tick_start
     
+    results = []
     for process_number in range(0, len(processes)):
         # full call example : pool.apply_async(foo_pool, args = (i, ), callback = log_result)
         logger.info('SYNCHRONIZING PROCESS... executing '+str(processes[process_number])+' function')
         if updatingTime is None:
-            pool.apply_async(processes[process_number])
+            args = []
         else:
-            pool.apply_async(processes[process_number],[updatingTime()] )
-        
-    pool.close()
-    pool.join()
+            args = [updatingTime()]
+        profile_directory = profiling.get_profiled_directory(get_process_name(processes[process_number]))
+        results.append(pool.apply_async(run_process, (processes[process_number], args, time.time(), profile_directory),
+                                        callback=lambda outcome: record_outcome(outcome, interval)))
+    
+    # The pool is kept for the next executions, so we only wait for our scripts
+    wait_seconds = []
+    for result in results:
+        try:
+            wait_seconds.append(result.get()['wait'])
+        except Exception as e:
+            # Only if the outcome itself can't be sent back from the worker process
+            logger.error('SYNCHRONIZING PROCESS... exception getting the outcome of a script')
+            logger.error(e)
+    if len(wait_seconds) > 0:
+        if created:
+            pool_state = 'created with '+str(MAX_THREADS)+' worker processes'
+        else:
+            pool_state = 'reused'
+        logger.info('SYNCHRONIZING PROCESS... startup overhead: '+str(round(pool_seconds, 3))+' s getting the pool ('
+                    +pool_state+'), scripts waited '+str(round(max(wait_seconds), 3))+' s at most to start')
  
 
 
 
+def log_skipped_job(event):
+    """
+        Reports the executions of a job that are skipped because the previous one is still running, or merged
+        with the next one because they were missed.
+        * event {JobEvent} scheduler event.
+    """
+    if event.code == EVENT_JOB_MAX_INSTANCES:
+        logger.warning('SYNCHRONIZING PROCESS... overlapping execution of job '+str(event.job_id)+' skipped: '
+                       +'the previous one is still running')
+    else:
+        logger.warning('SYNCHRONIZING PROCESS... execution of job '+str(event.job_id)+' scheduled at '
+                       +str(event.scheduled_run_time)+' missed, it is merged with the next one')
+
+
+def add_jobs(sched):
+    """
+        Adds all synchronisation jobs to a scheduler. Only one execution of each job runs at the same time,
+        and missed executions are merged into one.
+        * sched {BaseScheduler} scheduler.
+    """
+    sched.add_listener(log_skipped_job, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+    job_options = {'max_instances': 1, 'coalesce': True}
+    sched.add_job(scripts_async_execution, 'cron', minute="0", args=[[UPDATING_1H_PROCESSES, getPastHour, UPDATING_1H_INTERVAL]], id='updating_1h', **job_options)
+    sched.add_job(scripts_async_execution, 'cron', hour="0", minute="30", args=[[FULL_UPDATING_1D_PROCESSES, None, FULL_UPDATING_1D_INTERVAL]], id='full_updating_1d', **job_options)
+    sched.add_job(scripts_async_execution, 'cron', day=6,hour="2",minute="30", args=[[FULL_UPDATING_1W_PROCESSES, None, FULL_UPDATING_1W_INTERVAL]], id='full_updating_1w', **job_options)
+
+
 def start_blocking_scheduler():
     """
         Executes 'synchronize_job' as a synchronous job every hour.
@@ -118,16 +359,15 @@ def start_blocking_scheduler():
     """
     init_logger()
     logger.info('SYNCHRONIZING PROCESS... starting blocking scheduler')
+    profiling.install_signal_handler()
     sched = BlockingScheduler()
-    updating_1h_job = sched.add_job(scripts_async_execution, 'cron', minute="0", args=[[UPDATING_1H_PROCESSES, getPastHour]])
-    full_updating_1d_job = sched.add_job(scripts_async_execution, 'cron', hour="0", minute="30", args=[[FULL_UPDATING_1D_PROCESSES]])
-    full_updating_1w_job = sched.add_job(scripts_async_execution, 'cron', day=6,hour="2",minute="30", args=[[FULL_UPDATING_1W_PROCESSES]])
+    add_jobs(sched)
 
     try:
         sched.start()
     except (KeyboardInterrupt, SystemExit):
         logger.info('Stopping blocking scheduler')
-        pass
+        close_worker_pool()
     
 
 def start_background_scheduler(): 
@@ -137,12 +377,10 @@ def start_background_scheduler():
     """
     init_logger()
     logger.info('SYNCHRONIZING PROCESS... starting background scheduler')
+    profiling.install_signal_handler()
 
     sched = BackgroundScheduler()
-
-    updating_1h_job = sched.add_job(scripts_async_execution, 'cron', minute="00", args=[[UPDATING_1H_PROCESSES, getPastHour]])
-    full_updating_1d_job = sched.add_job(scripts_async_execution, 'cron', hour="0",minute="30", args=[[FULL_UPDATING_1D_PROCESSES]])
-    full_updating_1w_job = sched.add_job(scripts_async_execution, 'cron', day=6,hour="2",minute="30", args=[[FULL_UPDATING_1W_PROCESSES]])
+    add_jobs(sched)
 
     sched.start()
     
@@ -153,6 +391,7 @@ def start_background_scheduler():
     except (KeyboardInterrupt, SystemExit):
         logger.info('Stopping background scheduler')
         sched.shutdown()  # Not strictly necessary if daemonic mode is enabled but should be done if possible
+        close_worker_pool()
  
  
  
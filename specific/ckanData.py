@@ -9,17 +9,41 @@ import logging
 from logging.handlers import TimedRotatingFileHandler
 import ssl
 import urllib2
-
-import ConfigParser
-
-# Importing db manager
-sys.path.insert(0, '../../resource-contextualization-import-db/abstraction')
-from DB_Factory import DBFactory
+import collections
+from multiprocessing.pool import ThreadPool
 
 # Importing utils
 sys.path.insert(0, '../util')
 import util
+import db_managers
+import http_client
+import bulk_writer
+import reconcile
+import staging
+import checkpoint
+import journal
+import pipeline
+import source_lock
+import metrics
+import fields
+
+
+TESS_API_URL = 'http://tess.elixir-europe.org/api/3/action/'
+
+# Default number of package_show requests made at the same time
+FETCH_MAX_WORKERS = 8
+
+# Default way of fetching training materials:
+#   'search' - pages of full documents obtained with package_search
+#   'show'   - package_list followed by one package_show request per training material
+DEFAULT_FETCH_MODE = 'search'
+SEARCH_PAGE_ROWS = 500
+
+# Courses from mygoblet.org are Events, not Training Materials
+MYGOBLET_COURSES_LINK = 'http://www.mygoblet.org//training-portal/courses/'
 
+# Format of the creation dates of training materials
+CKAN_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
 
 logger = None
@@ -59,9 +83,9 @@ def get_materials_names():
         
     try:
         # TEMPORARY DOWN tessResponse = urllib2.urlopen('https://tess.elixir-uk.org/api/3/action/package_list', context=context)
-        tessResponse = urllib2.urlopen('http://tess.elixir-europe.org/api/3/action/package_list')
+        tessResponse = http_client.get(TESS_API_URL+'package_list')
 
-        tessData = tessResponse.read()
+        tessData = tessResponse.text
         # Direct call gaves some problems related with SSL handshake.
         # tessData = requests.get('https://tess.elixir-uk.org/api/3/action/package_list')
         names_list = json.loads(tessData).get('result')
@@ -87,9 +111,9 @@ def get_json_from_material_name(material_name):
     
     try:
         # materialResponse = urllib2.urlopen('http://tess.elixir-europe.org/api/3/action/package_show?id=' + material_name, context=context)
-        materialResponse = urllib2.urlopen('http://tess.elixir-europe.org/api/3/action/package_show?id=' + material_name)
+        materialResponse = http_client.get(TESS_API_URL+'package_show', params={'id': material_name})
         
-        results = materialResponse.read()
+        results = materialResponse.text
         # results = requests.get('http://tess.elixir-europe.org/api/3/action/package_show?id=' + material_name)
         try:           
             json_data = json.loads(results)
@@ -104,6 +128,105 @@ def get_json_from_material_name(material_name):
         logger.error(e)
         return None
     
+
+def get_materials_offset_pages(rows=SEARCH_PAGE_ROWS, fq=None, start=0, fetchStatus=None):
+    """
+        Get training materials from "tess.elixir-europe.org" in pages, using package_search. Each training
+        material has the same structure returned by get_json_from_material_name, so all getters can be used with it.
+        * rows {int} number of training materials requested in each page.
+        * fq {string} filter query of the search. All training materials are obtained if it's None.
+        * start {int} offset of the first training material requested.
+        * fetchStatus {FetchStatus} status of the fetch, finished when the last page is yielded, if any.
+        * {generator} Return (start, materials) tuples: the offset of each page, and its training materials data.
+            It stops if there is any error, leaving fetchStatus unfinished.
+    """
+    if fetchStatus is None:
+        fetchStatus = pipeline.FetchStatus()
+    while True:
+        params = {'q': '*:*', 'rows': rows, 'start': start, 'sort': 'name asc'}
+        if fq is not None:
+            params['fq'] = fq
+        try:
+            search_data = http_client.get_json(TESS_API_URL+'package_search', params=params)
+            search_result = search_data.get('result')
+            packages = search_result.get('results')
+            count = search_result.get('count')
+        except Exception as e:
+            logger.error ("Exception searching for Tess data")
+            logger.error (e)
+            return
+        if packages is None:
+            return
+        if len(packages) == 0:
+            # Training materials removed meanwhile move the offsets, so we can't tell if any was missed
+            if count is None or start >= count:
+                fetchStatus.finish()
+            return
+        yield (start, [{'success': search_data.get('success'), 'result': package} for package in packages])
+        start = start + len(packages)
+        if count is not None and start >= count:
+            fetchStatus.finish()
+            return
+
+
+def get_materials_pages(rows=SEARCH_PAGE_ROWS, fq=None):
+    """
+        Get training materials from "tess.elixir-europe.org" in pages, using package_search.
+        * rows {int} number of training materials requested in each page.
+        * fq {string} filter query of the search. All training materials are obtained if it's None.
+        * {generator} Return lists of training materials data. It stops if there is any error.
+    """
+    for (start, materials) in get_materials_offset_pages(rows, fq):
+        yield materials
+
+
+def get_modified_since_query(registriesFromTime):
+    """
+        Get the package_search filter query to obtain only training materials modified since one moment.
+        * registriesFromTime {datetime} time from registries will be obtained.
+        * {string} Return the filter query, or None if registriesFromTime is None.
+    """
+    if registriesFromTime is None:
+        return None
+    return 'metadata_modified:['+registriesFromTime.strftime('%Y-%m-%dT%H:%M:%SZ')+' TO *]'
+
+
+def fetch_materials(materials_names, max_workers=FETCH_MAX_WORKERS, fetchStatus=None):
+    """
+        Gets the data of several training materials concurrently. Results are yielded in the same order as
+        materials_names, each one as soon as it (and the previous ones) have arrived, so they can be inserted
+        while the next ones are still being downloaded.
+        * materials_names {list} names of the training materials to be obtained.
+        * max_workers {int} maximum number of requests made at the same time.
+        * fetchStatus {FetchStatus} status of the fetch, failed if any training material can't be got and finished
+            when all of them are yielded, if any.
+        * {generator} Return the data of each training material, as get_json_from_material_name does.
+    """
+    if fetchStatus is None:
+        fetchStatus = pipeline.FetchStatus()
+    max_workers = max(1, max_workers)
+    pool = ThreadPool(max_workers)
+    try:
+        names = iter(materials_names)
+        pending = collections.deque()
+        while True:
+            # We only keep a bounded window of requests in flight, so fast servers don't fill our memory
+            while len(pending) < 2*max_workers:
+                material_name = next(names, None)
+                if material_name is None:
+                    break
+                pending.append(pool.apply_async(get_json_from_material_name, (material_name,)))
+            if len(pending) == 0:
+                fetchStatus.finish()
+                break
+            json_data = pending.popleft().get()
+            if json_data is None:
+                fetchStatus.fail()
+            yield json_data
+    finally:
+        pool.terminate()
+        pool.join()
+
   
 def get_one_field_from_tm(data, root_tag):
     """
@@ -145,6 +268,20 @@ def get_one_field_from_custom_tm_data(data, source_tag, field_name):
         return None
 
 
+def get_one_value_from_tm_data(data, field_name):
+    """
+        Get one field value from the main data of one training material, as it was decoded.
+        * data {list} data of one training material.
+        * field_name {string} name of the field to be obtained.
+        * {object} Return the field value requested. fields.NOT_FOUND if there is any error.
+    """
+    try:
+        return data['result'].get(field_name)
+    except Exception:
+        logger.error ("Error getting "+field_name+" from training materials JSON")
+        return fields.NOT_FOUND
+
+
 def get_title(data):
     """
         Get 'title' field from the data of one training material.
@@ -171,18 +308,18 @@ def get_field(data):
         * data {list} data of one training material.
         * {string or list} Return 'field' value from the list. None if there is any error.
     """
-    my_field = get_one_field_from_tm_data(data, 'tags')
+    my_field = get_one_value_from_tm_data(data, 'tags')
     return_value = []
     default_value = 'Bioinformatics'
-    if my_field is not None:
-        my_field_converted = eval(my_field)
+    if my_field is not fields.NOT_FOUND:
+        my_field_converted = fields.get_list(my_field)
         
         for each_field in my_field_converted:
             try:
                 term = each_field.get('display_name')
                 return_value.append(term)
             except Exception as e:
-                logger.error("Error getting 'display_name' field of "+my_field+" tags:")
+                logger.error("Error getting 'display_name' field of "+format(my_field)+" tags:")
                 logger.error(e)
         if len(return_value)==0:
             return_value.append(default_value)
@@ -224,6 +361,27 @@ def get_ckan_source():
     return 'ckan'
 
 
+def is_mygoblet_course(link):
+    """
+        Returns if one link is the one of a course from mygoblet.org.
+        * link {string} link of one training material.
+        * {boolean} Return True if it's a mygoblet.org course.
+    """
+    return isinstance(link, basestring) and link.startswith(MYGOBLET_COURSES_LINK)
+
+
+def get_record_resource_type(link):
+    """
+        Get the resource type of the record of one training material. Courses from mygoblet.org are tagged as
+        Events, as postProcessing did with the records of previous versions of this script.
+        * link {string} link of the training material.
+        * {string or list} Return resource type value.
+    """
+    if is_mygoblet_course(link):
+        return ["Event"]
+    return get_resource_type_field()
+
+
 def get_insertion_date_field():
     """
         Get insertion date of any registry obtained with this script.
@@ -253,7 +411,7 @@ def get_audience(data):
             audience = resources_content.get('audience')
             audience_terms = []
             if audience is not None:
-                audience_terms = eval(audience)
+                audience_terms = fields.get_literal(audience)
             for each_field in audience_terms:
                 return_value.append(each_field)
         except Exception as e:
@@ -265,6 +423,15 @@ def get_audience(data):
     
 
 
+def get_name(data):
+    """
+        Get 'name' field from the data of one training material. It's the identifier used by the CKAN API.
+        * data {list} data of one training material.
+        * {string} Return 'name' value from the list. None if there is any error.
+    """
+    return get_one_field_from_tm_data(data, 'name')
+
+
 def get_link(data):
     """
         Get 'url' field from the data of one training material.
@@ -283,7 +450,7 @@ def get_created(data):
     my_field = get_one_field_from_tm_data(data, 'metadata_created')
     if my_field is not None:
         try:
-            datetime_object = datetime.strptime(my_field, '%Y-%m-%dT%H:%M:%S.%f' )
+            datetime_object = fields.get_datetime(my_field, CKAN_DATE_FORMAT)
             return datetime_object
         except Exception as e:
             logger.error('Exception getting creation date field')
@@ -293,6 +460,25 @@ def get_created(data):
         return None
 
 
+def get_modified(data):
+    """
+        Get 'metadata_modified' field from the data of one training material: the last time it was changed, which
+        incremental updates are filtered and checkpointed on.
+        * data {list} data of one training material.
+        * {datetime} Return 'metadata_modified' value from the list. None if there is any error.
+    """
+    my_field = get_one_field_from_tm_data(data, 'metadata_modified')
+    if my_field is not None:
+        try:
+            return fields.get_datetime(my_field, CKAN_DATE_FORMAT)
+        except Exception as e:
+            logger.error('Exception getting modification date field')
+            logger.error(e)
+            return None
+    else:
+        return None
+
+
 def isDataMoreRecentThan(data, minimumDate):
     """
         Returns if data passed as argument is more recient than the minimumDate argument.
@@ -301,7 +487,19 @@ def isDataMoreRecentThan(data, minimumDate):
         * {boolean} Return True if our data is more recent than minimumDate, False if data is older or equally old than minimumDate.
     """  
     if minimumDate is not None:
-        createdDate = get_created(data)
+        return isDateMoreRecentThan(get_created(data), minimumDate)
+    else:
+        return True
+
+
+def isDateMoreRecentThan(createdDate, minimumDate):
+    """
+        Returns if the creation date passed as argument is more recient than the minimumDate argument.
+        * createdDate {datetime} creation date of one training material, as returned by get_created.
+        * minimumDate {datetime} minimum date and time that registry should be. 
+        * {boolean} Return True if createdDate is more recent than minimumDate, False if it's older, equally old or None.
+    """  
+    if minimumDate is not None:
         if createdDate is not None:
             try:
                 comparison = (minimumDate < createdDate)
@@ -314,7 +512,178 @@ def isDataMoreRecentThan(data, minimumDate):
             return False
     else:
         return True
-    
+
+
+def get_ckan_record(data):
+    """
+        Get the record to be inserted into the DB for one training material.
+        * data {list} data of one training material.
+        * {dict} Return the record, with the fields described in main_options.
+    """
+    link = get_link(data)
+    return {
+        "title":get_title(data),
+        "description":get_notes(data),
+        "field":get_field(data),
+        "source":get_source_field(),
+        "resource_type":get_record_resource_type(link),
+        "insertion_date":get_insertion_date_field(),
+        "created":get_created(data),
+        "audience":get_audience(data),
+        "link":link
+        }
+
+
+def get_batch_field(tags):
+    """
+        Get 'field' field of one training material of a batch, as get_field does.
+        * tags {list} 'tags' value of the training material.
+        * {list} Return 'field' value. It raises an exception if any tag isn't a dict.
+    """
+    return_value = [each_field.get('display_name') for each_field in tags]
+    if len(return_value)==0:
+        return_value.append('Bioinformatics')
+    return return_value
+
+
+def get_batch_audience(result, audience_cache):
+    """
+        Get 'audience' field of one training material of a batch, as get_audience does.
+        * result {dict} 'result' value of the training material.
+        * audience_cache {dict} audience terms of the 'audience' values already parsed in the batch.
+        * {list} Return 'audience' value. It raises an exception if there is any error.
+    """
+    resources = result.get('resources')
+    if resources is None or len(resources)==0:
+        return []
+    audience = resources[0].get('audience')
+    if audience is None:
+        return []
+    if not isinstance(audience, basestring):
+        return list(fields.get_literal(audience))
+    audience_terms = audience_cache.get(audience)
+    if audience_terms is None:
+        audience_terms = list(fields.get_literal(audience))
+        # Only lists of strings are shared through the cache, records don't share anything mutable
+        if all(isinstance(each_field, basestring) for each_field in audience_terms):
+            audience_cache[audience] = audience_terms
+    return list(audience_terms)
+
+
+def transform_batch(materials):
+    """
+        Get the records to be inserted into the DB for a whole page of training materials, in one pass. Records are
+        the ones of get_ckan_record, but the fields shared by every record are got once, with one insertion date for
+        the whole page, and repeated 'audience' values are parsed once.
+        Training materials with missing or unexpected values are left to get_ckan_record, which logs their errors.
+        * materials {list} data of the training materials. None training materials are left out.
+        * {list} Return the records, with the fields described in main_options.
+    """
+    source = get_source_field()
+    insertion_date = get_insertion_date_field()
+    audience_cache = {}
+    records = []
+    for data in materials:
+        if data is None:
+            continue
+        try:
+            result = data['result']
+            link = format(result.get('url'))
+            record = {
+                "title":format(result.get('title')),
+                "description":format(result.get('notes')),
+                "field":get_batch_field(result.get('tags')),
+                "source":source,
+                "resource_type":get_record_resource_type(link),
+                "insertion_date":insertion_date,
+                "created":fields.get_datetime(format(result.get('metadata_created')), CKAN_DATE_FORMAT),
+                "audience":get_batch_audience(result, audience_cache),
+                "link":link
+                }
+        except Exception:
+            record = get_ckan_record(data)
+            record['insertion_date'] = insertion_date
+        records.append(record)
+    return records
+
+
+class CkanSource(pipeline.SourcePlugin):
+    """
+        Importing of training materials as a pipeline: pages of training materials are fetched from the CKAN server,
+        converted into records and inserted into the DB, each step working on a different page at the same time.
+    """
+
+    name = 'ckan'
+
+    def __init__(self, pages, dbWriter, runJournal, registriesFromTime=None, highWaterMark=None):
+        """
+            * pages {generator} (start, materials) tuples, as returned by get_materials_offset_pages. start is None
+                if the page can't be requested again.
+            * dbWriter {BulkWriter} writer of the records, bulk_writer.BulkWriter or reconcile.Reconciler.
+            * runJournal {Journal} journal of the run.
+            * registriesFromTime {datetime} time from registries modified will be inserted, if any.
+            * highWaterMark {HighWaterMark} checkpoint of the modification dates ingested, if any.
+        """
+        self.pages = pages
+        self.dbWriter = dbWriter
+        self.runJournal = runJournal
+        self.registriesFromTime = registriesFromTime
+        self.highWaterMark = highWaterMark
+
+    def fetch_pages(self):
+        return self.pages
+
+    def prepare_page(self, page):
+        (page_start, materials) = page
+        metrics.increment('records_fetched', len(materials))
+        records = []
+        with metrics.timer('transform_seconds'):
+            materials = [json_data for json_data in materials if json_data is not None]
+            for (json_data, record) in zip(materials, transform_batch(materials)):
+                material_name = get_name(json_data)
+                modified = get_modified(json_data)
+                # If we have registriesFromTime, we have to check that each one was modified since registriesFromTime, as
+                # the filter query of get_modified_since_query does. In 'search' mode old training materials are already
+                # filtered by the server, so this is only a safety net. Training materials inserted by a previous run
+                # are kept anyway, the checkpoint has to take them into account
+                if (self.runJournal.is_committed(material_name) or self.registriesFromTime is None
+                        or modified == self.registriesFromTime or isDateMoreRecentThan(modified, self.registriesFromTime)):
+                    records.append((material_name, record, modified))
+        # Courses from mygoblet.org are only kept if their links are available, as postProcessing did
+        mygoblet_links = [record['link'] for (material_name, record, modified) in records
+                          if is_mygoblet_course(record['link']) and not self.runJournal.is_committed(material_name)]
+        if len(mygoblet_links) > 0:
+            url_status = util.check_urls(mygoblet_links)
+            records = [(material_name, record, modified) for (material_name, record, modified) in records
+                       if self.runJournal.is_committed(material_name) or not is_mygoblet_course(record['link'])
+                       or url_status.get(record['link'], False)]
+        return (page_start, records)
+
+    def load_page(self, page):
+        (page_start, records) = page
+        if page_start is not None:
+            # Everything from previous pages is committed before journaling this one
+            self.dbWriter.flush()
+            self.runJournal.page(page_start)
+        for (material_name, record, modified) in records:
+            if self.highWaterMark is not None and self.highWaterMark.is_ingested(modified, record['link']):
+                continue
+            if self.runJournal.is_committed(material_name):
+                # Inserted by the previous run, before it died
+                if self.highWaterMark is not None:
+                    self.highWaterMark.observe(modified, record['link'])
+                continue
+            writeCallback = None
+            if self.highWaterMark is not None:
+                writeCallback = self.highWaterMark.callback_for(modified)
+            self.dbWriter.insert_data(record, self.runJournal.callback_for(material_name, writeCallback))
+        # Records that don't have to be written are not committed, but a resumed run must know about them too
+        self.runJournal.see([record['link'] for (material_name, record, modified) in records])
+        return len(records)
+
+    def wait_page(self):
+        # Records of the last page are not kept buffered past their age while the next one is fetched
+        self.dbWriter.flush_expired()
 
 
 
@@ -327,7 +696,7 @@ def main():
     """
         Executes main_options function with default configurations
     """
-    main_options(None)
+    return main_options(None)
 
        
 def mainUpdating(registriesFromTime):
@@ -338,17 +707,29 @@ def mainUpdating(registriesFromTime):
     my_options = {}
     my_options['registriesFromTime'] = registriesFromTime
     my_options['updateRegistries'] = True
-    main_options(my_options)
+    my_options['use_checkpoint'] = True
+    return main_options(my_options)
     
        
 def mainFullUpdating():
     """
-        Executes main_options function erasing all previous ckan data
+        Executes main_options function updating all registries and synchronising them with previous ckan data
     """
     my_options = {}
-    my_options['delete_all_old_data'] = True
+    my_options['reconcile'] = True
     my_options['updateRegistries'] = True
-    main_options(my_options)
+    return main_options(my_options)
+    
+    
+def mainStagedFullUpdating():
+    """
+        Executes main_options function loading all registries into the staging dataset, and synchronising previous
+        ckan data with them once they are all loaded and validated
+    """
+    my_options = {}
+    my_options['staging_ds_name'] = staging.DEFAULT_STAGING_DS_NAME
+    my_options['updateRegistries'] = True
+    return main_options(my_options)
     
     
 def mainFullDeleting():
@@ -358,7 +739,7 @@ def mainFullDeleting():
     my_options = {}
     my_options['delete_all_old_data'] = True
     my_options['updateRegistries'] = False
-    main_options(my_options)
+    return main_options(my_options)
     
     
 def main_options(options):
@@ -368,17 +749,62 @@ def main_options(options):
         * options {list} specific configurations for initialization.
             ds_name {string} specific dataset/database to use with the DB manager
             delete_all_old_data {boolean} specifies if we should delete all previous ckanData in our DataBase
+            reconcile {boolean} synchronises the DB with the new data: inserts new records, updates changed ones and
+                deletes the ones not found anymore, instead of inserting everything
+            staging_ds_name {string} dataset where records are loaded before being promoted to ds_name, if any
+            staging_min_records {int} minimum number of staged records to promote them
+            staging_min_ratio {float} minimum number of staged records to promote them, as a share of the live ones
             registriesFromTime {datetime} time from registries will be obtained
             updateRegistries {boolean} if we want to get new regiestries or not
-
+            use_checkpoint {boolean} starts from the last registry ingested by a previous run, if any, instead of registriesFromTime
+            fetch_mode {string} 'search' to get pages of training materials, 'show' to request them one by one
+            fetch_workers {int} maximum number of training materials requested at the same time ('show' mode)
+            search_rows {int} number of training materials requested in each page ('search' mode), or grouped in each
+                page as they arrive ('show' mode)
+            resume {boolean} continues the previous run with the same options if it didn't finish, skipping the
+                training materials it already inserted
+            queue_size {int} maximum number of pages waiting between two steps of the importing process
+        * {int} Return the number of registries inserted, None if the process was skipped because another one
+            of CKAN was running.
     """
+    init_logger()
+    
+    # Only one importing process of each source runs at the same time, even in different processes
+    sourceLock = source_lock.SourceLock(get_source_field())
+    if not sourceLock.acquire():
+        # Incremental updates are not lost: the next one starts from the last registry ingested
+        logger.warning('Skipping ckanData importing process: the previous one is still running')
+        return None
+    try:
+        return run_main_options(options)
+    finally:
+        sourceLock.release()
 
+
+def run_main_options(options):
+    """
+        Executes the importing process described in main_options, once the lock of the source is held.
+        * options {list} specific configurations for initialization, see main_options.
+        * {int} Return the number of registries inserted.
+    """
     init_logger()
+    # Timers and counters of this run, written at the end of it
+    metrics.reset()
     
     ds_name = None
     delete_all_old_data = False
+    reconcile_data = False
+    staging_ds_name = None
+    staging_min_records = staging.DEFAULT_MIN_RECORDS
+    staging_min_ratio = staging.DEFAULT_MIN_RATIO
     registriesFromTime = None
     updateRegistries = True
+    use_checkpoint = False
+    fetch_mode = DEFAULT_FETCH_MODE
+    fetch_workers = FETCH_MAX_WORKERS
+    search_rows = SEARCH_PAGE_ROWS
+    resume = False
+    queue_size = pipeline.DEFAULT_QUEUE_SIZE
 
     if options is not None:
         logger.info ('>> Starting ckanData importing process... params: ')
@@ -388,41 +814,94 @@ def main_options(options):
         if ('delete_all_old_data' in options.keys()):
             delete_all_old_data = options['delete_all_old_data']
             logger.info ('delete_all_old_data='+str(delete_all_old_data))
+        if ('reconcile' in options.keys()):
+            reconcile_data = options['reconcile']
+            logger.info ('reconcile='+str(reconcile_data))
+        if ('staging_ds_name' in options.keys()):
+            staging_ds_name = options['staging_ds_name']
+            logger.info ('staging_ds_name='+str(staging_ds_name))
+        if ('staging_min_records' in options.keys()):
+            staging_min_records = options['staging_min_records']
+            logger.info ('staging_min_records='+str(staging_min_records))
+        if ('staging_min_ratio' in options.keys()):
+            staging_min_ratio = options['staging_min_ratio']
+            logger.info ('staging_min_ratio='+str(staging_min_ratio))
         if ('registriesFromTime' in options.keys()):
             registriesFromTime = options['registriesFromTime']
             logger.info ('registriesFromTime='+str(registriesFromTime))
         if ('updateRegistries' in options.keys()):
             updateRegistries = options['updateRegistries']
             logger.info ('updateRegistries='+str(updateRegistries))
+        if ('use_checkpoint' in options.keys()):
+            use_checkpoint = options['use_checkpoint']
+            logger.info ('use_checkpoint='+str(use_checkpoint))
+        if ('fetch_mode' in options.keys()):
+            fetch_mode = options['fetch_mode']
+            logger.info ('fetch_mode='+str(fetch_mode))
+        if ('fetch_workers' in options.keys()):
+            fetch_workers = options['fetch_workers']
+            logger.info ('fetch_workers='+str(fetch_workers))
+        if ('search_rows' in options.keys()):
+            search_rows = options['search_rows']
+            logger.info ('search_rows='+str(search_rows))
+        if ('resume' in options.keys()):
+            resume = options['resume']
+            logger.info ('resume='+str(resume))
+        if ('queue_size' in options.keys()):
+            queue_size = options['queue_size']
+            logger.info ('queue_size='+str(queue_size))
             
 
     else:
         logger.info ('>> Starting ckanData importing process...')
 
 
-    materials_names = None
-    if updateRegistries:   
-        materials_names = get_materials_names()
+    highWaterMark = None
+    if use_checkpoint:
+        highWaterMark = checkpoint.HighWaterMark(get_source_field())
+        if highWaterMark.get_value() is not None:
+            # We resume exactly from the last registry ingested, so missed runs are covered by this one
+            registriesFromTime = highWaterMark.get_value()
+            logger.info ('Resuming from checkpoint: registriesFromTime='+str(registriesFromTime))
     
+    runJournal = None
+    materials_pages = None
+    fetchStatus = pipeline.FetchStatus()
+    if updateRegistries:
+        # Progress of the run is journaled, so it can be resumed if it dies halfway
+        runJournal = journal.Journal(get_source_field(), str([registriesFromTime, delete_all_old_data, reconcile_data, staging_ds_name, fetch_mode]), resume)
+        if fetch_mode == 'search':
+            # Full documents in pages: one request for each page of training materials.
+            # When updating, the server only returns the training materials modified since registriesFromTime
+            modified_since_query = get_modified_since_query(registriesFromTime)
+            # Offsets move if training materials are removed meanwhile, so a resumed run asks again for the previous
+            # page too: training materials already inserted are skipped anyway
+            start = max(0, (runJournal.get_last_page() or 0) - search_rows)
+            materials_pages = get_materials_offset_pages(search_rows, modified_since_query, start, fetchStatus)
+        else:
+            materials_names = get_materials_names()
+            if materials_names is not None:
+                # Training materials inserted by a previous run that died are not requested again
+                materials_names = [material_name for material_name in materials_names if not runJournal.is_committed(material_name)]
+                # Training materials are downloaded concurrently and grouped in pages of search_rows as they arrive.
+                # Those pages can't be requested again: each training material is journaled by its name once inserted
+                materials_pages = ((None, materials) for materials in pipeline.chunks(fetch_materials(materials_names, fetch_workers, fetchStatus), search_rows))
     
-    user = None
-    passw = None
-    try:
-        config = ConfigParser.RawConfigParser()
-        config.read('ConfigFile.properties')
-        usertemp = config.get('AuthenticationSection', 'database.user');
-        passwtemp = config.get('AuthenticationSection', 'database.password');
-        user = usertemp
-        passw = passwtemp
-    except Exception as e:
-        logger.info ("Not user info found, using anonymous user... ")
-        logger.info (e)
-            
-    dbFactory = DBFactory()
-    dbManager = dbFactory.get_default_db_manager_with_username(ds_name,user,passw)
+    
+    # DB managers are opened once per process, and reused by all its runs
+    dbManager = db_managers.get_db_manager(ds_name)
+    
+    liveManager = None
+    if staging_ds_name is not None:
+        # Shadow load: records are written to the staging dataset, and promoted to the live one at the end
+        liveManager = dbManager
+        dbManager = db_managers.get_db_manager(staging_ds_name)
+        if runJournal is None or not runJournal.is_resuming():
+            staging.clear(dbManager, get_source_field())
     
     # print (dbManager)
-    if (delete_all_old_data is not None and delete_all_old_data):
+    # A resumed run must keep the registries inserted before it died
+    if (delete_all_old_data is not None and delete_all_old_data and (runJournal is None or not runJournal.is_resuming())):
         ckan_conditions = [['EQ','source',get_source_field()]]
         previous_count = dbManager.count_data_by_conditions(ckan_conditions)
         dbManager.delete_data_by_conditions(ckan_conditions)
@@ -431,41 +910,48 @@ def main_options(options):
             logger.info ('Deleted '+str( (previous_count-new_count) )+' registries')   
     
        
-    if materials_names is not None:    
-        numSuccess = 0
-        for material_name in materials_names:
-            json_data = get_json_from_material_name(material_name)
-            if (json_data is not None):
-                # If we have registriesFromTime, we have to check that each one's creation date if more recent than registriesFromTime
-                if registriesFromTime is None or isDataMoreRecentThan(json_data,registriesFromTime):
-                    success = dbManager.insert_data({
-                        "title":get_title(json_data),
-                        "description":get_notes(json_data),
-                        "field":get_field(json_data),
-                        "source":get_source_field(),
-                        "resource_type":get_resource_type_field(),
-                        "insertion_date":get_insertion_date_field(),
-                        "created":get_created(json_data),
-                        "audience":get_audience(json_data),
-                        "link":get_link(json_data)
-                        })
-                    if success:
-                        numSuccess=numSuccess+1
+    numSuccess = 0
+    if materials_pages is not None:    
+        if reconcile_data:
+            dbWriter = reconcile.Reconciler(dbManager, get_source_field())
+        else:
+            dbWriter = bulk_writer.BulkWriter(dbManager)
+        for link in runJournal.get_committed_links()+runJournal.get_seen_links():
+            dbWriter.mark_committed(link)
+        # Fetching, building the records and inserting work at the same time on consecutive pages
+        CkanSource(materials_pages, dbWriter, runJournal, registriesFromTime, highWaterMark).run(queue_size)
+        if not fetchStatus.is_complete():
+            # Registries not fetched are not deleted, and the run can be resumed from the page that failed
+            logger.error ('Tess training materials could not be fetched completely, the journal of the run is kept to resume it')
                         
+        numSuccess = dbWriter.close(fetchStatus.is_complete())
+        # Pages are not sorted by date, so after an incomplete fetch older registries could still be missing
+        if highWaterMark is not None and fetchStatus.is_complete():
+            highWaterMark.save()
         logger.info ('Inserted '+str(numSuccess)+' new registries')   
+        if liveManager is not None:
+            staging.promote(dbManager, liveManager, get_source_field(), staging_min_records, staging_min_ratio,
+                            fetchStatus.is_complete())
+        if fetchStatus.is_complete():
+            runJournal.finish()
+        else:
+            runJournal.close()
      
     
     if updateRegistries:
         postProcessing(options)
         
     logger.info('<< Finished ckanData importing process.')
+    metrics.write_summary(get_source_field())
+    return numSuccess
     
     
     
 
 def postProcessing(options):
     """
-        Executes some curating operations over imported data
+        Executes some curating operations over imported data. Records are already imported with these changes, so
+        it only changes the records inserted by previous versions of this script.
     """
     
     init_logger()
@@ -476,21 +962,8 @@ def postProcessing(options):
         ds_name = options['ds_name']
         
     
-    user = None
-    passw = None
-    try:
-        config = ConfigParser.RawConfigParser()
-        config.read('ConfigFile.properties')
-        usertemp = config.get('AuthenticationSection', 'database.user');
-        passwtemp = config.get('AuthenticationSection', 'database.password');
-        user = usertemp
-        passw = passwtemp
-    except Exception as e:
-        logger.info ("Not user info found, using anonymous user... ")
-        logger.info (e)
-            
-    dbFactory = DBFactory()
-    dbManager = dbFactory.get_default_db_manager_with_username(ds_name,user,passw)
+    # DB managers are opened once per process, and reused by all its runs
+    dbManager = db_managers.get_db_manager(ds_name)
     
     # We want to change all courses from mygoblet.org tagged as Training Materials
     ckan_conditions = [
@@ -504,17 +977,20 @@ def postProcessing(options):
     previous_count = dbManager.count_data_by_conditions(ckan_conditions)
     #print (previous_count)
     results = dbManager.get_data_by_conditions(ckan_conditions)
-    # delete all of them , and then we insert them again modified. We will have to implement update operation in AbstractManager
-    dbManager.delete_data_by_conditions(ckan_conditions)
-    new_count = dbManager.count_data_by_conditions(ckan_conditions)
-    #print (new_count)
-    numSuccess = 0
+    if results is None:
+        results = []
+    results = list(results)
+    # All links are checked at once, concurrently, before inserting them again
+    url_status = util.check_urls([result.get("link") for result in results])
+    # We insert them again modified, and then we delete the old ones, which are the only ones tagged as Training Materials.
+    # We will have to implement update operation in AbstractManager
+    dbWriter = bulk_writer.BulkWriter(dbManager)
     for result in results:
         #print (result)
-        exists = util.existURL(result.get("link"))
+        exists = url_status.get(result.get("link"), False)
         # logger.info ('Exists? '+get_link(record)+' :'+str(exists))   
         if (exists):
-            success = dbManager.insert_data({
+            record = {
                 "title":result.get("title"),
                 "description":result.get("description"),
                 "field":result.get("field"),
@@ -524,9 +1000,14 @@ def postProcessing(options):
                 "created":result.get("created"),
                 "audience":result.get("audience"),
                 "link":result.get("link")
-                })
-            if success:
-                numSuccess=numSuccess+1
+                }
+            # The hash of the new content, so reconciling runs find these records unchanged
+            record['content_hash'] = reconcile.get_content_hash(record)
+            dbWriter.insert_data(record)
+    numSuccess = dbWriter.close()
+    dbManager.delete_data_by_conditions(ckan_conditions)
+    new_count = dbManager.count_data_by_conditions(ckan_conditions)
+    #print (new_count)
     #print (numSuccess)
     logger.info('Changed '+str(numSuccess)+' mygoblet.org records tagged as Training Materials to Events')
     logger.info('< Finished ckan postprocessing')
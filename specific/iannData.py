@@ -1,39 +1,43 @@
 from __future__ import print_function
-import re
 import sys
 from datetime import datetime, timedelta, date, time
 import pysolr
 import threading
+import itertools
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
-import ConfigParser
-
-# Importing db manager
-sys.path.insert(0, '../../resource-contextualization-import-db/abstraction')
-from DB_Factory import DBFactory
-
 # Importing utils
 sys.path.insert(0, '../util')
 import util
+import db_managers
+import http_client
+import bulk_writer
+import reconcile
+import staging
+import checkpoint
+import journal
+import pipeline
+import source_lock
+import metrics
+import fields
 
 
-'''
-class IannDataLocking(object):
-    
-    # Lock object to ensure only one thread is updating iann registries at the same time
-    iann_lock = threading.Lock()
-    
-    @staticmethod
-    def lock():
-        iann_lock.acquire()
-        
-    @staticmethod
-    def release():
-        iann_lock.release()    
-   
-'''   
-    
+IANN_SOLR_URL = 'http://iann.pro/solr/'
+
+# Solr deep paging: results are sorted by the unique key of the iAnn index and requested in pages
+IANN_SOLR_UNIQUE_KEY = 'id'
+SOLR_PAGE_ROWS = 500
+
+# Only the fields read by the getters of this script are requested to iAnn
+IANN_FIELDS = [IANN_SOLR_UNIQUE_KEY, 'title', 'start', 'end', 'city', 'country', 'field', 'provider', 'link', 'submission_date']
+
+# Events requested with and without projection once per run, to measure how many bytes the projection saves
+PROJECTION_SAMPLE_ROWS = 50
+
+# Format of the submission dates of iAnn events
+IANN_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
 """
     Dictionary with the relationships between special iAnn field terms and EDAM terms.
 """
@@ -87,33 +91,115 @@ def init_logger():
 
 
 
-def get_iann_data(registriesFromTime):
+def get_iann_query(registriesFromTime):
     """
-        Makes a Request to the Solr Server from "iann.pro"
+        Get the filter query to ask the Solr Server from "iann.pro" for events.
         * registriesFromTime {datetime} time from registries will be obtained
+        * {string} Return the filter query:
+           "start:[2015-01-01T00:00:00Z TO *]" - Events beginning in 2015-01-01 until "*" (today)
+           submission_date: Events created from registriesFromTime, if it's not None
+    """
+    myfq='start:[2015-01-01T00:00:00Z TO *]'
+    if registriesFromTime is not None:
+        submission_date = 'submission_date:['+registriesFromTime.strftime('%Y-%m-%dT%H:%M:%SZ')+' TO *]'
+        myfq = myfq + ' AND '+submission_date 
+    return myfq
+
+
+def get_iann_data_cursor_pages(registriesFromTime, rows=SOLR_PAGE_ROWS, cursor_mark='*', fetchStatus=None):
+    """
+        Makes Requests to the Solr Server from "iann.pro", following its cursorMark to get all events page by page.
+        * registriesFromTime {datetime} time from registries will be obtained
+        * rows {int} number of events requested in each page.
+        * cursor_mark {string} cursorMark of the first page requested. '*' to start from the beginning.
+        * fetchStatus {FetchStatus} status of the fetch, finished when the last page is yielded, if any.
+        * {generator} Return (cursor_mark, events) tuples: the cursorMark used to request each page, and its events.
+            It stops if there is any error, leaving fetchStatus unfinished.
         
         Some information about iAnn SolR server:
         * iannData {class} url - Uniform Resource Locator
         * {class} resultsIann Query fields:
            "q='*:*'" - Query all the data;
-           "rows='5000'" - Indicates the maximum number of events that will be returned;
-           "fq='start:[2015-01-01T00:00:00Z TO *]" - Events beginning in 2015-01-01 until "*" (today)
-                submission_date: Events created from this date
+           "rows" - Indicates the maximum number of events that will be returned in each page;
+           "sort" - Unique key of the events, needed by cursorMark to page through all of them;
+           "fl" - Only the fields in IANN_FIELDS, the ones we insert into the DB;
+           "fq" - Filter query returned by get_iann_query
+        Responses are requested gzip-compressed through the shared HTTP client.
     """
     
-    myfq='start:[2015-01-01T00:00:00Z TO *]'
-    if registriesFromTime is not None:
-        submission_date = 'submission_date:['+str(registriesFromTime.year)+'-'+str(registriesFromTime.month)+'-'+str(registriesFromTime.day)+'T'+str(registriesFromTime.hour)+':'+str(registriesFromTime.minute)+':'+str(registriesFromTime.second)+'Z TO *]'
-        myfq = myfq + ' AND '+submission_date 
+    if fetchStatus is None:
+        fetchStatus = pipeline.FetchStatus()
+    myfq = get_iann_query(registriesFromTime)
 
     try:
-        iannData = pysolr.Solr('http://iann.pro/solr/', timeout=20)
-        resultsIann = iannData.search(q='*:*', rows='5000', fq=myfq)
-        return resultsIann
+        iannData = pysolr.Solr(IANN_SOLR_URL, timeout=20)
+        # Reuse the pooled, keep-alive connections of the shared HTTP client
+        iannData.session = http_client.get_session()
     except Exception as e:
         logger.error("Exception asking for iAnn data")
         logger.error(e)
+        return
+
+    while True:
+        try:
+            resultsIann = iannData.search(q='*:*', rows=str(rows), fq=myfq, fl=','.join(IANN_FIELDS), sort=IANN_SOLR_UNIQUE_KEY+' asc', cursorMark=cursor_mark)
+        except Exception as e:
+            logger.error("Exception asking for iAnn data")
+            logger.error(e)
+            return
+        if len(resultsIann.docs) > 0:
+            yield (cursor_mark, resultsIann.docs)
+        next_cursor_mark = resultsIann.raw_response.get('nextCursorMark')
+        # Solr returns the same cursorMark when there are no more results
+        if next_cursor_mark is None or next_cursor_mark == cursor_mark or len(resultsIann.docs) == 0:
+            fetchStatus.finish()
+            return
+        cursor_mark = next_cursor_mark
+
+
+def get_projection_sample(registriesFromTime, rows=PROJECTION_SAMPLE_ROWS):
+    """
+        Measures how many bytes the projection of IANN_FIELDS saves: the first events of the query are requested
+        twice, with and without "fl", and the sizes of both uncompressed responses are compared.
+        * registriesFromTime {datetime} time from registries will be obtained
+        * rows {int} number of events of the sample.
+        * {dict} Return 'projected_bytes' and 'unprojected_bytes' of the same events. None if there is any error.
+    """
+    params = {'q': '*:*', 'rows': str(rows), 'fq': get_iann_query(registriesFromTime),
+              'sort': IANN_SOLR_UNIQUE_KEY+' asc', 'wt': 'json'}
+    url = IANN_SOLR_URL.rstrip('/')+'/select'
+    try:
+        unprojected = http_client.get(url, params=params)
+        unprojected.raise_for_status()
+        params['fl'] = ','.join(IANN_FIELDS)
+        projected = http_client.get(url, params=params)
+        projected.raise_for_status()
+    except Exception as e:
+        logger.error("Exception asking for the projection sample of iAnn data")
+        logger.error(e)
         return None
+    return {'projected_bytes': len(projected.content), 'unprojected_bytes': len(unprojected.content)}
+
+
+def get_iann_data_pages(registriesFromTime, rows=SOLR_PAGE_ROWS):
+    """
+        Get all events from the Solr Server from "iann.pro", page by page.
+        * registriesFromTime {datetime} time from registries will be obtained
+        * rows {int} number of events requested in each page.
+        * {generator} Return lists of events. It stops if there is any error.
+    """
+    for (cursor_mark, docs) in get_iann_data_cursor_pages(registriesFromTime, rows):
+        yield docs
+
+
+def get_iann_data(registriesFromTime, rows=SOLR_PAGE_ROWS):
+    """
+        Get all events from the Solr Server from "iann.pro". Events are requested page by page while they are consumed.
+        * registriesFromTime {datetime} time from registries will be obtained
+        * rows {int} number of events requested in each page.
+        * {generator} Return each event's iAnn data.
+    """
+    return itertools.chain.from_iterable(get_iann_data_pages(registriesFromTime, rows))
 
 
 
@@ -133,6 +219,22 @@ def get_one_field_from_iann_data(result, field_name):
         return None
 
 
+def get_one_value_from_iann_data(result, field_name):
+    """
+        Generic function to get one field value from the data of one iAnn result, as it was decoded.
+        * result {list} one event's iAnn data.
+        * field_name {string} name of the field to be obtained.
+        * {object} Return the field value requested. fields.NOT_FOUND if there is any error.
+    """
+    try:
+       return result[field_name]
+    except Exception as e:
+        logger.error("Error getting "+field_name+" from iAnn result:")
+        logger.error(result)
+        logger.error(e)
+        return fields.NOT_FOUND
+
+
 def get_title(data):
     """
         Get 'title' field from the data of one iAnn event.
@@ -223,20 +325,28 @@ def get_field(data):
         * data {list} one event's iAnn data.
         * {List} Return 'field' value from the list. None if there is any error.
     """
-    edam_values = []
-    my_field = get_one_field_from_iann_data(data, 'field')
-    if my_field is not None:
-        clear_value = remove_unicode_chars(my_field)
-        if isinstance(clear_value, basestring):
-            edam_values = get_edam_field_value(clear_value)
-            return edam_values
-        else:
-            for each_value in clear_value: 
-                edam_values = edam_values + get_edam_field_value(each_value)
-            return edam_values
+    my_field = get_one_value_from_iann_data(data, 'field')
+    if my_field is not fields.NOT_FOUND:
+        return get_edam_field_values(fields.get_string_list(my_field))
     else:
         return None
-    
+
+
+def get_edam_field_values(clear_value):
+    """
+        Converts the terms of one 'field' field within EDAM ontology.
+        * clear_value {list} terms of the field, as returned by fields.get_string_list.
+        * {List} Return 'field' value adapted with EDAM ontology.
+    """
+    edam_values = []
+    if isinstance(clear_value, basestring):
+        edam_values = get_edam_field_value(clear_value)
+        return edam_values
+    else:
+        for each_value in clear_value: 
+            edam_values = edam_values + get_edam_field_value(each_value)
+        return edam_values
+
 
 def get_resource_type_field():
     """
@@ -286,11 +396,11 @@ def get_creation_date_field(data):
         * data {list} one event's iAnn data.
         * {date} Return creation date value.
     """
-    my_field = get_one_field_from_iann_data(data, 'submission_date')
-    if my_field is not None:
+    my_field = get_one_value_from_iann_data(data, 'submission_date')
+    if my_field is not fields.NOT_FOUND:
         try:
-            date_string_list = remove_unicode_chars(my_field)      
-            datetime_object = datetime.strptime(date_string_list[0], '%Y-%m-%dT%H:%M:%SZ' )
+            date_string_list = fields.get_string_list(my_field)
+            datetime_object = fields.get_datetime(date_string_list[0], IANN_DATE_FORMAT)
             return datetime_object
         except Exception as e:
             logger.error('Exception getting creation date field')
@@ -300,6 +410,118 @@ def get_creation_date_field(data):
         return None
 
 
+
+def get_iann_record(data):
+    """
+        Get the record to be inserted into the DB for one iAnn event.
+        * data {list} one event's iAnn data.
+        * {dict} Return the record, with the fields described in main_options.
+    """
+    return {
+        "title":get_title(data),
+        "start":get_start(data),
+        "end":get_end(data),
+        "city":get_city(data),
+        "country":get_country(data),
+        "field":get_field(data),
+        "provider":get_provider(data),
+        "link":get_link(data),
+        "source":get_source_field(),
+        "resource_type":get_resource_type_field(),
+        "insertion_date":get_insertion_date_field(),
+        "created":get_creation_date_field(data)
+        }
+
+
+def get_batch_field(value, edam_cache):
+    """
+        Get 'field' field of one iAnn event of a batch, as get_field does.
+        * value {object} 'field' value of the event.
+        * edam_cache {dict} EDAM terms of the 'field' values already converted in the batch.
+        * {List} Return 'field' value adapted with EDAM ontology.
+    """
+    if not fields.is_simple_string_list(value):
+        return get_edam_field_values(fields.get_string_list(value))
+    key = tuple(value)
+    edam_values = edam_cache.get(key)
+    if edam_values is None:
+        edam_values = get_edam_field_values(fields.get_string_list(value))
+        edam_cache[key] = edam_values
+    # Records don't share lists, as with get_field
+    return list(edam_values)
+
+
+def get_batch_creation_date(value):
+    """
+        Get original creation date of one iAnn event of a batch, as get_creation_date_field does.
+        * value {object} 'submission_date' value of the event.
+        * {date} Return creation date value. It raises an exception if there is any error.
+    """
+    if fields.is_simple_string_list(value):
+        return fields.get_datetime(str(value[0]), IANN_DATE_FORMAT)
+    return fields.get_datetime(fields.get_string_list(value)[0], IANN_DATE_FORMAT)
+
+
+def get_last_submission_date(data):
+    """
+        Get the last submission date of one iAnn event. Solr matches the event with "submission_date:[T TO *]" as
+        soon as any of its submission dates is T or later, so incremental runs are checkpointed on this one, not on
+        the creation date: events submitted again are then skipped as any other event at the checkpoint.
+        * data {dict} one event's iAnn data.
+        * {datetime} Return the last valid submission date. None if the event has none.
+    """
+    value = data.get('submission_date') if isinstance(data, dict) else None
+    if value is None:
+        return None
+    dates = []
+    for text in fields.get_string_list(value):
+        try:
+            dates.append(fields.get_datetime(text, IANN_DATE_FORMAT))
+        except ValueError:
+            pass
+    if len(dates) == 0:
+        return None
+    return max(dates)
+
+
+def transform_batch(iann_data):
+    """
+        Get the records to be inserted into the DB for a whole page of iAnn events, in one pass. Records are the
+        ones of get_iann_record, but the fields shared by every record are got once, with one insertion date for
+        the whole page, and the EDAM terms of repeated 'field' values are converted once.
+        Events with missing or unexpected values are left to get_iann_record, which logs their errors.
+        * iann_data {list} events' iAnn data. None events are left out.
+        * {list} Return the records, with the fields described in main_options.
+    """
+    source = get_source_field()
+    resource_type = get_resource_type_field()
+    insertion_date = get_insertion_date_field()
+    edam_cache = {}
+    records = []
+    for data in iann_data:
+        if data is None:
+            continue
+        try:
+            record = {
+                "title":format(data['title']),
+                "start":format(data['start']),
+                "end":format(data['end']),
+                "city":format(data['city']),
+                "country":format(data['country']),
+                "field":get_batch_field(data['field'], edam_cache),
+                "provider":format(data['provider']),
+                "link":format(data['link']),
+                "source":source,
+                "resource_type":resource_type,
+                "insertion_date":insertion_date,
+                "created":get_batch_creation_date(data['submission_date'])
+                }
+        except Exception:
+            record = get_iann_record(data)
+            record['insertion_date'] = insertion_date
+        records.append(record)
+    return records
+
     
 
 def remove_unicode_chars(variable):
@@ -308,22 +530,71 @@ def remove_unicode_chars(variable):
         * variable {string} string variable with Unicode chars. It can contains more than only one different strings. 
         * {list} Return the variables without Unicode chars. None if there is any error.
     """
-    if variable is not None and isinstance(variable, basestring) : 
-        listFull = []
-        strText = variable.replace("[u'", "")
-        strClear = strText.replace("']", "")
-    
-        if re.search("', u'", strClear):
-            array = strClear.split("', u'")
-            for index in array:
-                strEach = index
-                listFull.append(strEach)
-            return listFull
-        else:
-            listFull.append(strClear)
-            return listFull
-    else:
-        return None
+    return fields.split_repr(variable)
+
+
+
+class IannSource(pipeline.SourcePlugin):
+    """
+        Importing of iAnn events as a pipeline: pages of events are fetched from the Solr server, their links are
+        checked and they are inserted into the DB, each step working on a different page at the same time.
+    """
+
+    name = 'iann'
+
+    def __init__(self, pages, dbWriter, runJournal, highWaterMark=None):
+        """
+            * pages {generator} (cursor_mark, events) tuples, as returned by get_iann_data_cursor_pages.
+            * dbWriter {BulkWriter} writer of the records, bulk_writer.BulkWriter or reconcile.Reconciler.
+            * runJournal {Journal} journal of the run.
+            * highWaterMark {HighWaterMark} checkpoint of the last submission dates ingested, if any.
+        """
+        self.pages = pages
+        self.dbWriter = dbWriter
+        self.runJournal = runJournal
+        self.highWaterMark = highWaterMark
+
+    def fetch_pages(self):
+        return self.pages
+
+    def prepare_page(self, page):
+        (cursor_mark, iann_data) = page
+        metrics.increment('records_fetched', len(iann_data))
+        iann_data = [data for data in iann_data if data is not None]
+        with metrics.timer('transform_seconds'):
+            records = transform_batch(iann_data)
+        # Each record goes with the last submission date of its event, which the checkpoint is kept on
+        records = zip(records, [get_last_submission_date(data) for data in iann_data])
+        # All links of the page are checked at once, concurrently. Events inserted by a previous run are kept
+        # without checking them, the checkpoint has to take them into account
+        url_status = util.check_urls([record['link'] for (record, submission_date) in records if not self.runJournal.is_committed(record['link'])])
+        return (cursor_mark, [(record, submission_date) for (record, submission_date) in records
+                              if self.runJournal.is_committed(record['link']) or url_status.get(record['link'], False)])
+
+    def load_page(self, page):
+        (cursor_mark, records) = page
+        # Everything from previous pages is committed before journaling this one
+        self.dbWriter.flush()
+        self.runJournal.page(cursor_mark)
+        for (record, submission_date) in records:
+            if self.highWaterMark is not None and self.highWaterMark.is_ingested(submission_date, record['link']):
+                continue
+            if self.runJournal.is_committed(record['link']):
+                # Inserted by the previous run, before it died
+                if self.highWaterMark is not None:
+                    self.highWaterMark.observe(submission_date, record['link'])
+                continue
+            writeCallback = None
+            if self.highWaterMark is not None:
+                writeCallback = self.highWaterMark.callback_for(submission_date)
+            self.dbWriter.insert_data(record, self.runJournal.callback_for(None, writeCallback))
+        # Records that don't have to be written are not committed, but a resumed run must know about them too
+        self.runJournal.see([record['link'] for (record, submission_date) in records])
+        return len(records)
+
+    def wait_page(self):
+        # Records of the last page are not kept buffered past their age while the next one is fetched
+        self.dbWriter.flush_expired()
 
 
 
@@ -334,7 +605,7 @@ def main():
     """
         Executes main_options function with default configurations
     """
-    main_options(None)
+    return main_options(None)
     
   
 def mainUpdating(registriesFromTime):
@@ -345,17 +616,29 @@ def mainUpdating(registriesFromTime):
     my_options = {}
     my_options['registriesFromTime'] = registriesFromTime
     my_options['updateRegistries'] = True
-    main_options(my_options)
+    my_options['use_checkpoint'] = True
+    return main_options(my_options)
     
     
 def mainFullUpdating():
     """
-        Executes main_options function updating all registries and erasing all previous iAnn data
+        Executes main_options function updating all registries and synchronising them with previous iAnn data
     """
     my_options = {}
-    my_options['delete_all_old_data'] = True
+    my_options['reconcile'] = True
+    my_options['updateRegistries'] = True
+    return main_options(my_options)
+    
+    
+def mainStagedFullUpdating():
+    """
+        Executes main_options function loading all registries into the staging dataset, and synchronising previous
+        iAnn data with them once they are all loaded and validated
+    """
+    my_options = {}
+    my_options['staging_ds_name'] = staging.DEFAULT_STAGING_DS_NAME
     my_options['updateRegistries'] = True
-    main_options(my_options)
+    return main_options(my_options)
     
 def mainFullDeleting():
     """
@@ -364,7 +647,7 @@ def mainFullDeleting():
     my_options = {}
     my_options['delete_all_old_data'] = True
     my_options['updateRegistries'] = False
-    main_options(my_options)
+    return main_options(my_options)
     
     
 def main_options(options):
@@ -374,8 +657,19 @@ def main_options(options):
         * options {list} specific configurations for initialization.
             ds_name: specific dataset/database to use with the DB manager
             delete_all_old_data {boolean} specifies if we should delete all previous ckanData in our DataBase
+            reconcile {boolean} synchronises the DB with the new data: inserts new records, updates changed ones and
+                deletes the ones not found anymore, instead of inserting everything
+            staging_ds_name {string} dataset where records are loaded before being promoted to ds_name, if any
+            staging_min_records {int} minimum number of staged records to promote them
+            staging_min_ratio {float} minimum number of staged records to promote them, as a share of the live ones
             registriesFromTime {datetime} time from registries will be obtained
             updateRegistries {boolean} if we want to get new regiestries or not
+            use_checkpoint {boolean} starts from the last registry ingested by a previous run, if any, instead of registriesFromTime
+            page_rows {int} number of events requested to iAnn in each page
+            resume {boolean} continues the previous run with the same options if it didn't finish, skipping the
+                events it already inserted
+            queue_size {int} maximum number of pages waiting between two steps of the importing process
+            check_workers {int} maximum number of pages whose links are checked at the same time
                
         
         In this script we will insert these fields into each registry:
@@ -392,14 +686,47 @@ def main_options(options):
             "created" {date} Date and time of creation of the original registry.
 
         See more eg: http://iann.pro/iann-web-services
+
+        * {int} Return the number of registries inserted, None if the process was skipped because another one
+            of iAnn was running.
+    """
+    init_logger()
+    
+    # Only one importing process of each source runs at the same time, even in different processes
+    sourceLock = source_lock.SourceLock(get_source_field())
+    if not sourceLock.acquire():
+        # Incremental updates are not lost: the next one starts from the last registry ingested
+        logger.warning('Skipping iann importing process: the previous one is still running')
+        return None
+    try:
+        return run_main_options(options)
+    finally:
+        sourceLock.release()
+
+
+def run_main_options(options):
+    """
+        Executes the importing process described in main_options, once the lock of the source is held.
+        * options {list} specific configurations for initialization, see main_options.
+        * {int} Return the number of registries inserted.
     """
-    # IannDataLocking.lock()
     init_logger()
+    # Timers and counters of this run, written at the end of it
+    metrics.reset()
     
     ds_name = None
     delete_all_old_data = False
+    reconcile_data = False
+    staging_ds_name = None
+    staging_min_records = staging.DEFAULT_MIN_RECORDS
+    staging_min_ratio = staging.DEFAULT_MIN_RATIO
     registriesFromTime = None
     updateRegistries = True
+    use_checkpoint = False
+    page_rows = SOLR_PAGE_ROWS
+    resume = False
+    queue_size = pipeline.DEFAULT_QUEUE_SIZE
+    check_workers = 1
 
     if options is not None:
         logger.info ('>> Starting iann importing process... params: ')
@@ -409,37 +736,73 @@ def main_options(options):
         if ('delete_all_old_data' in options.keys()):
             delete_all_old_data = options['delete_all_old_data']
             logger.info ('delete_all_old_data='+str(delete_all_old_data))
+        if ('reconcile' in options.keys()):
+            reconcile_data = options['reconcile']
+            logger.info ('reconcile='+str(reconcile_data))
+        if ('staging_ds_name' in options.keys()):
+            staging_ds_name = options['staging_ds_name']
+            logger.info ('staging_ds_name='+str(staging_ds_name))
+        if ('staging_min_records' in options.keys()):
+            staging_min_records = options['staging_min_records']
+            logger.info ('staging_min_records='+str(staging_min_records))
+        if ('staging_min_ratio' in options.keys()):
+            staging_min_ratio = options['staging_min_ratio']
+            logger.info ('staging_min_ratio='+str(staging_min_ratio))
         if ('registriesFromTime' in options.keys()):
             registriesFromTime = options['registriesFromTime']
             logger.info ('registriesFromTime='+str(registriesFromTime))
         if ('updateRegistries' in options.keys()):
             updateRegistries = options['updateRegistries']
             logger.info ('updateRegistries='+str(updateRegistries))        
+        if ('use_checkpoint' in options.keys()):
+            use_checkpoint = options['use_checkpoint']
+            logger.info ('use_checkpoint='+str(use_checkpoint))
+        if ('page_rows' in options.keys()):
+            page_rows = options['page_rows']
+            logger.info ('page_rows='+str(page_rows))
+        if ('resume' in options.keys()):
+            resume = options['resume']
+            logger.info ('resume='+str(resume))
+        if ('queue_size' in options.keys()):
+            queue_size = options['queue_size']
+            logger.info ('queue_size='+str(queue_size))
+        if ('check_workers' in options.keys()):
+            check_workers = options['check_workers']
+            logger.info ('check_workers='+str(check_workers))
     else:
         logger.info ('>> Starting iann importing process...')
 
-    iann_data = None
+    highWaterMark = None
+    if use_checkpoint:
+        highWaterMark = checkpoint.HighWaterMark(get_source_field())
+        if highWaterMark.get_value() is not None:
+            # We resume exactly from the last registry ingested, so missed runs are covered by this one
+            registriesFromTime = highWaterMark.get_value()
+            logger.info ('Resuming from checkpoint: registriesFromTime='+str(registriesFromTime))
+    
+    initial_transfer_stats = http_client.get_transfer_stats()
+    runJournal = None
+    iann_pages = None
+    fetchStatus = pipeline.FetchStatus()
     if updateRegistries: 
-        iann_data = get_iann_data(registriesFromTime)
+        # Progress of the run is journaled, so it can be resumed if it dies halfway
+        runJournal = journal.Journal(get_source_field(), str([registriesFromTime, delete_all_old_data, reconcile_data, staging_ds_name]), resume)
+        iann_pages = get_iann_data_cursor_pages(registriesFromTime, page_rows, runJournal.get_last_page() or '*', fetchStatus)
     
     
-    user = None
-    passw = None
-    try:
-        config = ConfigParser.RawConfigParser()
-        config.read('ConfigFile.properties')
-        usertemp = config.get('AuthenticationSection', 'database.user');
-        passwtemp = config.get('AuthenticationSection', 'database.password');
-        user = usertemp
-        passw = passwtemp
-    except Exception as e:
-        logger.info ("Not user info found, using anonymous user... ")
-        logger.info (e)
-        
-    dbFactory = DBFactory()
-    dbManager = dbFactory.get_default_db_manager_with_username(ds_name,user,passw)
+    # DB managers are opened once per process, and reused by all its runs
+    dbManager = db_managers.get_db_manager(ds_name)
+    
+    liveManager = None
+    if staging_ds_name is not None:
+        # Shadow load: records are written to the staging dataset, and promoted to the live one at the end
+        liveManager = dbManager
+        dbManager = db_managers.get_db_manager(staging_ds_name)
+        if runJournal is None or not runJournal.is_resuming():
+            staging.clear(dbManager, get_source_field())
     
-    if (delete_all_old_data is not None and delete_all_old_data):
+    # A resumed run must keep the registries inserted before it died
+    if (delete_all_old_data is not None and delete_all_old_data and (runJournal is None or not runJournal.is_resuming())):
         iann_conditions = [['EQ','source',get_source_field()]]
         previous_count = dbManager.count_data_by_conditions(iann_conditions)
         dbManager.delete_data_by_conditions(iann_conditions)
@@ -447,35 +810,49 @@ def main_options(options):
         if (previous_count is not None and new_count is not None):
             logger.info ('Deleted '+str( (previous_count-new_count) )+' registries')   
    
-    if iann_data is not None:    
-        numSuccess = 0
-        for result in iann_data:
-            if (result is not None):        
-                exists = util.existURL(get_link(record))
-                # logger.info ('Exists? '+get_link(record)+' :'+str(exists))   
-                if (exists):
-                        success = dbManager.insert_data({
-                            "title":get_title(result),
-                            "start":get_start(result),
-                            "end":get_end(result),
-                            "city":get_city(result),
-                            "country":get_country(result),
-                            "field":get_field(result),
-                            "provider":get_provider(result),
-                            "link":get_link(result),
-                            "source":get_source_field(),
-                            "resource_type":get_resource_type_field(),
-                            "insertion_date":get_insertion_date_field(),
-                            "created":get_creation_date_field(result)                    
-                            })
-                        if success:
-                            numSuccess=numSuccess+1
+    numSuccess = 0
+    if iann_pages is not None:    
+        if reconcile_data:
+            dbWriter = reconcile.Reconciler(dbManager, get_source_field())
+        else:
+            dbWriter = bulk_writer.BulkWriter(dbManager)
+        for link in runJournal.get_committed_links()+runJournal.get_seen_links():
+            dbWriter.mark_committed(link)
+        # Events are requested page by page, so only a few pages are kept in memory. Fetching, link checking and
+        # inserting work at the same time on consecutive pages
+        IannSource(iann_pages, dbWriter, runJournal, highWaterMark).run(queue_size, check_workers)
+        if not fetchStatus.is_complete():
+            # Registries not fetched are not deleted, and the run can be resumed from the page that failed
+            logger.error ('iAnn events could not be fetched completely, the journal of the run is kept to resume it')
         
+        numSuccess = dbWriter.close(fetchStatus.is_complete())
+        # Pages are not sorted by date, so after an incomplete fetch older registries could still be missing
+        if highWaterMark is not None and fetchStatus.is_complete():
+            highWaterMark.save()
         logger.info ('Inserted '+str(numSuccess)+' new registries')   
+        if liveManager is not None:
+            staging.promote(dbManager, liveManager, get_source_field(), staging_min_records, staging_min_ratio,
+                            fetchStatus.is_complete())
+        if fetchStatus.is_complete():
+            runJournal.finish()
+        else:
+            runJournal.close()
+        transfer_stats = http_client.get_transfer_stats_since(initial_transfer_stats)
+        logger.info ('Received '+str(transfer_stats['wire_bytes'])+' bytes in '+str(transfer_stats['requests'])+' requests: '
+                     +str(transfer_stats['decoded_bytes'])+' bytes uncompressed, '
+                     +str(transfer_stats['decoded_bytes']-transfer_stats['wire_bytes'])+' bytes saved by compression')
+        # The savings of the projection are estimated from one sample of events, requested after the run so
+        # they are not counted above
+        projection_sample = get_projection_sample(registriesFromTime)
+        if projection_sample is not None and projection_sample['projected_bytes'] > 0:
+            ratio = float(projection_sample['unprojected_bytes'])/projection_sample['projected_bytes']
+            logger.info ('Projection of iAnn fields: '+str(projection_sample['projected_bytes'])+' bytes instead of '
+                         +str(projection_sample['unprojected_bytes'])+' for a sample of up to '+str(PROJECTION_SAMPLE_ROWS)+' events, about '
+                         +str(int(transfer_stats['decoded_bytes']*(ratio-1)))+' uncompressed bytes saved in this run')
               
     logger.info ('<< Finished iann importing process.')
-    
-    # IannDataLocking.release()  
+    metrics.write_summary(get_source_field())
+    return numSuccess
 
 
 if __name__ == "__main__":
@@ -1,22 +1,35 @@
 import requests
-import re
 import json
 import sys
 import datetime
+import math
+import collections
+import itertools
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
-import ConfigParser
+from multiprocessing.pool import ThreadPool
 
 
-# Importing db manager
-sys.path.insert(0, '../../resource-contextualization-import-db/abstraction')
-from DB_Factory import DBFactory
-
 # Importing utils
 sys.path.insert(0, '../util')
 import util
+import db_managers
+import http_client
+import bulk_writer
+import reconcile
+import staging
+import journal
+import pipeline
+import source_lock
+import metrics
+import fields
+
+
+BIOTOOLS_API_URL = 'https://bio.tools/api/tool'
 
+# Default number of bio.tools pages requested at the same time
+BIOTOOLS_PAGE_PREFETCH = 4
     
 """
     Dictionary with the relationships between input resource types and output resource types.
@@ -67,27 +80,112 @@ def init_logger():
     
 
 
-def get_records():
+def get_records_page(page):
+    """
+        Get one page of registry data from "bio.tools".
+        * page {int} number of the page, starting with 1.
+        * {dict} decoded page: "count" - number of records, "next" - next page, if any, "list" - records of the page.
+            None if there is any error.
+    """
+    try:
+        return http_client.get_json(BIOTOOLS_API_URL, params={'page': page, 'format': 'json'})
+    except Exception as e:
+        logger.error ("Exception asking for Elixir data, page "+str(page))
+        logger.error (e)
+        return None
+
+
+def get_records_numbered_pages(prefetch=BIOTOOLS_PAGE_PREFETCH, first_page_number=1, fetchStatus=None):
+    """
+        Get all registry data from "bio.tools", following its pagination. Once the first page tells us how many
+        pages there are, up to 'prefetch' pages are downloaded at the same time, but they are yielded in order and
+        only a bounded window of them is kept in memory.
+        * prefetch {int} maximum number of pages requested at the same time.
+        * first_page_number {int} number of the first page requested, starting with 1.
+        * fetchStatus {FetchStatus} status of the fetch, finished when the last page is yielded, if any.
+        * {generator} Return (page_number, records) tuples. It stops if there is any error, leaving fetchStatus
+            unfinished.
+    """
+    if fetchStatus is None:
+        fetchStatus = pipeline.FetchStatus()
+    first_page = get_records_page(first_page_number)
+    if first_page is None:
+        return
+    if isinstance(first_page, list):
+        # Not paginated: all records in one response
+        yield (first_page_number, first_page)
+        fetchStatus.finish()
+        return
+    records = first_page.get('list') or []
+    if len(records) == 0:
+        fetchStatus.finish()
+        return
+    yield (first_page_number, records)
+    if first_page.get('next') is None:
+        fetchStatus.finish()
+        return
+
+    count = first_page.get('count')
+    if count is None or prefetch <= 1:
+        page_number = first_page_number+1
+        while True:
+            page = get_records_page(page_number)
+            if page is None or not page.get('list'):
+                # The previous page told us there was a next one
+                return
+            yield (page_number, page.get('list'))
+            if page.get('next') is None:
+                fetchStatus.finish()
+                return
+            page_number = page_number + 1
+    else:
+        last_page_number = int(math.ceil(count/float(len(records))))
+        page_numbers = iter(range(first_page_number+1, last_page_number+1))
+        pool = ThreadPool(prefetch)
+        try:
+            pending = collections.deque()
+            while True:
+                while len(pending) < prefetch:
+                    page_number = next(page_numbers, None)
+                    if page_number is None:
+                        break
+                    pending.append((page_number, pool.apply_async(get_records_page, (page_number,))))
+                if len(pending) == 0:
+                    break
+                (page_number, result) = pending.popleft()
+                page = result.get()
+                if page is None or not page.get('list'):
+                    return
+                yield (page_number, page.get('list'))
+            fetchStatus.finish()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def get_records_pages(prefetch=BIOTOOLS_PAGE_PREFETCH):
+    """
+        Get all registry data from "bio.tools", page by page.
+        * prefetch {int} maximum number of pages requested at the same time.
+        * {generator} Return lists of records. It stops if there is any error.
+    """
+    for (page_number, records) in get_records_numbered_pages(prefetch):
+        yield records
+
+
+def get_records(prefetch=BIOTOOLS_PAGE_PREFETCH):
         
     """
-        Get all registry data from "elixir-registry.cbs.dtu.dk"
-        * {list} registry data. In this script we will need:
+        Get all registry data from "bio.tools". Records are requested page by page while they are consumed.
+        * prefetch {int} maximum number of pages requested at the same time.
+        * {generator} registry data. In this script we will need:
             variables {string}:
             "title" - Title for the data registry.
             "description" - Description for the data registry.
             "link" - Link to the data registry.
             "field" - Default ('Services Registry');
-            None if there is any error.
     """
-       
-    try:
-        elixirData = requests.get('https://bio.tools/api/tool')
-        records_list = json.loads(elixirData.text)
-        return records_list
-    except Exception as e:
-        logger.error ("Exception asking for Elixir data")
-        logger.error (e)
-        return None
+    return itertools.chain.from_iterable(get_records_pages(prefetch))
 
 
 
@@ -108,6 +206,22 @@ def get_one_field_from_registry_data(record, field_name):
         return None
 
 
+def get_one_value_from_registry_data(record, field_name):
+    """
+        Generic function to get one field value from the data of one record, as it was decoded.
+        * result {list} one Elixir's record.
+        * field_name {string} name of the field to be obtained.
+        * {object} Return the field value requested. fields.NOT_FOUND if there is any error.
+    """
+    try:
+        return record[field_name]
+    except Exception as e:
+        logger.error("Error getting "+field_name+" from Elixir record:")
+        logger.error(record)
+        logger.error(e)
+        return fields.NOT_FOUND
+
+
 def get_title(data):
     """
         Get 'title' field from the data of one record.
@@ -145,16 +259,16 @@ def get_field(data):
         * {string or list} Return 'field' value from the list. None if there is any error.
     """
     
-    my_field = get_one_field_from_registry_data(data, 'topic')
-    if my_field is not None:
-        my_field_converted = eval(my_field)
+    my_field = get_one_value_from_registry_data(data, 'topic')
+    if my_field is not fields.NOT_FOUND:
+        my_field_converted = fields.get_list(my_field)
         return_value = []
         for each_field in my_field_converted:
             try:
                 term = each_field.get('term')
                 return_value.append(term)
             except Exception as e:
-                logger.error("Error getting 'term' field of "+my_field+" topic:")
+                logger.error("Error getting 'term' field of "+format(my_field)+" topic:")
                 logger.error(e)
         return return_value
     else:
@@ -183,19 +297,27 @@ def get_resource_type_field(data):
         * data {list} one Elixir's record.
         * {string} Return resource type value.
     """
-    resource_types = []
-    my_field = get_one_field_from_registry_data(data, 'resourceType')
-    if my_field is not None:
-        clear_value = remove_unicode_chars(my_field)
-        if isinstance(clear_value, basestring):
-            resource_types = get_resource_types_value(clear_value)
-            return resource_types
-        else:
-            for each_value in clear_value: 
-                resource_types = resource_types + get_resource_types_value(each_value)
-            return resource_types
+    my_field = get_one_value_from_registry_data(data, 'resourceType')
+    if my_field is not fields.NOT_FOUND:
+        return get_resource_types_values(fields.get_string_list(my_field))
     else:
         return None
+
+
+def get_resource_types_values(clear_value):
+    """
+        Converts the original resource types of one registry to our own resource type names.
+        * clear_value {list} original resource types, as returned by fields.get_string_list.
+        * {List} Return 'resource type' value adapted to our own necesities.
+    """
+    resource_types = []
+    if isinstance(clear_value, basestring):
+        resource_types = get_resource_types_value(clear_value)
+        return resource_types
+    else:
+        for each_value in clear_value: 
+            resource_types = resource_types + get_resource_types_value(each_value)
+        return resource_types
     
     
 
@@ -223,6 +345,72 @@ def get_insertion_date_field():
     return datetime.datetime.now()
 
 
+def get_registry_record(data):
+    """
+        Get the record to be inserted into the DB for one bio.tools registry.
+        * data {list} one registry's data.
+        * {dict} Return the record, with the fields described in main_options.
+    """
+    return {
+        "title":get_title(data),
+        "description":get_description(data),
+        "link":get_link(data),
+        "field":get_field(data),
+        "source":get_source_field(),
+        "resource_type":get_resource_type_field(data),
+        "insertion_date":get_insertion_date_field()
+    }
+
+
+def get_batch_resource_type(value, resource_types_cache):
+    """
+        Get the resource type of one registry of a batch, as get_resource_type_field does.
+        * value {object} 'resourceType' value of the registry.
+        * resource_types_cache {dict} resource types of the 'resourceType' values already converted in the batch.
+        * {List} Return resource type value.
+    """
+    if not fields.is_simple_string_list(value):
+        return get_resource_types_values(fields.get_string_list(value))
+    key = tuple(value)
+    resource_types = resource_types_cache.get(key)
+    if resource_types is None:
+        resource_types = get_resource_types_values(fields.get_string_list(value))
+        resource_types_cache[key] = resource_types
+    # Records don't share lists, as with get_resource_type_field
+    return list(resource_types)
+
+
+def transform_batch(registries):
+    """
+        Get the records to be inserted into the DB for a whole page of bio.tools registries, in one pass. Records
+        are the ones of get_registry_record, but the fields shared by every record are got once, with one insertion
+        date for the whole page, and repeated 'resourceType' values are converted once.
+        Registries with missing or unexpected values are left to get_registry_record, which logs their errors.
+        * registries {list} registries' data.
+        * {list} Return the records, with the fields described in main_options.
+    """
+    source = get_source_field()
+    insertion_date = get_insertion_date_field()
+    resource_types_cache = {}
+    records = []
+    for data in registries:
+        try:
+            record = {
+                "title":format(data['name']),
+                "description":format(data['description']),
+                "link":format(data['homepage']),
+                "field":[each_field.get('term') for each_field in data['topic']],
+                "source":source,
+                "resource_type":get_batch_resource_type(data['resourceType'], resource_types_cache),
+                "insertion_date":insertion_date
+            }
+        except Exception:
+            record = get_registry_record(data)
+            record['insertion_date'] = insertion_date
+        records.append(record)
+    return records
+
+
 
 def remove_unicode_chars(variable):
     """
@@ -230,22 +418,56 @@ def remove_unicode_chars(variable):
         * variable {string} string variable with Unicode chars. It can contains more than only one different strings. 
         * {list} Return the variables without Unicode chars. None if there is any error.
     """
-    if variable is not None and isinstance(variable, basestring) : 
-        listFull = []
-        strText = variable.replace("[u'", "")
-        strClear = strText.replace("']", "")
-    
-        if re.search("', u'", strClear):
-            array = strClear.split("', u'")
-            for index in array:
-                strEach = index
-                listFull.append(strEach)
-            return listFull
-        else:
-            listFull.append(strClear)
-            return listFull
-    else:
-        return None
+    return fields.split_repr(variable)
+
+
+class RegistrySource(pipeline.SourcePlugin):
+    """
+        Importing of bio.tools registries as a pipeline: pages of registries are fetched, converted into records and
+        inserted into the DB, each step working on a different page at the same time.
+    """
+
+    name = 'elixir_registry'
+
+    def __init__(self, pages, dbWriter, runJournal):
+        """
+            * pages {generator} (page_number, records) tuples, as returned by get_records_numbered_pages.
+            * dbWriter {BulkWriter} writer of the records, bulk_writer.BulkWriter or reconcile.Reconciler.
+            * runJournal {Journal} journal of the run.
+        """
+        self.pages = pages
+        self.dbWriter = dbWriter
+        self.runJournal = runJournal
+
+    def fetch_pages(self):
+        return self.pages
+
+    def prepare_page(self, page):
+        (page_number, records) = page
+        # exists = util.existURL(get_link(record))
+        # logger.info ('Exists? '+get_link(record)+' :'+str(exists))   
+        # if (exists):
+        metrics.increment('records_fetched', len(records))
+        with metrics.timer('transform_seconds'):
+            return (page_number, transform_batch(records))
+
+    def load_page(self, page):
+        (page_number, records) = page
+        # Everything from previous pages is committed before journaling this one
+        self.dbWriter.flush()
+        self.runJournal.page(page_number)
+        for record in records:
+            if self.runJournal.is_committed(record['link']):
+                # Inserted by the previous run, before it died
+                continue
+            self.dbWriter.insert_data(record, self.runJournal.callback_for(None))
+        # Records that don't have to be written are not committed, but a resumed run must know about them too
+        self.runJournal.see([record['link'] for record in records])
+        return len(records)
+
+    def wait_page(self):
+        # Records of the last page are not kept buffered past their age while the next one is fetched
+        self.dbWriter.flush_expired()
 
 
 
@@ -256,19 +478,30 @@ def main():
     """
         Executes main_options function with default configurations
     """
-    main_options(None)
+    return main_options(None)
     
 
     
 def mainFullUpdating():
     """
-        Executes main_options function updating all registries and erasing all previous
+        Executes main_options function updating all registries and synchronising them with previous
         Elixir registry data
     """
     my_options = {}
-    my_options['delete_all_old_data'] = True
+    my_options['reconcile'] = True
+    my_options['updateRegistries'] = True
+    return main_options(my_options)
+    
+    
+def mainStagedFullUpdating():
+    """
+        Executes main_options function loading all registries into the staging dataset, and synchronising previous
+        Elixir registry data with them once they are all loaded and validated
+    """
+    my_options = {}
+    my_options['staging_ds_name'] = staging.DEFAULT_STAGING_DS_NAME
     my_options['updateRegistries'] = True
-    main_options(my_options)
+    return main_options(my_options)
     
     
 def mainFullDeleting():
@@ -278,7 +511,7 @@ def mainFullDeleting():
     my_options = {}
     my_options['delete_all_old_data'] = True
     my_options['updateRegistries'] = False
-    main_options(my_options)
+    return main_options(my_options)
     
     
     
@@ -289,8 +522,17 @@ def main_options(options):
         * options {list} specific configurations for initialization.
             ds_name {string} specific dataset/database to use with the DB manager
             delete_all_old_data {boolean} specifies if we should delete all previous Elixir registry data in our DataBase
+            reconcile {boolean} synchronises the DB with the new data: inserts new records, updates changed ones and
+                deletes the ones not found anymore, instead of inserting everything
+            staging_ds_name {string} dataset where records are loaded before being promoted to ds_name, if any
+            staging_min_records {int} minimum number of staged records to promote them
+            staging_min_ratio {float} minimum number of staged records to promote them, as a share of the live ones
             registriesFromTime {date} time from registries will be obtained
             updateRegistries {boolean} if we want to get new regiestries or not
+            prefetch_pages {int} maximum number of bio.tools pages requested at the same time
+            resume {boolean} continues the previous run with the same options if it didn't finish, skipping the
+                records it already inserted
+            queue_size {int} maximum number of pages waiting between two steps of the importing process
 
             
         In this script we will insert these fields into each registry:
@@ -301,15 +543,45 @@ def main_options(options):
             "source" {string} Default ('ckan');
             "insertion date" {date} Current date and time.
 
+        * {int} Return the number of registries inserted, None if the process was skipped because another one
+            of the Elixir registry was running.
     """
+    init_logger()
     
+    # Only one importing process of each source runs at the same time, even in different processes
+    sourceLock = source_lock.SourceLock(get_source_field())
+    if not sourceLock.acquire():
+        # Nothing is lost: every run loads all bio.tools registries again
+        logger.warning('Skipping Elixir registry importing process: the previous one is still running')
+        return None
+    try:
+        return run_main_options(options)
+    finally:
+        sourceLock.release()
+
+
+def run_main_options(options):
+    """
+        Executes the importing process described in main_options, once the lock of the source is held.
+        * options {list} specific configurations for initialization, see main_options.
+        * {int} Return the number of registries inserted.
+    """
     init_logger()
+    # Timers and counters of this run, written at the end of it
+    metrics.reset()
     
     
     ds_name = None
     delete_all_old_data = False
+    reconcile_data = False
+    staging_ds_name = None
+    staging_min_records = staging.DEFAULT_MIN_RECORDS
+    staging_min_ratio = staging.DEFAULT_MIN_RATIO
     registriesFromTime = None
     updateRegistries = True
+    prefetch_pages = BIOTOOLS_PAGE_PREFETCH
+    resume = False
+    queue_size = pipeline.DEFAULT_QUEUE_SIZE
 
     if options is not None:
         logger.info ('>> Starting Elixir registry importing process... params: ')
@@ -319,34 +591,55 @@ def main_options(options):
         if ('delete_all_old_data' in options.keys()):
             delete_all_old_data = options['delete_all_old_data']
             logger.info ('delete_all_old_data='+str(delete_all_old_data))
+        if ('reconcile' in options.keys()):
+            reconcile_data = options['reconcile']
+            logger.info ('reconcile='+str(reconcile_data))
+        if ('staging_ds_name' in options.keys()):
+            staging_ds_name = options['staging_ds_name']
+            logger.info ('staging_ds_name='+str(staging_ds_name))
+        if ('staging_min_records' in options.keys()):
+            staging_min_records = options['staging_min_records']
+            logger.info ('staging_min_records='+str(staging_min_records))
+        if ('staging_min_ratio' in options.keys()):
+            staging_min_ratio = options['staging_min_ratio']
+            logger.info ('staging_min_ratio='+str(staging_min_ratio))
         if ('updateRegistries' in options.keys()):
             updateRegistries = options['updateRegistries']
             logger.info ('updateRegistries='+str(updateRegistries))    
+        if ('prefetch_pages' in options.keys()):
+            prefetch_pages = options['prefetch_pages']
+            logger.info ('prefetch_pages='+str(prefetch_pages))
+        if ('resume' in options.keys()):
+            resume = options['resume']
+            logger.info ('resume='+str(resume))
+        if ('queue_size' in options.keys()):
+            queue_size = options['queue_size']
+            logger.info ('queue_size='+str(queue_size))
 
     else:
         logger.info ('>> Starting Elixir registry importing process...')
 
-    records = None
+    runJournal = None
+    records_pages = None
+    fetchStatus = pipeline.FetchStatus()
     if updateRegistries:         
-        records = get_records()
-    
-    user = None
-    passw = None
-    try:
-        config = ConfigParser.RawConfigParser()
-        config.read('ConfigFile.properties')
-        usertemp = config.get('AuthenticationSection', 'database.user');
-        passwtemp = config.get('AuthenticationSection', 'database.password');
-        user = usertemp
-        passw = passwtemp
-    except Exception as e:
-        logger.info ("Not user info found, using anonymous user... ")
-        logger.info (e)
-            
-    dbFactory = DBFactory()
-    dbManager = dbFactory.get_default_db_manager_with_username(ds_name,user,passw)
-    
-    if (delete_all_old_data is not None and delete_all_old_data):
+        # Progress of the run is journaled, so it can be resumed if it dies halfway
+        runJournal = journal.Journal(get_source_field(), str([delete_all_old_data, reconcile_data, staging_ds_name]), resume)
+        records_pages = get_records_numbered_pages(prefetch_pages, runJournal.get_last_page() or 1, fetchStatus)
+    
+    # DB managers are opened once per process, and reused by all its runs
+    dbManager = db_managers.get_db_manager(ds_name)
+    
+    liveManager = None
+    if staging_ds_name is not None:
+        # Shadow load: records are written to the staging dataset, and promoted to the live one at the end
+        liveManager = dbManager
+        dbManager = db_managers.get_db_manager(staging_ds_name)
+        if runJournal is None or not runJournal.is_resuming():
+            staging.clear(dbManager, get_source_field())
+    
+    # A resumed run must keep the registries inserted before it died
+    if (delete_all_old_data is not None and delete_all_old_data and (runJournal is None or not runJournal.is_resuming())):
         registry_conditions = [['EQ','source',get_source_field()]]
         previous_count = dbManager.count_data_by_conditions(registry_conditions)
         dbManager.delete_data_by_conditions(registry_conditions)
@@ -355,29 +648,35 @@ def main_options(options):
             logger.info ('Deleted '+str( (previous_count-new_count) )+' registries')   
     
         
-    if records is not None:
+    numSuccess = 0
+    if records_pages is not None:
         
-        numSuccess = 0
-        for record in records:
-            # exists = util.existURL(get_link(record))
-            # logger.info ('Exists? '+get_link(record)+' :'+str(exists))   
-            # if (exists):
-                        success = dbManager.insert_data({
-                            "title":get_title(record),
-                            "description":get_description(record),
-                            "link":get_link(record),
-                            "field":get_field(record),
-                            "source":get_source_field(),
-                            "resource_type":get_resource_type_field(record),
-                            "insertion_date":get_insertion_date_field()
-                        })
-                        if success:
-                            numSuccess=numSuccess+1
+        if reconcile_data:
+            dbWriter = reconcile.Reconciler(dbManager, get_source_field())
+        else:
+            dbWriter = bulk_writer.BulkWriter(dbManager)
+        for link in runJournal.get_committed_links()+runJournal.get_seen_links():
+            dbWriter.mark_committed(link)
+        # Fetching, building the records and inserting work at the same time on consecutive pages
+        RegistrySource(records_pages, dbWriter, runJournal).run(queue_size)
+        if not fetchStatus.is_complete():
+            # Registries not fetched are not deleted, and the run can be resumed from the page that failed
+            logger.error ('Elixir registry data could not be fetched completely, the journal of the run is kept to resume it')
                 
+        numSuccess = dbWriter.close(fetchStatus.is_complete())
         logger.info ('Inserted '+str(numSuccess)+' new registries')   
+        if liveManager is not None:
+            staging.promote(dbManager, liveManager, get_source_field(), staging_min_records, staging_min_ratio,
+                            fetchStatus.is_complete())
+        if fetchStatus.is_complete():
+            runJournal.finish()
+        else:
+            runJournal.close()
    
      
     logger.info('<< Finished Elixir registry importing process...')
+    metrics.write_summary(get_source_field())
+    return numSuccess
    
 
 
@@ -0,0 +1,236 @@
+import json
+import time
+import itertools
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import metrics
+
+
+"""
+    Default limits of the buffer of BulkWriter: it is flushed when any of them is reached.
+"""
+DEFAULT_MAX_RECORDS = 500
+DEFAULT_MAX_BYTES = 5*1024*1024
+DEFAULT_MAX_SECONDS = 30
+
+# Name of the DB manager method that inserts a list of records in one call. Managers without it get one
+# insert_data call per record. It returns one boolean per record, or a single boolean for the whole list
+BULK_INSERT_METHOD = 'insert_data_list'
+
+# Classes of the DB managers already reported as not having BULK_INSERT_METHOD
+managers_without_bulk_insert = set()
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('bulk_writer')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_written_conditions(record):
+    """
+        Get the DB conditions that select one record as written by a writer: its link, source, insertion date and
+        content hash, if it has them, so older records with the same link are not selected.
+        * record {dict} record inserted.
+        * {list} Return the conditions.
+    """
+    conditions = [['EQ','link',record.get('link')], ['EQ','source',record.get('source')]]
+    for field in ['insertion_date', 'content_hash']:
+        if record.get(field) is not None:
+            conditions.append(['EQ',field,record.get(field)])
+    return [['AND', conditions]]
+
+
+def get_record_size(record):
+    """
+        Get the approximate size of one record once serialized.
+        * record {dict} record to be inserted.
+        * {int} Return the size in bytes.
+    """
+    try:
+        return len(json.dumps(record, default=str))
+    except Exception:
+        return len(repr(record))
+
+
+class BulkWriter(object):
+    """
+        Buffered writer in front of a DB manager. Records are inserted in batches, flushed when the buffer
+        reaches a number of records, a size in bytes or an age in seconds. The age is checked when records are
+        added, and by flush_expired, which writers call while they wait for more records. Batches are inserted with one call to
+        the BULK_INSERT_METHOD of the manager; managers without it get one insert_data call per record. When a
+        batch fails without telling which of its records were written, each one is looked up in the DB, and only
+        the ones not found are inserted again with insert_data, so the result of every record is known and
+        nothing is written twice.
+    """
+
+    def __init__(self, dbManager, max_records=DEFAULT_MAX_RECORDS, max_bytes=DEFAULT_MAX_BYTES, max_seconds=DEFAULT_MAX_SECONDS):
+        init_logger()
+        self.dbManager = dbManager
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.buffer = []
+        self.callbacks = []
+        self.buffer_bytes = 0
+        self.buffer_since = None
+        self.num_success = 0
+        self.num_failed = 0
+        self.num_batches = 0
+        self.num_recovered_batches = 0
+        self.num_single_inserts = 0
+        self.bulk_insert = getattr(dbManager, BULK_INSERT_METHOD, None)
+        manager_class = type(dbManager).__name__
+        if self.bulk_insert is None and manager_class not in managers_without_bulk_insert:
+            managers_without_bulk_insert.add(manager_class)
+            logger.warning('DB manager '+manager_class+' has no '+BULK_INSERT_METHOD+' method: records are inserted one by one, batching saves no round trips')
+
+    def insert_data(self, record, callback=None):
+        """
+            Adds one record to the buffer, flushing it if any limit is reached.
+            * record {dict} record to be inserted.
+            * callback {function} optional function called with (record, success) once the record is written.
+        """
+        if len(self.buffer) == 0:
+            self.buffer_since = time.time()
+        self.buffer.append(record)
+        self.callbacks.append(callback)
+        self.buffer_bytes = self.buffer_bytes + get_record_size(record)
+        if (len(self.buffer) >= self.max_records or self.buffer_bytes >= self.max_bytes
+                or (time.time() - self.buffer_since) >= self.max_seconds):
+            self.flush()
+
+    def flush(self):
+        """
+            Writes all buffered records.
+            * {int} Return the number of records successfully inserted in this flush.
+        """
+        if len(self.buffer) == 0:
+            return 0
+        records = self.buffer
+        callbacks = self.callbacks
+        self.buffer = []
+        self.callbacks = []
+        self.buffer_bytes = 0
+        self.buffer_since = None
+
+        if self.bulk_insert is None:
+            # Callbacks are called as soon as each record is written, so they never miss a written record
+            results = (self._insert_one(record) for record in records)
+        else:
+            results = self._insert_batch(records)
+            if results is None:
+                self.num_recovered_batches = self.num_recovered_batches + 1
+                results = (self._recover_one(record) for record in records)
+
+        inserted = 0
+        for (record, callback, success) in itertools.izip(records, callbacks, results):
+            if success:
+                inserted = inserted + 1
+            if callback is not None:
+                callback(record, success)
+        self.num_success = self.num_success + inserted
+        self.num_failed = self.num_failed + len(records) - inserted
+        metrics.increment('records_inserted', inserted)
+        metrics.increment('records_failed', len(records) - inserted)
+        return inserted
+
+    def flush_expired(self):
+        """
+            Writes all buffered records if the oldest of them is older than max_seconds. It's called while no
+            records are added, so records don't stay buffered past their age when the next ones are slow to come.
+            * {int} Return the number of records successfully inserted, 0 if the buffer was not flushed.
+        """
+        if self.buffer_since is None or (time.time() - self.buffer_since) < self.max_seconds:
+            return 0
+        return self.flush()
+
+    def mark_committed(self, link):
+        """
+            Takes into account one record written or seen by a previous, interrupted run. Nothing has to be done here,
+            it's only needed by writers that keep track of all records, like reconcile.Reconciler.
+            * link {string} link of the record.
+        """
+        pass
+
+    def close(self, complete=True):
+        """
+            Writes all pending records. The writer can't be used after closing it.
+            * complete {boolean} if the records written are all the records of the source. Nothing has to be done
+                with it here, it's only needed by writers that keep track of all records, like reconcile.Reconciler.
+            * {int} Return the total number of records successfully inserted.
+        """
+        self.flush()
+        if self.num_success+self.num_failed > 0:
+            logger.info('Inserted '+str(self.num_success)+' records, '+str(self.num_failed)+' failed: '
+                        +str(self.num_batches)+' batches ('+str(self.num_recovered_batches)+' of them failed and recovered), '
+                        +str(self.num_single_inserts)+' records inserted one by one')
+        return self.num_success
+
+    def _insert_batch(self, records):
+        # Returns one boolean per record, or None if it's unknown which records of the batch were written
+        metrics.increment('db_calls')
+        self.num_batches = self.num_batches + 1
+        try:
+            with metrics.timer('db_insert_batch_seconds'):
+                result = self.bulk_insert(records)
+        except Exception as e:
+            logger.error('Exception inserting a batch of '+str(len(records))+' records, checking which ones were written')
+            logger.error(e)
+            return None
+        if isinstance(result, (list, tuple)):
+            if len(result) == len(records):
+                # Records reported as failed are known not to be written, they are not inserted again
+                return [bool(success) for success in result]
+        elif result:
+            return [True]*len(records)
+        logger.error('Error inserting a batch of '+str(len(records))+' records, checking which ones were written')
+        return None
+
+    def _recover_one(self, record):
+        # Records of a failed batch that were written anyway are not inserted again
+        metrics.increment('db_calls')
+        try:
+            with metrics.timer('db_query_seconds'):
+                written = self.dbManager.count_data_by_conditions(get_written_conditions(record))
+        except Exception as e:
+            logger.error('Exception checking if one record of a failed batch was written')
+            logger.error(e)
+            written = None
+        if written is not None and written > 0:
+            return True
+        return self._insert_one(record)
+
+    def _insert_one(self, record):
+        metrics.increment('db_calls')
+        self.num_single_inserts = self.num_single_inserts + 1
+        try:
+            with metrics.timer('db_insert_seconds'):
+                return bool(self.dbManager.insert_data(record))
+        except Exception as e:
+            logger.error('Exception inserting one record')
+            logger.error(e)
+            return False
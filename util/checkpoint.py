@@ -0,0 +1,159 @@
+import os
+import json
+from datetime import datetime
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import util
+
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('checkpoint')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_checkpoint_path(source):
+    """
+        Get the file where the checkpoint of one source is stored. Each source has its own file, so jobs of
+        different sources never overwrite each other's checkpoints.
+        * source {string} source token.
+        * {string} Return the path of the file.
+    """
+    return os.path.join(util.get_state_directory(), 'checkpoint-'+source+'.json')
+
+
+def read_checkpoint(source):
+    """
+        Reads the checkpoint of one source.
+        * source {string} source token.
+        * {tuple} Return (value, keys): the maximum creation date ingested and the keys of the records ingested with
+            exactly that date. (None, []) if there is no checkpoint.
+    """
+    init_logger()
+    path = get_checkpoint_path(source)
+    if not os.path.isfile(path):
+        return (None, [])
+    try:
+        with open(path) as checkpoint_file:
+            data = json.load(checkpoint_file)
+        return (datetime.strptime(data['value'], DATETIME_FORMAT), data.get('keys', []))
+    except Exception as e:
+        logger.error('Exception reading checkpoint of '+source+', ignoring it')
+        logger.error(e)
+        return (None, [])
+
+
+def write_checkpoint(source, value, keys):
+    """
+        Stores the checkpoint of one source, atomically.
+        * source {string} source token.
+        * value {datetime} maximum creation date ingested.
+        * keys {list} keys of the records ingested with exactly that date.
+    """
+    init_logger()
+    content = json.dumps({'value': value.strftime(DATETIME_FORMAT), 'keys': sorted(keys),
+                          'updated': datetime.now().strftime(DATETIME_FORMAT)})
+    util.write_file_atomically(get_checkpoint_path(source), content)
+
+
+class HighWaterMark(object):
+    """
+        Tracks the maximum creation date of the records actually ingested from one source, so the next incremental
+        run resumes exactly from it. Records ingested with exactly that date are remembered by key, so they are
+        not inserted again when the next run asks for records from that same date on.
+    """
+
+    def __init__(self, source, value_field='created', key_field='link'):
+        self.source = source
+        self.value_field = value_field
+        self.key_field = key_field
+        (self.previous_value, previous_keys) = read_checkpoint(source)
+        self.previous_keys = set(previous_keys)
+        self.value = self.previous_value
+        self.keys = set(previous_keys)
+
+    def get_value(self):
+        """
+            Get the value stored by the previous run.
+            * {datetime} Return the maximum creation date ingested, None if there is no checkpoint.
+        """
+        return self.previous_value
+
+    def is_ingested(self, value, key):
+        """
+            Returns if one record was already ingested by a previous run.
+            * value {datetime} creation date of the record.
+            * key {string} key of the record.
+            * {boolean} Return True if the record was ingested exactly at the checkpoint.
+        """
+        return value is not None and value == self.previous_value and key in self.previous_keys
+
+    def observe(self, value, key):
+        """
+            Takes into account one ingested record.
+            * value {datetime} creation date of the record.
+            * key {string} key of the record.
+        """
+        if value is None:
+            return
+        if self.value is None or value > self.value:
+            self.value = value
+            self.keys = set([key])
+        elif value == self.value:
+            self.keys.add(key)
+
+    def record_written(self, record, success):
+        """
+            Callback for bulk_writer.BulkWriter: takes into account every record successfully inserted.
+            * record {dict} record inserted.
+            * success {boolean} result of the insertion.
+        """
+        if success:
+            self.observe(record.get(self.value_field), record.get(self.key_field))
+
+    def callback_for(self, value):
+        """
+            Get a callback for bulk_writer.BulkWriter that takes into account one record, when its checkpoint value
+            isn't one of its fields.
+            * value {datetime} checkpoint value of the record.
+            * {function} Return the callback.
+        """
+        def record_written(record, success):
+            if success:
+                self.observe(value, record.get(self.key_field))
+        return record_written
+
+    def save(self):
+        """
+            Stores the new checkpoint, if any record newer than the previous one was ingested.
+        """
+        if self.value is None or (self.value == self.previous_value and self.keys == self.previous_keys):
+            return
+        write_checkpoint(self.source, self.value, list(self.keys))
+        logger.info('New checkpoint of '+self.source+': '+str(self.value))
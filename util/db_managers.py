@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import threading
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import ConfigParser
+
+# Importing db manager
+sys.path.insert(0, '../../resource-contextualization-import-db/abstraction')
+from DB_Factory import DBFactory
+
+
+
+# DB managers already opened by this process, by (process id, dataset name)
+managers = {}
+managers_lock = threading.Lock()
+
+# Credentials read from ConfigFile.properties by this process, by process id
+credentials = {}
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('db_managers')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_credentials():
+    """
+        Get the user and password of the DB, from the 'AuthenticationSection' of ConfigFile.properties. The file is
+        only read the first time in each process.
+        * {tuple} Return (user, password). (None, None) if there are no credentials, to use the anonymous user.
+    """
+    init_logger()
+    pid = os.getpid()
+    if pid not in credentials:
+        user = None
+        passw = None
+        try:
+            config = ConfigParser.RawConfigParser()
+            config.read('ConfigFile.properties')
+            usertemp = config.get('AuthenticationSection', 'database.user');
+            passwtemp = config.get('AuthenticationSection', 'database.password');
+            user = usertemp
+            passw = passwtemp
+        except Exception as e:
+            logger.info ("Not user info found, using anonymous user... ")
+            logger.info (e)
+        credentials[pid] = (user, passw)
+    return credentials[pid]
+
+
+def get_db_manager(ds_name=None):
+    """
+        Get the DB manager of one dataset. Every process opens each dataset only once, and then reuses its manager
+        in all the runs of the importing scripts.
+        * ds_name {string} dataset/database to use. The default one if it's None.
+        * {AbstractManager} Return the DB manager.
+    """
+    init_logger()
+    # Connections can't be shared with forked processes, so every process has its own managers
+    key = (os.getpid(), ds_name)
+    if key not in managers:
+        with managers_lock:
+            if key not in managers:
+                (user, passw) = get_credentials()
+                open_start = time.time()
+                dbFactory = DBFactory()
+                managers[key] = dbFactory.get_default_db_manager_with_username(ds_name,user,passw)
+                logger.info('Opened DB manager of dataset '+str(ds_name)+' in '+str(round(time.time()-open_start, 3))+' s')
+    return managers[key]
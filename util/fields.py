@@ -0,0 +1,111 @@
+import re
+import ast
+from datetime import datetime
+
+
+"""
+    Typed extraction of field values from the decoded JSON of the upstreams (Solr documents, CKAN packages,
+    bio.tools tools). Getters used to turn values into their repr with format() and parse it back with string
+    replaces or eval(); these functions read the values directly and return the same results, only falling back
+    to the old parsing for the values whose repr it mangles.
+"""
+
+# Returned by the typed getters when the field can't be read, where the string getters returned None
+NOT_FOUND = object()
+
+# Strings whose repr is u'<string>': printable ASCII without quotes or backslashes, which repr escapes. Brackets
+# are left out too, and ', u', as next to the quotes of the repr they look like the separators split_repr removes
+SIMPLE_STRING = re.compile(r"[ -&(-Z^-~]*\Z")
+AMBIGUOUS_STRING = u', u'
+
+# repr of a list of simple strings, as some upstreams store lists, e.g. "['Students', 'Researchers']"
+SIMPLE_LIST_REPR = re.compile(r"\[(u?'[ -&(-\[\]-~]*'(, u?'[ -&(-\[\]-~]*')*)?\]\Z")
+SIMPLE_LIST_REPR_ITEM = re.compile(r"(u?)'([ -&(-\[\]-~]*)'")
+
+# Date formats of the upstreams that are parsed without strptime, with the regular expression of their usual form
+FAST_DATE_FORMATS = {
+    '%Y-%m-%dT%H:%M:%SZ': re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})Z\Z"),
+    '%Y-%m-%dT%H:%M:%S.%f': re.compile(r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})\.(\d{1,6})\Z")
+}
+
+
+def split_repr(text):
+    """
+        Splits the repr of a list of unicode strings into its strings, removing the "[u'", "', u'" and "']" around them.
+        * text {string} repr of the list. It can be the repr of one string too.
+        * {list} Return the strings. None if text isn't a string.
+    """
+    if text is not None and isinstance(text, basestring):
+        text = text.replace("[u'", "").replace("']", "")
+        if "', u'" in text:
+            return text.split("', u'")
+        return [text]
+    return None
+
+
+def is_simple_string_list(value):
+    """
+        * value {object} value of one field.
+        * {boolean} Return True if the value is a non-empty list of unicode strings whose repr isn't escaped.
+    """
+    if not isinstance(value, list) or len(value) == 0:
+        return False
+    for item in value:
+        if not isinstance(item, unicode) or SIMPLE_STRING.match(item) is None or item == AMBIGUOUS_STRING:
+            return False
+    return True
+
+
+def get_string_list(value):
+    """
+        Get the strings of one field, as split_repr(format(value)) does.
+        * value {object} value of one field, as decoded from JSON: usually a list of unicode strings.
+        * {list} Return the strings.
+    """
+    if is_simple_string_list(value):
+        return [str(item) for item in value]
+    # The repr of empty lists, escaped strings and other values is split as it always was
+    return split_repr(format(value))
+
+
+def get_list(value):
+    """
+        Get the items of one field whose value is a list, as eval(format(value)) does, without evaluating anything.
+        * value {object} value of one field, as decoded from JSON.
+        * {object} Return the value itself if it's a list. Other values are parsed back from their repr.
+    """
+    if isinstance(value, list):
+        return value
+    return ast.literal_eval(format(value))
+
+
+def get_literal(text):
+    """
+        Parses one field whose value is the repr of a list, as eval(text) does, without evaluating anything.
+        * text {string} repr of the list, e.g. "['Students', 'Researchers']".
+        * {object} Return the parsed value. It raises ValueError or SyntaxError if text isn't a literal.
+    """
+    if isinstance(text, basestring) and SIMPLE_LIST_REPR.match(text) is not None:
+        # Quoted strings are bytes, except the u'' ones, as they are for eval
+        return [unicode(item) if prefix else str(item) for (prefix, item) in SIMPLE_LIST_REPR_ITEM.findall(text)]
+    return ast.literal_eval(text)
+
+
+def get_datetime(text, date_format):
+    """
+        Parses one date, as datetime.strptime(text, date_format) does. The usual forms of the formats in
+        FAST_DATE_FORMATS are parsed without strptime, which is much slower.
+        * text {string} date.
+        * date_format {string} strptime format of the date.
+        * {datetime} Return the date. It raises ValueError if text doesn't match the format.
+    """
+    pattern = FAST_DATE_FORMATS.get(date_format)
+    if pattern is not None and isinstance(text, basestring):
+        match = pattern.match(text)
+        if match is not None:
+            parts = match.groups()
+            microsecond = 0
+            if len(parts) > 6:
+                microsecond = int(parts[6].ljust(6, '0'))
+            return datetime(int(parts[0]), int(parts[1]), int(parts[2]), int(parts[3]), int(parts[4]), int(parts[5]), microsecond)
+    return datetime.strptime(text, date_format)
@@ -0,0 +1,229 @@
+import os
+import threading
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import ConfigParser
+
+import metrics
+
+
+"""
+    Default configuration of the HTTP client shared by all importing scripts. It can be overwritten through
+    the 'HttpSection' of ConfigFile.properties:
+        http.pool_connections   number of hosts whose connections are kept alive
+        http.pool_maxsize       maximum number of connections kept alive for each host
+        http.connect_timeout    seconds to wait for a connection to be established
+        http.read_timeout       seconds to wait for data from the server
+"""
+DEFAULT_POOL_CONNECTIONS = 100
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+
+# Status codes returned by servers that don't accept HEAD requests
+HEAD_NOT_SUPPORTED_CODES = [403, 405, 501]
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('http_client')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+session = None
+session_pid = None
+session_lock = threading.Lock()
+default_timeout = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+
+# Bytes received by the shared session: 'wire_bytes' as sent by the servers (maybe compressed) and
+# 'decoded_bytes' once decompressed. Streamed responses are not counted.
+transfer_stats = {'requests': 0, 'wire_bytes': 0, 'decoded_bytes': 0}
+transfer_stats_lock = threading.Lock()
+
+
+def read_config():
+    """
+        Reads the HTTP client configuration from ConfigFile.properties.
+        * {dict} Return the pool sizes and timeouts to use.
+    """
+    http_config = {
+        'pool_connections': DEFAULT_POOL_CONNECTIONS,
+        'pool_maxsize': DEFAULT_POOL_MAXSIZE,
+        'connect_timeout': DEFAULT_CONNECT_TIMEOUT,
+        'read_timeout': DEFAULT_READ_TIMEOUT
+    }
+    try:
+        config = ConfigParser.RawConfigParser()
+        config.read('ConfigFile.properties')
+        if config.has_section('HttpSection'):
+            for option in ['pool_connections', 'pool_maxsize']:
+                if config.has_option('HttpSection', 'http.'+option):
+                    http_config[option] = config.getint('HttpSection', 'http.'+option)
+            for option in ['connect_timeout', 'read_timeout']:
+                if config.has_option('HttpSection', 'http.'+option):
+                    http_config[option] = config.getfloat('HttpSection', 'http.'+option)
+    except Exception as e:
+        logger.error('Exception reading HTTP configuration, using default values')
+        logger.error(e)
+    return http_config
+
+
+def count_transfer(response, *args, **kwargs):
+    """
+        Response hook of the shared session that updates transfer_stats and the metrics of this process.
+        * response {requests.Response} response received.
+    """
+    metrics.increment('http_requests')
+    metrics.observe('http_request_seconds', response.elapsed.total_seconds())
+    if kwargs.get('stream'):
+        return response
+    try:
+        decoded_bytes = len(response.content)
+        wire_bytes = None
+        try:
+            wire_bytes = response.raw.tell()
+        except Exception:
+            pass
+        if not wire_bytes:
+            wire_bytes = int(response.headers.get('Content-Length', decoded_bytes))
+        with transfer_stats_lock:
+            transfer_stats['requests'] = transfer_stats['requests'] + 1
+            transfer_stats['wire_bytes'] = transfer_stats['wire_bytes'] + wire_bytes
+            transfer_stats['decoded_bytes'] = transfer_stats['decoded_bytes'] + decoded_bytes
+        metrics.increment('http_wire_bytes', wire_bytes)
+        metrics.increment('http_decoded_bytes', decoded_bytes)
+    except Exception as e:
+        logger.error('Exception counting transferred bytes')
+        logger.error(e)
+    return response
+
+
+def get_transfer_stats():
+    """
+        Get the bytes received by the shared session of this process until now.
+        * {dict} Return a copy of transfer_stats.
+    """
+    with transfer_stats_lock:
+        return dict(transfer_stats)
+
+
+def get_transfer_stats_since(previous_stats):
+    """
+        Get the bytes received by the shared session since one previous call to get_transfer_stats.
+        * previous_stats {dict} value returned by get_transfer_stats.
+        * {dict} Return the difference between the current transfer_stats and previous_stats.
+    """
+    current_stats = get_transfer_stats()
+    return dict([(key, current_stats[key] - previous_stats.get(key, 0)) for key in current_stats])
+
+
+def get_session():
+    """
+        Get the HTTP session shared by all importing scripts of this process. Connections are pooled per host
+        and kept alive, and responses are requested gzip-compressed.
+        * {requests.Session} Return the shared session.
+    """
+    global session, session_pid, default_timeout
+    init_logger()
+    # Sockets can't be shared with forked processes, so every process has its own session
+    if session is None or session_pid != os.getpid():
+        with session_lock:
+            if session is None or session_pid != os.getpid():
+                http_config = read_config()
+                new_session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=http_config['pool_connections'], pool_maxsize=http_config['pool_maxsize'])
+                new_session.mount('http://', adapter)
+                new_session.mount('https://', adapter)
+                new_session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+                new_session.hooks['response'].append(count_transfer)
+                default_timeout = (http_config['connect_timeout'], http_config['read_timeout'])
+                session = new_session
+                session_pid = os.getpid()
+    return session
+
+
+def get(url, params=None, timeout=None, stream=False):
+    """
+        Makes a GET request through the shared session.
+        * url {string} URL to request.
+        * params {dict} query parameters of the request.
+        * timeout {float or tuple} seconds to wait for the server. The configured timeouts are used if it's None.
+        * stream {boolean} if True, the body is not downloaded until it is read.
+        * {requests.Response} Return the response. Raises an exception if the request fails.
+    """
+    my_session = get_session()
+    if timeout is None:
+        timeout = default_timeout
+    return my_session.get(url, params=params, timeout=timeout, stream=stream)
+
+
+def get_json(url, params=None, timeout=None):
+    """
+        Makes a GET request through the shared session and decodes its JSON body.
+        * url {string} URL to request.
+        * params {dict} query parameters of the request.
+        * timeout {float or tuple} seconds to wait for the server. The configured timeouts are used if it's None.
+        * {dict} Return the decoded JSON. Raises an exception if the request fails or the status is not 2xx.
+    """
+    response = get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_status_code(url, timeout=None):
+    """
+        Get the HTTP status code of one url, following redirections. A HEAD request is made first, and the
+        body is only streamed with a GET request if the server doesn't accept HEAD requests.
+        * url {string} URL to check.
+        * timeout {float or tuple} seconds to wait for the server. The configured timeouts are used if it's None.
+        * {int} Return the HTTP status code. Raises an exception if the server can't be reached.
+    """
+    my_session = get_session()
+    if timeout is None:
+        timeout = default_timeout
+    response = my_session.head(url, timeout=timeout, allow_redirects=True)
+    response.close()
+    if response.status_code in HEAD_NOT_SUPPORTED_CODES:
+        response = my_session.get(url, timeout=timeout, stream=True)
+        # We don't need the body, so we stop here without downloading it
+        response.close()
+    return response.status_code
+
+
+def is_available(url, timeout=None):
+    """
+        Returns if the url is available or not.
+        * url {string} URL to check.
+        * timeout {float or tuple} seconds to wait for the server. The configured timeouts are used if it's None.
+        * {boolean} Return True if the url answers with a 2xx or 3xx status code, False otherwise.
+    """
+    try:
+        return get_status_code(url, timeout) < 400
+    except Exception:
+        return False
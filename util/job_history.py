@@ -0,0 +1,86 @@
+import os
+import json
+import threading
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import util
+
+
+# Maximum number of executions kept in the history: the oldest ones are dropped
+DEFAULT_MAX_ENTRIES = 1000
+
+HISTORY_FILE_NAME = 'job-history.json'
+
+history_lock = threading.Lock()
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('job_history')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_history_path():
+    """
+        * {string} Return the path of the file where the history of executions is kept.
+    """
+    return os.path.join(util.get_state_directory(), HISTORY_FILE_NAME)
+
+
+def read_history(job=None):
+    """
+        Reads the history of executions of the synchronisation jobs.
+        * job {string} name of the job whose executions are returned. All executions are returned if it's None.
+        * {list} Return the executions, oldest first. Each one is a dict with 'job', 'start', 'end', 'duration',
+            'records' and 'error' fields.
+    """
+    init_logger()
+    path = get_history_path()
+    if not os.path.isfile(path):
+        return []
+    try:
+        with open(path) as history_file:
+            entries = json.load(history_file)
+    except Exception as e:
+        logger.error('Exception reading job history, ignoring it')
+        logger.error(e)
+        return []
+    if job is None:
+        return entries
+    return [entry for entry in entries if entry.get('job') == job]
+
+
+def add_entry(entry, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+        Adds one execution to the history, dropping the oldest ones if there are more than max_entries.
+        * entry {dict} execution of one job, as described in read_history.
+        * max_entries {int} maximum number of executions kept.
+    """
+    init_logger()
+    with history_lock:
+        entries = read_history()
+        entries.append(entry)
+        util.write_file_atomically(get_history_path(), json.dumps(entries[-max_entries:], default=str))
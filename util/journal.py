@@ -0,0 +1,203 @@
+import os
+import json
+from datetime import datetime
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import util
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('journal')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_journal_path(name):
+    """
+        Get the file of the journal of one importing process.
+        * name {string} name of the journal, usually the source token.
+        * {string} Return the path of the file.
+    """
+    return os.path.join(util.get_state_directory(), 'journal-'+name+'.log')
+
+
+class Journal(object):
+    """
+        Write-ahead progress journal of one importing run. It records, line by line, the pages fetched, the keys
+        of the records committed to the DB and the links of all the records of each page, even the ones that didn't
+        have to be written (unchanged, repeated...), so writers that keep track of all the records of the source
+        know about the ones of the pages skipped when resuming. The file is removed when the run finishes, so if it exists at the
+        beginning of a run, the previous one died halfway: a run started with resume=True then skips the records
+        already committed and continues from the last page recorded.
+        Runs can only be resumed by runs with the same signature (same kind of update, same starting time...).
+    """
+
+    def __init__(self, name, signature, resume=False):
+        init_logger()
+        self.name = name
+        self.signature = signature
+        self.path = get_journal_path(name)
+        self.committed = {}
+        self.seen = set()
+        self.last_page = None
+        self.resuming = False
+        if resume:
+            self.load()
+        if self.resuming:
+            logger.info('Resuming '+name+' run: '+str(len(self.committed))+' records already committed, '+str(len(self.seen))
+                        +' records seen, last page '+str(self.last_page))
+            self.journal_file = open(self.path, 'a')
+        else:
+            self.journal_file = open(self.path, 'w')
+            self.append({'event': 'start', 'signature': signature, 'time': datetime.now().isoformat()}, durable=True)
+
+    def load(self):
+        """
+            Reads the journal left by an unfinished previous run, if it has the same signature as this one.
+        """
+        if not os.path.isfile(self.path):
+            return
+        committed = {}
+        seen = set()
+        last_page = None
+        signature = None
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line can be incomplete if the process died while writing it
+                    break
+                if entry.get('event') == 'start':
+                    signature = entry.get('signature')
+                elif entry.get('event') == 'page':
+                    last_page = entry.get('marker')
+                elif entry.get('event') == 'commit':
+                    committed[entry.get('key')] = entry.get('link')
+                elif entry.get('event') == 'seen':
+                    seen.update(entry.get('links', []))
+        if signature != self.signature:
+            logger.info('Previous '+self.name+' run had a different signature, starting from the beginning')
+            return
+        self.committed = committed
+        self.seen = seen
+        self.last_page = last_page
+        self.resuming = True
+
+    def append(self, entry, durable=False):
+        self.journal_file.write(json.dumps(entry)+'\n')
+        self.journal_file.flush()
+        if durable:
+            os.fsync(self.journal_file.fileno())
+
+    def is_resuming(self):
+        """
+            * {boolean} Return True if this run continues an unfinished previous one.
+        """
+        return self.resuming
+
+    def get_last_page(self):
+        """
+            * {object} Return the marker of the last page recorded by the previous run, None if there isn't any.
+        """
+        return self.last_page
+
+    def get_committed_links(self):
+        """
+            * {list} Return the links of the records committed by the previous run.
+        """
+        return [link for link in self.committed.values() if link is not None]
+
+    def get_seen_links(self):
+        """
+            * {list} Return the links of all the records the previous run gave to its writer, written or not.
+        """
+        return [link for link in self.seen if link is not None]
+
+    def is_committed(self, key):
+        """
+            Returns if one record was already committed.
+            * key {string} key of the record.
+            * {boolean} Return True if the record was committed by this run or the one it continues.
+        """
+        return key in self.committed
+
+    def page(self, marker):
+        """
+            Records that a page starts to be processed. Every record of the previous pages must be committed before
+            calling it, because a resumed run will continue from this page.
+            * marker {object} what is needed to fetch the page again (cursor, offset, page number...).
+        """
+        self.last_page = marker
+        self.append({'event': 'page', 'marker': marker}, durable=True)
+
+    def see(self, links):
+        """
+            Records the links of all the records of one page given to the writer, whether they have to be written or
+            not. They must be recorded before the next page is.
+            * links {list} links of the records.
+        """
+        self.seen.update(links)
+        self.append({'event': 'seen', 'links': links})
+
+    def commit(self, key, link=None):
+        """
+            Records that one record is committed to the DB.
+            * key {string} key of the record.
+            * link {string} link of the record, if the key is not the link itself.
+        """
+        self.committed[key] = link
+        self.append({'event': 'commit', 'key': key, 'link': link})
+
+    def callback_for(self, key, callback=None):
+        """
+            Get a callback for bulk_writer.BulkWriter that commits one record once it is successfully written.
+            * key {string} key of the record. If it's None, the 'link' field of the record is used.
+            * callback {function} another callback to call after it, if any.
+            * {function} Return the callback.
+        """
+        def record_written(record, success):
+            if success:
+                if key is None:
+                    self.commit(record.get('link'), record.get('link'))
+                else:
+                    self.commit(key, record.get('link'))
+            if callback is not None:
+                callback(record, success)
+        return record_written
+
+    def close(self):
+        """
+            Closes the journal of an unfinished run, keeping it so the next run can resume it.
+        """
+        self.journal_file.close()
+
+    def finish(self):
+        """
+            Closes the journal of a finished run, removing it.
+        """
+        self.journal_file.close()
+        os.remove(self.path)
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import bisect
+import threading
+from datetime import datetime
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import ConfigParser
+
+import util
+
+
+"""
+    Default configuration of the metrics written at the end of each importing process. It can be overwritten
+    through the 'MetricsSection' of ConfigFile.properties:
+        metrics.directory   directory where the summaries are written
+        metrics.format      'json' for a JSON summary, 'prometheus' for a Prometheus text file, 'both' or 'none'
+"""
+DEFAULT_METRICS_DIRECTORY = '../../resource-contextualization-metrics'
+DEFAULT_METRICS_FORMAT = 'json'
+
+# Upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Prefix of the names of the metrics in Prometheus text files
+PROMETHEUS_PREFIX = 'resource_import_'
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('metrics')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+class Histogram(object):
+    """
+        Distribution of the latencies of one kind of call, in the buckets of LATENCY_BUCKETS.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0]*(len(LATENCY_BUCKETS)+1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def get_quantile(self, quantile):
+        """
+            * quantile {float} quantile, between 0 and 1.
+            * {float} Return the upper bound of the bucket where the quantile is, or the maximum latency if it's
+                over the last bucket. None if nothing was observed.
+        """
+        if self.count == 0:
+            return None
+        accumulated = 0
+        for (index, bucket_count) in enumerate(self.bucket_counts):
+            accumulated = accumulated + bucket_count
+            if accumulated >= quantile*self.count:
+                if index < len(LATENCY_BUCKETS):
+                    return min(LATENCY_BUCKETS[index], self.max)
+                return self.max
+        return self.max
+
+    def get_summary(self):
+        """
+            * {dict} Return the count, sum, min, max, mean and approximate p50, p90 and p99 of the latencies.
+        """
+        summary = {'count': self.count, 'sum': round(self.sum, 6), 'min': self.min, 'max': self.max, 'mean': None}
+        if self.count > 0:
+            summary['mean'] = round(self.sum/self.count, 6)
+        for quantile in [0.5, 0.9, 0.99]:
+            summary['p'+str(int(quantile*100))] = self.get_quantile(quantile)
+        return summary
+
+
+"""
+    Metrics of the importing process running in this process. Each process of the synchronizer pool runs one
+    importing process at a time, so they are reset at the beginning of each one.
+"""
+counters = {}
+histograms = {}
+metrics_lock = threading.Lock()
+started = time.time()
+
+
+def reset():
+    """
+        Forgets all the metrics collected until now.
+    """
+    global started
+    with metrics_lock:
+        counters.clear()
+        histograms.clear()
+        started = time.time()
+
+
+def increment(name, value=1):
+    """
+        Increments one counter.
+        * name {string} name of the counter.
+        * value {int} value to add to the counter.
+    """
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    """
+        Adds one latency to one histogram.
+        * name {string} name of the histogram, usually ending with '_seconds'.
+        * seconds {float} latency of one call.
+    """
+    with metrics_lock:
+        if name not in histograms:
+            histograms[name] = Histogram()
+        histograms[name].observe(seconds)
+
+
+class Timer(object):
+    """
+        Context manager that adds the time spent in its block to one histogram.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        observe(self.name, time.time()-self.start)
+        return False
+
+
+def timer(name):
+    """
+        Get a context manager that adds the time spent in its block to one histogram:
+            with metrics.timer('db_insert_seconds'):
+                ...
+        * name {string} name of the histogram.
+        * {Timer} Return the context manager.
+    """
+    return Timer(name)
+
+
+def get_snapshot():
+    """
+        * {dict} Return the 'counters' and the summaries of the 'histograms' collected until now, and the
+            'elapsed' seconds since the last reset.
+    """
+    with metrics_lock:
+        return {
+            'elapsed': round(time.time()-started, 3),
+            'counters': dict(counters),
+            'histograms': dict([(name, histogram.get_summary()) for (name, histogram) in histograms.items()])
+        }
+
+
+def get_prometheus_text(source):
+    """
+        Get the metrics collected until now in the Prometheus text format.
+        * source {string} source token, added as a label to every metric.
+        * {string} Return the text.
+    """
+    label = 'source="'+source+'"'
+    lines = []
+    with metrics_lock:
+        lines.append('# TYPE '+PROMETHEUS_PREFIX+'elapsed_seconds gauge')
+        lines.append(PROMETHEUS_PREFIX+'elapsed_seconds{'+label+'} '+str(time.time()-started))
+        for name in sorted(counters):
+            lines.append('# TYPE '+PROMETHEUS_PREFIX+name+'_total counter')
+            lines.append(PROMETHEUS_PREFIX+name+'_total{'+label+'} '+str(counters[name]))
+        for name in sorted(histograms):
+            histogram = histograms[name]
+            lines.append('# TYPE '+PROMETHEUS_PREFIX+name+' histogram')
+            accumulated = 0
+            for (index, bucket_count) in enumerate(histogram.bucket_counts):
+                accumulated = accumulated + bucket_count
+                if index < len(LATENCY_BUCKETS):
+                    bound = str(LATENCY_BUCKETS[index])
+                else:
+                    bound = '+Inf'
+                lines.append(PROMETHEUS_PREFIX+name+'_bucket{'+label+',le="'+bound+'"} '+str(accumulated))
+            lines.append(PROMETHEUS_PREFIX+name+'_sum{'+label+'} '+str(histogram.sum))
+            lines.append(PROMETHEUS_PREFIX+name+'_count{'+label+'} '+str(histogram.count))
+    return '\n'.join(lines)+'\n'
+
+
+def read_config():
+    """
+        Reads the metrics configuration from ConfigFile.properties.
+        * {tuple} Return the (directory, format) to use.
+    """
+    directory = DEFAULT_METRICS_DIRECTORY
+    metrics_format = DEFAULT_METRICS_FORMAT
+    config = ConfigParser.RawConfigParser()
+    config.read('ConfigFile.properties')
+    if config.has_option('MetricsSection', 'metrics.directory'):
+        directory = config.get('MetricsSection', 'metrics.directory')
+    if config.has_option('MetricsSection', 'metrics.format'):
+        metrics_format = config.get('MetricsSection', 'metrics.format')
+    return (directory, metrics_format)
+
+
+def write_summary(source):
+    """
+        Writes the metrics collected until now, as configured in ConfigFile.properties: 'metrics-<source>.json'
+        and/or 'metrics-<source>.prom', replaced at the end of every importing process of the source.
+        * source {string} source token.
+    """
+    init_logger()
+    try:
+        (directory, metrics_format) = read_config()
+        if metrics_format == 'none':
+            return
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if metrics_format in ['json', 'both']:
+            snapshot = get_snapshot()
+            snapshot['source'] = source
+            snapshot['written'] = datetime.now().isoformat()
+            util.write_file_atomically(os.path.join(directory, 'metrics-'+source+'.json'),
+                                       json.dumps(snapshot, indent=2, sort_keys=True))
+        if metrics_format in ['prometheus', 'both']:
+            util.write_file_atomically(os.path.join(directory, 'metrics-'+source+'.prom'), get_prometheus_text(source))
+    except Exception as e:
+        logger.error('Exception writing metrics of '+source)
+        logger.error(e)
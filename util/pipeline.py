@@ -0,0 +1,355 @@
+import sys
+import time
+import threading
+import Queue
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import metrics
+
+
+# Default maximum number of items waiting between two stages. When a queue is full, the stages before it wait
+DEFAULT_QUEUE_SIZE = 2
+
+# Seconds between checks of the stop flag while waiting for a queue
+POLL_INTERVAL = 0.5
+
+# Marks the end of the items of a queue
+END = object()
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('pipeline')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def chunks(iterable, size):
+    """
+        Groups the items of one iterable in lists.
+        * iterable {iterable} items to be grouped.
+        * size {int} maximum number of items of each list.
+        * {generator} Return lists of items, in the same order.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+class Stage(object):
+    """
+        One step of a Pipeline: a function applied to every item, by one or more worker threads.
+        Items leave the stage in the same order they entered it, whatever the number of workers.
+        If the function returns None, the item is dropped. The optional idle function is called by the workers
+        every POLL_INTERVAL seconds while they wait for an item, so it must be thread safe if there are several.
+    """
+
+    def __init__(self, name, function, workers=1, idle=None):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.idle = idle
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+
+
+class Pipeline(object):
+    """
+        Chain of stages connected by bounded queues. Items of the source are produced by their own thread, and
+        every stage runs in its own threads, so all of them work at the same time on different items: e.g. while
+        one page of records is inserted, the next one is being checked and the one after it is being fetched.
+        Queues give backpressure: a stage never gets more than queue_size items ahead of the next one.
+    """
+
+    def __init__(self, source, stages, queue_size=DEFAULT_QUEUE_SIZE, name='pipeline'):
+        init_logger()
+        self.source = source
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.name = name
+        self.source_items = 0
+        self.source_seconds = 0.0
+        self.stopped = threading.Event()
+        self.error = None
+        self.error_lock = threading.Lock()
+
+    def run(self):
+        """
+            Runs the pipeline until all items of the source have gone through all the stages. If any stage fails,
+            the pipeline is stopped and the exception is raised again here.
+            * {int} Return the number of items that went out of the last stage.
+        """
+        start_time = time.time()
+        queues = [Queue.Queue(self.queue_size) for i in range(len(self.stages)+1)]
+        threads = [threading.Thread(target=self._produce, args=(queues[0],))]
+        for (index, stage) in enumerate(self.stages):
+            threads = threads + self._start_stage(stage, queues[index], queues[index+1])
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        num_items = 0
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is END:
+                    break
+                num_items = num_items + 1
+        finally:
+            # Nothing else will be consumed, so all stages must stop if they haven't finished yet
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        self.log_stats(time.time()-start_time)
+        return num_items
+
+    def log_stats(self, elapsed):
+        """
+            Logs how long every stage was working and waiting. Stages that were busy most of the time are the
+            bottleneck of the pipeline.
+            * elapsed {float} total seconds of the run.
+        """
+        logger.info(self.name+' finished in '+str(round(elapsed, 2))+' s: source produced '+str(self.source_items)
+                    +' items in '+str(round(self.source_seconds, 2))+' s')
+        for stage in self.stages:
+            logger.info(self.name+' stage '+stage.name+' ('+str(stage.workers)+' workers): '+str(stage.items)+' items, '
+                        +str(round(stage.busy_seconds, 2))+' s busy, '+str(round(stage.idle_seconds, 2))+' s waiting')
+
+    def stop(self):
+        """
+            Stops all stages, after the items they are processing.
+        """
+        self.stopped.set()
+
+    def _fail(self):
+        with self.error_lock:
+            if self.error is None:
+                self.error = sys.exc_info()
+        self.stop()
+
+    def _put(self, queue, item):
+        while not self.stopped.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get(self, queue, idle=None):
+        while not self.stopped.is_set():
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                if idle is not None:
+                    idle()
+        return END
+
+    def _produce(self, out_queue):
+        try:
+            sequence = 0
+            items = iter(self.source)
+            while not self.stopped.is_set():
+                item_start = time.time()
+                item = next(items, END)
+                self.source_seconds = self.source_seconds + time.time() - item_start
+                if item is END:
+                    break
+                metrics.observe('stage_fetch_seconds', time.time() - item_start)
+                self.source_items = self.source_items + 1
+                if not self._put(out_queue, (sequence, item)):
+                    break
+                sequence = sequence + 1
+        except BaseException:
+            self._fail()
+        finally:
+            if hasattr(self.source, 'close'):
+                self.source.close()
+            self._put(out_queue, END)
+
+    def _start_stage(self, stage, in_queue, out_queue):
+        # Workers may finish items out of order: the collector puts them back in order. The window stops
+        # fast workers from getting too far ahead of a slow one
+        results = Queue.Queue()
+        window = threading.Semaphore(stage.workers+self.queue_size)
+        stats_lock = threading.Lock()
+        threads = [threading.Thread(target=self._work, args=(stage, in_queue, results, window, stats_lock))
+                   for i in range(stage.workers)]
+        threads.append(threading.Thread(target=self._collect, args=(stage, results, out_queue, window)))
+        return threads
+
+    def _work(self, stage, in_queue, results, window, stats_lock):
+        try:
+            while not self.stopped.is_set():
+                wait_start = time.time()
+                # The window is only released by the collector, so it must be acquired before taking an item
+                while not window.acquire(False):
+                    if self.stopped.is_set():
+                        return
+                    time.sleep(0.01)
+                entry = self._get(in_queue, stage.idle)
+                if entry is END:
+                    window.release()
+                    # The other workers of the stage have to see the end too
+                    self._put(in_queue, END)
+                    return
+                work_start = time.time()
+                result = stage.function(entry[1])
+                metrics.observe('stage_'+stage.name+'_seconds', time.time() - work_start)
+                with stats_lock:
+                    stage.idle_seconds = stage.idle_seconds + work_start - wait_start
+                    stage.busy_seconds = stage.busy_seconds + time.time() - work_start
+                    stage.items = stage.items + 1
+                results.put((entry[0], result))
+        except BaseException:
+            self._fail()
+        finally:
+            results.put(END)
+
+    def _collect(self, stage, results, out_queue, window):
+        try:
+            pending = {}
+            next_sequence = 0
+            # Dropped items leave gaps, so items are numbered again for the next stage
+            out_sequence = 0
+            ended_workers = 0
+            while ended_workers < stage.workers:
+                entry = self._get(results)
+                if entry is END:
+                    if self.stopped.is_set():
+                        return
+                    ended_workers = ended_workers + 1
+                    continue
+                pending[entry[0]] = entry[1]
+                while next_sequence in pending:
+                    result = pending.pop(next_sequence)
+                    next_sequence = next_sequence + 1
+                    window.release()
+                    if result is not None:
+                        if not self._put(out_queue, (out_sequence, result)):
+                            return
+                        out_sequence = out_sequence + 1
+        except BaseException:
+            self._fail()
+        finally:
+            self._put(out_queue, END)
+
+
+class FetchStatus(object):
+    """
+        Tells if the fetch of a source got all its data. Fetching functions finish it when they reach the end of the
+        source, and fail it when any page or record can't be got, so the records of a fetch cut short by an error
+        are not taken for the whole source: e.g. records not found in them must not be deleted.
+    """
+
+    def __init__(self):
+        self.finished = False
+        self.failed = False
+
+    def finish(self):
+        """
+            Records that the end of the source was reached.
+        """
+        self.finished = True
+
+    def fail(self):
+        """
+            Records that some data of the source could not be got.
+        """
+        self.failed = True
+
+    def is_complete(self):
+        """
+            * {boolean} Return True if the end of the source was reached without losing any data.
+        """
+        return self.finished and not self.failed
+
+
+class SourcePlugin(object):
+    """
+        Base class of the importing scripts run as a Pipeline. Pages of records are fetched by the source, prepared
+        by the 'prepare' stage (link checking, building the records...) and written to the DB by the 'load' stage,
+        so fetching page k+1, preparing page k and loading page k-1 overlap. The 'load' stage always has one worker,
+        so pages are written one by one and in order.
+        Subclasses implement fetch_pages and load_page, and usually prepare_page.
+    """
+
+    # Name of the source, used in logs
+    name = 'source'
+
+    def fetch_pages(self):
+        """
+            Gets the pages of data of the source.
+            * {generator} Return the pages, in any form understood by prepare_page.
+        """
+        raise NotImplementedError()
+
+    def prepare_page(self, page):
+        """
+            Prepares one page to be loaded. It can be called from several threads at the same time.
+            * page {object} page returned by fetch_pages.
+            * {object} Return the page in any form understood by load_page, None to skip it.
+        """
+        return page
+
+    def load_page(self, page):
+        """
+            Writes one prepared page to the DB.
+            * page {object} page returned by prepare_page.
+            * {int} Return the number of records of the page.
+        """
+        raise NotImplementedError()
+
+    def wait_page(self):
+        """
+            Called by the 'load' stage every POLL_INTERVAL seconds while it waits for the next page, e.g. to write
+            the records buffered by load_page that are too old, when pages are slow to come.
+        """
+        pass
+
+    def get_stages(self, prepare_workers=1):
+        """
+            * prepare_workers {int} number of workers of the 'prepare' stage.
+            * {list} Return the stages of the pipeline.
+        """
+        return [Stage('prepare', self.prepare_page, prepare_workers), Stage('load', self.load_page, idle=self.wait_page)]
+
+    def run(self, queue_size=DEFAULT_QUEUE_SIZE, prepare_workers=1):
+        """
+            Runs the pipeline of this source until all its pages are loaded.
+            * queue_size {int} maximum number of pages waiting between two stages.
+            * prepare_workers {int} number of workers of the 'prepare' stage.
+            * {int} Return the number of pages loaded.
+        """
+        return Pipeline(self.fetch_pages(), self.get_stages(prepare_workers), queue_size, self.name).run()
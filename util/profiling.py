@@ -0,0 +1,243 @@
+import os
+import gc
+import sys
+import time
+import pstats
+import signal
+import resource
+import cProfile
+import threading
+import collections
+from datetime import datetime
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import ConfigParser
+
+# tracemalloc is only available since Python 3.4
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+"""
+    Default configuration of the profiling of synchronisation jobs. It can be overwritten through the
+    'ProfilingSection' of ConfigFile.properties:
+        profiling.enabled       if jobs are profiled
+        profiling.jobs          comma separated names of the jobs to profile (e.g. iannData.mainUpdating), all if empty
+        profiling.directory     directory where profiles are written
+"""
+DEFAULT_PROFILING_ENABLED = False
+DEFAULT_PROFILES_DIRECTORY = '../../resource-contextualization-profiles'
+
+# Number of lines written in the allocations snapshot of each profile
+TOP_ALLOCATIONS = 25
+
+# Profiling can also be switched on and off with this signal, sent to the synchronizer process
+TOGGLE_SIGNAL = signal.SIGUSR1
+
+# Set by the signal handler: profiling is enabled if it's True, whatever the configuration says
+signal_enabled = False
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('profiling')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def read_config():
+    """
+        Reads the profiling configuration from ConfigFile.properties.
+        * {dict} Return 'enabled' {boolean}, 'jobs' {list} and 'directory' {string}.
+    """
+    profiling_config = {'enabled': DEFAULT_PROFILING_ENABLED, 'jobs': [], 'directory': DEFAULT_PROFILES_DIRECTORY}
+    config = ConfigParser.RawConfigParser()
+    config.read('ConfigFile.properties')
+    if config.has_option('ProfilingSection', 'profiling.enabled'):
+        profiling_config['enabled'] = config.getboolean('ProfilingSection', 'profiling.enabled')
+    if config.has_option('ProfilingSection', 'profiling.jobs'):
+        profiling_config['jobs'] = [job.strip() for job in config.get('ProfilingSection', 'profiling.jobs').split(',') if job.strip()]
+    if config.has_option('ProfilingSection', 'profiling.directory'):
+        profiling_config['directory'] = config.get('ProfilingSection', 'profiling.directory')
+    return profiling_config
+
+
+def toggle(signum, frame):
+    """
+        Signal handler that switches profiling on and off.
+    """
+    global signal_enabled
+    init_logger()
+    signal_enabled = not signal_enabled
+    logger.info('Profiling of jobs switched '+('on' if signal_enabled else 'off')+' by signal')
+
+
+def install_signal_handler():
+    """
+        Lets profiling be switched on and off by sending TOGGLE_SIGNAL to this process, e.g. kill -USR1 <pid>.
+    """
+    signal.signal(TOGGLE_SIGNAL, toggle)
+
+
+def get_profiled_directory(job):
+    """
+        Returns if one job has to be profiled, as configured or switched by signal.
+        * job {string} name of the job.
+        * {string} Return the directory where its profile has to be written, None if it's not profiled.
+    """
+    profiling_config = read_config()
+    if not (signal_enabled or profiling_config['enabled']):
+        return None
+    if len(profiling_config['jobs']) > 0 and job not in profiling_config['jobs']:
+        return None
+    return profiling_config['directory']
+
+
+def get_max_rss():
+    """
+        * {int} Return the peak resident memory of this process, in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class JobProfiler(object):
+    """
+        Profiles one execution of a job: CPU time with cProfile, written as a .pstats file, and memory, written as a
+        text snapshot of the top allocations (with tracemalloc) or of the most numerous live objects (without it).
+        cProfile only profiles the thread that enables it, so every thread started while profiling (stages of the
+        importing pipeline, pools checking links...) gets a profile of its own, merged into the .pstats file.
+    """
+
+    def __init__(self, job, directory):
+        init_logger()
+        self.job = job
+        self.directory = directory
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        self.profiling = False
+        self.overhead = 0.0
+        self.files = []
+        self.max_rss = None
+
+    def start(self):
+        """
+            Starts profiling the code executed by this thread, and by the threads started from now on.
+        """
+        start_time = time.time()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        self.max_rss = get_max_rss()
+        self.profiling = True
+        threading.setprofile(self.start_thread_profile)
+        self.overhead = self.overhead + time.time()-start_time
+        self.profile.enable()
+
+    def start_thread_profile(self, frame, event, arg):
+        """
+            Profile function of the threads started while profiling: on their first event, it's replaced by a
+            profile of their own.
+        """
+        with self.lock:
+            if not self.profiling:
+                sys.setprofile(None)
+                return
+            profile = cProfile.Profile()
+            self.thread_profiles.append((threading.current_thread(), profile))
+        profile.enable()
+
+    def get_stats(self):
+        """
+            Merges the profile of this thread with the ones of the threads started while profiling. Threads still
+            running are left out, as their profiles can't be read while they are being written.
+            * {Stats} Return the merged statistics.
+        """
+        with self.lock:
+            self.profiling = False
+            thread_profiles = list(self.thread_profiles)
+        stats = pstats.Stats(self.profile)
+        running = 0
+        for (thread, profile) in thread_profiles:
+            if thread.is_alive():
+                running += 1
+                continue
+            try:
+                stats.add(profile)
+            except TypeError:
+                # Threads that didn't call any function have empty profiles
+                pass
+        if running > 0:
+            logger.warning(str(running)+' threads of '+self.job+' were still running, their profiles are left out')
+        return stats
+
+    def stop(self):
+        """
+            Stops profiling and writes the profile files.
+            * {dict} Return the report of the profile: 'files' written, 'overhead' seconds spent setting up and
+                writing the profile, and the peak memory ('max_rss_kb') and its growth ('max_rss_growth_kb').
+        """
+        self.profile.disable()
+        threading.setprofile(None)
+        stop_time = time.time()
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            base_path = os.path.join(self.directory, self.job+'-'+datetime.now().strftime('%Y%m%d-%H%M%S')+'-'+str(os.getpid()))
+            self.get_stats().dump_stats(base_path+'.pstats')
+            self.files.append(base_path+'.pstats')
+            with open(base_path+'.alloc.txt', 'w') as allocations_file:
+                allocations_file.write('\n'.join(self.get_allocations())+'\n')
+            self.files.append(base_path+'.alloc.txt')
+        except Exception as e:
+            logger.error('Exception writing profile of '+self.job)
+            logger.error(e)
+        finally:
+            if tracemalloc is not None:
+                tracemalloc.stop()
+        self.overhead = self.overhead + time.time()-stop_time
+        max_rss = get_max_rss()
+        report = {'files': self.files, 'overhead': round(self.overhead, 3), 'max_rss_kb': max_rss,
+                  'max_rss_growth_kb': max_rss-self.max_rss}
+        logger.info('Profile of '+self.job+' written to '+', '.join(self.files)+' in '+str(report['overhead'])+' s')
+        return report
+
+    def get_allocations(self):
+        """
+            * {list} Return the lines of the allocations snapshot.
+        """
+        lines = ['Peak resident memory: '+str(get_max_rss())+' KB ('+str(get_max_rss()-self.max_rss)+' KB more than at the start)']
+        if tracemalloc is not None:
+            lines.append('Top '+str(TOP_ALLOCATIONS)+' allocations by line:')
+            for statistic in tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]:
+                lines.append(str(statistic))
+        else:
+            # Without tracemalloc, the types of the objects still alive tell where the memory is
+            lines.append('Top '+str(TOP_ALLOCATIONS)+' types of live objects:')
+            type_counts = collections.Counter(type(item).__name__ for item in gc.get_objects())
+            for (type_name, count) in type_counts.most_common(TOP_ALLOCATIONS):
+                lines.append(str(count)+' '+type_name)
+        return lines
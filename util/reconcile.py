@@ -0,0 +1,289 @@
+import json
+import hashlib
+import urlparse
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import bulk_writer
+import metrics
+
+
+"""
+    Fields that are not compared to know if a record has changed.
+"""
+IGNORED_FIELDS = ['insertion_date', 'content_hash']
+
+# If more than this share of the existing records of a source would be deleted, nothing is deleted:
+# it usually means the source failed to return all its data without telling it.
+DEFAULT_MAX_DELETE_RATIO = 0.5
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('reconcile')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_canonical_link(link):
+    """
+        Get a canonical form of one link, so small differences don't make two links different.
+        * link {string} link to normalise.
+        * {string} Return the link with lower case scheme and host, and without trailing slashes or fragment.
+    """
+    if link is None:
+        return None
+    try:
+        parts = urlparse.urlsplit(link.strip())
+        path = parts.path.rstrip('/')
+        return urlparse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ''))
+    except Exception:
+        return link
+
+
+def get_record_key(record):
+    """
+        Get the stable identity of one record: its canonical link and its source.
+        * record {dict} record of the DB.
+        * {tuple} Return the (link, source) key.
+    """
+    return (get_canonical_link(record.get('link')), record.get('source'))
+
+
+def get_content_hash(record, fields=None):
+    """
+        Get a hash of the content of one record, ignoring the fields in IGNORED_FIELDS.
+        * record {dict} record of the DB.
+        * fields {list} fields to take into account. All fields of the record are used if it's None.
+        * {string} Return the hexadecimal SHA-1 hash of the record.
+    """
+    if fields is None:
+        fields = record.keys()
+    content = dict([(field, record.get(field)) for field in fields if field not in IGNORED_FIELDS])
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str)).hexdigest()
+
+
+def get_record_conditions(record):
+    """
+        Get the DB conditions that select one record by its link and source.
+        * record {dict} record of the DB.
+        * {list} Return the conditions.
+    """
+    return [
+        ['AND',[
+                ['EQ','link',record.get('link')],
+                ['EQ','source',record.get('source')]
+               ]
+        ]
+    ]
+
+
+def get_version_conditions(existing_record, record):
+    """
+        Get the DB conditions that select one version of a record, but not a new version of it: its link and source,
+        and its content hash or its insertion date, whichever is different in the new version.
+        * existing_record {dict} version of the record in the DB.
+        * record {dict} new version of the record, with its 'content_hash'.
+        * {list} Return the conditions. None if there is nothing to tell both versions apart.
+    """
+    for field in ['content_hash', 'insertion_date']:
+        value = existing_record.get(field)
+        if value is not None and value != record.get(field):
+            return [
+                ['AND',[
+                        ['EQ','link',existing_record.get('link')],
+                        ['EQ','source',existing_record.get('source')],
+                        ['EQ',field,value]
+                       ]
+                ]
+            ]
+    return None
+
+
+class Reconciler(object):
+    """
+        Writer that synchronises all the records of one source with the ones of one new import: new records are
+        inserted, changed records are updated, and records that are not present in the new import are deleted
+        when the writer is closed. Records are identified by get_record_key, and stored with a 'content_hash'
+        field to detect changes. Changed records are updated by inserting the new version first and deleting the
+        old one once it's written, and records that are not present anymore are deleted once everything else is
+        written, so records are never missing from the DB: if the run dies in between, both versions of some
+        records are kept, and the next run rewrites them. Nothing is deleted if the new import is incomplete.
+        It has the same interface as bulk_writer.BulkWriter, so importing scripts can use any of them.
+    """
+
+    def __init__(self, dbManager, source, max_delete_ratio=DEFAULT_MAX_DELETE_RATIO):
+        init_logger()
+        self.dbManager = dbManager
+        self.source = source
+        self.max_delete_ratio = max_delete_ratio
+        self.writer = bulk_writer.BulkWriter(dbManager)
+        self.stats = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'duplicated': 0}
+        self.seen_keys = set()
+        self.existing = {}
+        self.repeated_records = {}
+        self.load_existing()
+
+    def load_existing(self):
+        """
+            Reads the key and content hash of every record of the source already in the DB.
+        """
+        metrics.increment('db_calls')
+        with metrics.timer('db_query_seconds'):
+            existing_records = self.dbManager.get_data_by_conditions([['EQ','source',self.source]])
+        for record in (existing_records or []):
+            key = get_record_key(record)
+            if key in self.existing:
+                # Repeated records are always rewritten, so only one of them remains
+                self.repeated_records.setdefault(key, []).append(record)
+            else:
+                self.existing[key] = (record.get('content_hash'), record)
+        logger.info('Found '+str(len(self.existing))+' '+self.source+' records in the DB')
+
+    def is_unchanged(self, key, record):
+        """
+            Returns if one record of the new import has the same content as the one in the DB.
+            * key {tuple} key of the record.
+            * record {dict} record of the new import, with its 'content_hash'.
+            * {boolean} Return True if the content has not changed.
+        """
+        if key in self.repeated_records:
+            return False
+        (existing_hash, existing_record) = self.existing[key]
+        if existing_hash is None:
+            # Records stored before content hashes were used: we compare the fields we would insert
+            existing_hash = get_content_hash(existing_record, record.keys())
+        return existing_hash == record['content_hash']
+
+    def insert_data(self, record, callback=None):
+        """
+            Adds one record of the new import, writing it only if it is new or has changed.
+            * record {dict} record to be synchronised.
+            * callback {function} optional function called with (record, success) once the record is written.
+        """
+        key = get_record_key(record)
+        if key in self.seen_keys:
+            self.stats['duplicated'] = self.stats['duplicated'] + 1
+            return
+        self.seen_keys.add(key)
+
+        content_hash = get_content_hash(record)
+        record = dict(record)
+        record['content_hash'] = content_hash
+        if key not in self.existing:
+            self.stats['inserted'] = self.stats['inserted'] + 1
+            self.writer.insert_data(record, callback)
+        elif not self.is_unchanged(key, record):
+            # There isn't an update operation in the DB managers, so we insert the new record and delete the old one
+            self.stats['updated'] = self.stats['updated'] + 1
+            existing_records = [self.existing[key][1]]+self.repeated_records.get(key, [])
+            conditions = [get_version_conditions(existing_record, record) for existing_record in existing_records]
+            if None in conditions:
+                # Old versions that can't be selected apart from the new one are deleted first, and the new one is
+                # written right away
+                self.delete_record(existing_records[0])
+                self.writer.insert_data(record, callback)
+                self.writer.flush()
+            else:
+                self.writer.insert_data(record, self.callback_for_update(conditions, callback))
+        else:
+            self.stats['unchanged'] = self.stats['unchanged'] + 1
+
+    def callback_for_update(self, conditions, callback=None):
+        """
+            Get a callback for bulk_writer.BulkWriter that deletes the old versions of one record once the new one is
+            successfully written. If it's not written, the old versions are kept.
+            * conditions {list} conditions that select each old version, as returned by get_version_conditions.
+            * callback {function} another callback to call after it, if any.
+            * {function} Return the callback.
+        """
+        def record_written(record, success):
+            if success:
+                for version_conditions in conditions:
+                    self.delete_record(record, version_conditions)
+            if callback is not None:
+                callback(record, success)
+        return record_written
+
+    def delete_record(self, record, conditions=None):
+        """
+            Deletes one record from the DB.
+            * record {dict} record of the DB.
+            * conditions {list} conditions that select the record. All records with its link and source if it's None.
+        """
+        if conditions is None:
+            conditions = get_record_conditions(record)
+        metrics.increment('db_calls')
+        with metrics.timer('db_delete_seconds'):
+            self.dbManager.delete_data_by_conditions(conditions)
+
+    def mark_committed(self, link):
+        """
+            Takes into account one record written or seen by a previous, interrupted run, so it's not deleted when
+            closing.
+            * link {string} link of the record.
+        """
+        self.seen_keys.add((get_canonical_link(link), self.source))
+
+    def flush(self):
+        """
+            Writes all buffered records.
+            * {int} Return the number of records successfully inserted in this flush.
+        """
+        return self.writer.flush()
+
+    def flush_expired(self):
+        """
+            Writes all buffered records if they have been buffered too long, see bulk_writer.BulkWriter.flush_expired.
+            * {int} Return the number of records successfully inserted, 0 if the buffer was not flushed.
+        """
+        return self.writer.flush_expired()
+
+    def close(self, complete=True):
+        """
+            Writes all pending records and deletes the records that were not in the new import.
+            * complete {boolean} if the new import has all the records of the source. If it's False, because its
+                fetch was cut short by an error, records not found in it are not deleted.
+            * {int} Return the number of records inserted or updated successfully.
+        """
+        num_written = self.writer.close()
+        failed = self.writer.num_failed
+
+        missing_keys = [key for key in self.existing if key not in self.seen_keys]
+        if not complete:
+            logger.error('Not deleting '+str(len(missing_keys))+' '+self.source+' records missing from the new import:'
+                         +' its fetch was incomplete')
+        elif len(self.existing) > 0 and len(missing_keys) > self.max_delete_ratio*len(self.existing):
+            logger.error('Not deleting '+str(len(missing_keys))+' of '+str(len(self.existing))+' '+self.source
+                         +' records: it exceeds the maximum ratio of '+str(self.max_delete_ratio))
+        else:
+            for key in missing_keys:
+                self.delete_record(self.existing[key][1])
+                self.stats['deleted'] = self.stats['deleted'] + 1
+
+        logger.info('Synchronised '+self.source+' records: '+str(self.stats['inserted'])+' inserted, '
+                    +str(self.stats['updated'])+' updated, '+str(self.stats['deleted'])+' deleted, '
+                    +str(self.stats['unchanged'])+' unchanged, '+str(self.stats['duplicated'])+' duplicated, '
+                    +str(failed)+' failed')
+        return num_written
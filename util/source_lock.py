@@ -0,0 +1,99 @@
+import os
+import json
+import fcntl
+from datetime import datetime
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import util
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('source_lock')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_lock_path(source):
+    """
+        Get the lock file of one source.
+        * source {string} source token.
+        * {string} Return the path of the file.
+    """
+    return os.path.join(util.get_state_directory(), 'lock-'+source)
+
+
+class SourceLock(object):
+    """
+        Lock that only lets one importing process of each source run at the same time, whether they are in the
+        same process, in different processes of the synchronizer pool or launched by hand. It's a file lock, so the
+        operating system releases it if the process holding it dies.
+    """
+
+    def __init__(self, source):
+        init_logger()
+        self.source = source
+        self.path = get_lock_path(source)
+        self.lock_file = None
+
+    def acquire(self):
+        """
+            Tries to take the lock, without waiting for it.
+            * {boolean} Return True if the lock was taken, False if another importing process of the source holds it.
+        """
+        lock_file = open(self.path, 'a+')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lock_file.close()
+            logger.warning('Overlapping '+self.source+' importing processes: the lock is held by '+str(self.get_holder()))
+            return False
+        # Who holds the lock, to be reported to overlapping processes
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(json.dumps({'pid': os.getpid(), 'since': datetime.now().isoformat()}))
+        lock_file.flush()
+        self.lock_file = lock_file
+        return True
+
+    def get_holder(self):
+        """
+            * {dict} Return the process id and the time the lock was taken by its current holder, None if unknown.
+        """
+        try:
+            with open(self.path) as lock_file:
+                return json.loads(lock_file.read())
+        except Exception:
+            return None
+
+    def release(self):
+        """
+            Releases the lock, if it's held.
+        """
+        if self.lock_file is None:
+            return
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
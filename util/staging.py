@@ -0,0 +1,128 @@
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import reconcile
+
+
+# Dataset used by default for staged imports
+DEFAULT_STAGING_DS_NAME = 'staging'
+
+"""
+    Default thresholds a staged import must pass before being promoted to the live dataset, besides having fetched
+    its source completely.
+        DEFAULT_MIN_RECORDS     minimum number of staged records
+        DEFAULT_MIN_RATIO       minimum number of staged records, as a share of the records already live
+"""
+DEFAULT_MIN_RECORDS = 1
+DEFAULT_MIN_RATIO = 0.5
+
+# Fields added by the DB itself, which must not be copied from one dataset to another
+DB_INTERNAL_FIELDS = ['id', '_id', '_version_', 'score']
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('staging')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def get_source_conditions(source):
+    """
+        Get the DB conditions that select all records of one source.
+        * source {string} source token.
+        * {list} Return the conditions.
+    """
+    return [['EQ','source',source]]
+
+
+def clear(stagingManager, source):
+    """
+        Removes all records of one source from the staging dataset, before loading it again.
+        * stagingManager {AbstractManager} DB manager of the staging dataset.
+        * source {string} source token.
+    """
+    init_logger()
+    stagingManager.delete_data_by_conditions(get_source_conditions(source))
+
+
+def validate(staged_count, live_count, min_records=DEFAULT_MIN_RECORDS, min_ratio=DEFAULT_MIN_RATIO, complete=True):
+    """
+        Checks if a staged import can replace the live data of its source.
+        * staged_count {int} number of records in the staging dataset.
+        * live_count {int} number of records in the live dataset.
+        * min_records {int} minimum number of staged records.
+        * min_ratio {float} minimum number of staged records, as a share of live_count.
+        * complete {boolean} if the staged import fetched all the data of its source.
+        * {string} Return the reason why the import is not valid, None if it is valid.
+    """
+    if not complete:
+        # A fetch cut short by an error can have most of the records, and still miss some of them
+        return 'the fetch of the staged records was incomplete'
+    if staged_count is None:
+        return 'staged records could not be counted'
+    if staged_count < min_records:
+        return str(staged_count)+' staged records, less than the minimum of '+str(min_records)
+    if live_count is not None and staged_count < min_ratio*live_count:
+        return (str(staged_count)+' staged records, less than '+str(min_ratio)+' times the '
+                +str(live_count)+' live records')
+    return None
+
+
+def promote(stagingManager, liveManager, source, min_records=DEFAULT_MIN_RECORDS, min_ratio=DEFAULT_MIN_RATIO, complete=True):
+    """
+        Copies the staged records of one source to the live dataset, once they are validated, and drops them
+        from the staging dataset. Live records are synchronised with reconcile.Reconciler: new and changed records
+        are inserted before the versions they replace are deleted, and live records that are not staged are only
+        deleted once everything else is written. So readers never see the source empty, nor miss a record that is
+        both live and staged, although for a while they can see both versions of a changed record. If the process
+        dies while promoting, no record is lost but some can be left twice, until the next promotion rewrites them.
+        If validation fails, live data is not modified and staged records are kept, to be inspected or completed by
+        resuming the run.
+        * stagingManager {AbstractManager} DB manager of the staging dataset.
+        * liveManager {AbstractManager} DB manager of the live dataset.
+        * source {string} source token.
+        * min_records {int} minimum number of staged records.
+        * min_ratio {float} minimum number of staged records, as a share of the live ones.
+        * complete {boolean} if the staged import fetched all the data of its source. Incomplete imports are never
+            promoted, as live records missing from them would be deleted.
+        * {boolean} Return True if staged records were promoted.
+    """
+    init_logger()
+    conditions = get_source_conditions(source)
+    staged_count = stagingManager.count_data_by_conditions(conditions)
+    live_count = liveManager.count_data_by_conditions(conditions)
+    reason = validate(staged_count, live_count, min_records, min_ratio, complete)
+    if reason is not None:
+        logger.error('Staged '+source+' records not promoted: '+reason)
+        return False
+
+    # The staged import is complete and passed the thresholds, so the reconciler can delete as many live records as needed
+    reconciler = reconcile.Reconciler(liveManager, source, max_delete_ratio=1.0)
+    for record in (stagingManager.get_data_by_conditions(conditions) or []):
+        reconciler.insert_data(dict([(field, value) for (field, value) in record.items() if field not in DB_INTERNAL_FIELDS]))
+    reconciler.close()
+    stagingManager.delete_data_by_conditions(conditions)
+    logger.info('Promoted '+str(staged_count)+' staged '+source+' records')
+    return True
@@ -0,0 +1,237 @@
+import os
+import sqlite3
+import time
+import logging
+from logging.handlers import TimedRotatingFileHandler
+
+import ConfigParser
+
+
+"""
+    Default configuration of the URL availability cache. It can be overwritten through the
+    'CacheSection' of ConfigFile.properties:
+        url_cache.directory     directory where the SQLite file is stored
+        url_cache.positive_ttl  seconds an available url is trusted
+        url_cache.negative_ttl  seconds an unavailable url is trusted
+        url_cache.max_entries   maximum number of urls kept; least recently used ones are dropped
+"""
+DEFAULT_CACHE_DIRECTORY = '../../resource-contextualization-cache'
+DEFAULT_POSITIVE_TTL = 24*60*60
+DEFAULT_NEGATIVE_TTL = 60*60
+DEFAULT_MAX_ENTRIES = 100000
+CACHE_FILE_NAME = 'url_availability.sqlite'
+
+# SQLite has a limit on the number of parameters of one statement
+MAX_SQL_PARAMS = 500
+
+
+
+logger = None
+
+def init_logger():
+    """
+        Function that initialises logging system
+    """
+    global logger
+    logger = logging.getLogger('url_cache')
+    if (len(logger.handlers) == 0):           # We only create a StreamHandler if there aren't another one
+        streamhandler = logging.StreamHandler()
+        streamhandler.setLevel(logging.INFO)
+
+        filehandler = logging.handlers.TimedRotatingFileHandler('../../resource-contextualization-logs/util.log', when='w0')
+        filehandler.setLevel(logging.INFO)
+
+        logger.setLevel(logging.INFO)
+
+        # create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        streamhandler.setFormatter(formatter)
+        filehandler.setFormatter(formatter)
+        # add formatters to logger
+        logger.addHandler(streamhandler)
+        logger.addHandler(filehandler)
+
+
+
+def chunks(values, size):
+    """
+        Splits a list in consecutive pieces.
+        * values {list} values to split.
+        * size {int} maximum length of each piece.
+        * {list} Return a list of lists.
+    """
+    return [values[i:i+size] for i in range(0, len(values), size)]
+
+
+class UrlCache(object):
+    """
+        Disk-backed cache with the availability of urls, shared by all importing processes.
+        Available and unavailable urls expire after different times, and the number of urls
+        stored is limited: when it is exceeded, least recently used urls are removed.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, positive_ttl=DEFAULT_POSITIVE_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        init_logger()
+        self.directory = directory
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, CACHE_FILE_NAME)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS url_status ('
+                                   'url TEXT PRIMARY KEY, '
+                                   'available INTEGER NOT NULL, '
+                                   'checked_at REAL NOT NULL, '
+                                   'last_access REAL NOT NULL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS url_status_last_access ON url_status (last_access)')
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # A new connection for every operation: the cache is used from several processes and threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _is_fresh(self, available, checked_at, now):
+        if available:
+            return (now - checked_at) < self.positive_ttl
+        else:
+            return (now - checked_at) < self.negative_ttl
+
+    def get(self, url):
+        """
+            Get the cached availability of one url.
+            * url {string} URL to look for.
+            * {boolean} Return True or False if there is a fresh result for the url, None otherwise.
+        """
+        return self.get_many([url]).get(url)
+
+    def get_many(self, urls):
+        """
+            Get the cached availability of several urls.
+            * urls {list} URLs to look for.
+            * {dict} Return the availability of the urls with a fresh result. Missing or expired urls are not included.
+        """
+        found = {}
+        urls = list(set([url for url in urls if url is not None]))
+        if len(urls) == 0:
+            return found
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                for urls_chunk in chunks(urls, MAX_SQL_PARAMS):
+                    placeholders = ','.join(['?']*len(urls_chunk))
+                    rows = connection.execute('SELECT url, available, checked_at FROM url_status WHERE url IN ('+placeholders+')', urls_chunk).fetchall()
+                    for (url, available, checked_at) in rows:
+                        if self._is_fresh(available, checked_at, now):
+                            found[url] = bool(available)
+                for urls_chunk in chunks(found.keys(), MAX_SQL_PARAMS):
+                    placeholders = ','.join(['?']*len(urls_chunk))
+                    connection.execute('UPDATE url_status SET last_access = ? WHERE url IN ('+placeholders+')', [now] + urls_chunk)
+        finally:
+            connection.close()
+        return found
+
+    def set(self, url, available):
+        """
+            Stores the availability of one url.
+            * url {string} URL checked.
+            * available {boolean} result of the check.
+        """
+        self.set_many({url: available})
+
+    def set_many(self, url_status):
+        """
+            Stores the availability of several urls, and removes the least recently used ones if the cache is full.
+            * url_status {dict} availability (True or False) of each url.
+        """
+        now = time.time()
+        rows = [(url, int(bool(available)), now, now) for (url, available) in url_status.items() if url is not None]
+        if len(rows) == 0:
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO url_status (url, available, checked_at, last_access) VALUES (?, ?, ?, ?)', rows)
+                self._prune(connection)
+        finally:
+            connection.close()
+
+    def _prune(self, connection):
+        count = connection.execute('SELECT COUNT(*) FROM url_status').fetchone()[0]
+        if count > self.max_entries:
+            connection.execute('DELETE FROM url_status WHERE url IN (SELECT url FROM url_status ORDER BY last_access ASC LIMIT ?)', [count - self.max_entries])
+            logger.info('Removed '+str(count - self.max_entries)+' least recently used urls from cache')
+
+    def invalidate(self, urls=None):
+        """
+            Removes urls from the cache, so they will be checked again next time.
+            * urls {list} URLs to remove. If it is None, the whole cache is emptied.
+            * {int} Return the number of urls removed.
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                if urls is None:
+                    return connection.execute('DELETE FROM url_status').rowcount
+                removed = 0
+                for urls_chunk in chunks(list(urls), MAX_SQL_PARAMS):
+                    placeholders = ','.join(['?']*len(urls_chunk))
+                    removed = removed + connection.execute('DELETE FROM url_status WHERE url IN ('+placeholders+')', urls_chunk).rowcount
+                return removed
+        finally:
+            connection.close()
+
+    def invalidate_expired(self):
+        """
+            Removes all the urls whose result is not fresh anymore.
+            * {int} Return the number of urls removed.
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                return connection.execute('DELETE FROM url_status WHERE (available = 1 AND checked_at <= ?) OR (available = 0 AND checked_at <= ?)',
+                                          [now - self.positive_ttl, now - self.negative_ttl]).rowcount
+        finally:
+            connection.close()
+
+
+
+default_cache = None
+
+def get_default_cache():
+    """
+        Get the url cache configured in ConfigFile.properties, creating it the first time.
+        * {UrlCache} Return the cache, or None if it can't be used.
+    """
+    global default_cache
+    init_logger()
+    if default_cache is None:
+        directory = DEFAULT_CACHE_DIRECTORY
+        positive_ttl = DEFAULT_POSITIVE_TTL
+        negative_ttl = DEFAULT_NEGATIVE_TTL
+        max_entries = DEFAULT_MAX_ENTRIES
+        config = ConfigParser.RawConfigParser()
+        config.read('ConfigFile.properties')
+        if config.has_section('CacheSection'):
+            if config.has_option('CacheSection', 'url_cache.directory'):
+                directory = config.get('CacheSection', 'url_cache.directory')
+            if config.has_option('CacheSection', 'url_cache.positive_ttl'):
+                positive_ttl = config.getint('CacheSection', 'url_cache.positive_ttl')
+            if config.has_option('CacheSection', 'url_cache.negative_ttl'):
+                negative_ttl = config.getint('CacheSection', 'url_cache.negative_ttl')
+            if config.has_option('CacheSection', 'url_cache.max_entries'):
+                max_entries = config.getint('CacheSection', 'url_cache.max_entries')
+        try:
+            default_cache = UrlCache(directory, positive_ttl, negative_ttl, max_entries)
+        except Exception as e:
+            logger.error('Exception opening url cache at '+directory+', urls will not be cached')
+            logger.error(e)
+            return None
+    return default_cache
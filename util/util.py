@@ -1,4 +1,5 @@
 import json
+import os
 import re
 import requests
 import sys
@@ -7,9 +8,24 @@ import logging
 from logging.handlers import TimedRotatingFileHandler
 import ssl
 import urllib2
+import urlparse
+import threading
+from multiprocessing.pool import ThreadPool
 
 import ConfigParser
 
+import url_cache
+import http_client
+import metrics
+
+
+# Default concurrency used by check_urls
+URL_CHECK_MAX_WORKERS = 16
+URL_CHECK_PER_HOST_LIMIT = 4
+
+# Default directory where importing scripts keep their state between runs
+DEFAULT_STATE_DIRECTORY = '../../resource-contextualization-state'
+
 
 
 
@@ -42,6 +58,36 @@ def init_logger():
 
 
 
+def get_state_directory():
+    """
+        Get the directory where importing scripts keep their state between runs (checkpoints, journals...).
+        It can be configured with 'state.directory' in the 'StateSection' of ConfigFile.properties.
+        * {string} Return the path of the directory, which is created if it doesn't exist.
+    """
+    directory = DEFAULT_STATE_DIRECTORY
+    config = ConfigParser.RawConfigParser()
+    config.read('ConfigFile.properties')
+    if config.has_option('StateSection', 'state.directory'):
+        directory = config.get('StateSection', 'state.directory')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def write_file_atomically(path, content):
+    """
+        Writes a file so readers find either its previous or its new content, never a partial one.
+        * path {string} path of the file.
+        * content {string} new content of the file.
+    """
+    temp_path = path+'.'+str(os.getpid())+'.tmp'
+    with open(temp_path, 'w') as temp_file:
+        temp_file.write(content)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.rename(temp_path, path)
+
+
 def get_url_code(url):
         
     """
@@ -85,22 +131,8 @@ def existURL(url):
     
     myResponse = False  
     try:
-        # context = ssl._create_unverified_context()
-        try:
-            urlResponse = urllib2.urlopen(url, timeout = 10)
-            # urlResponse = urllib2.urlopen(url, context=context)
-            # logger.info(urlResponse)
-            myResponse = True
-        except urllib2.HTTPError as e:
-            myResponse = False
-            # logger.info('urllib2.HTTPError')
-            # logger.info(e)
-        except urllib2.URLError as e:
-            # logger.info('urllib2.URLError')
-            # logger.info(e)
-            myResponse = False    
-        
-        
+        # Pooled connections of the shared HTTP client: HEAD first, and only GET if HEAD isn't accepted
+        myResponse = http_client.is_available(url, timeout = 10)
     except Exception as e:
         # logger.error ("Exception getting data from URL: "+url)
         myResponse = False
@@ -109,6 +141,92 @@ def existURL(url):
     return myResponse
 
 
+def get_url_host(url):
+    """
+        Returns the host part of one url.
+        * url {string} URL to parse.
+        * {string} Return the host of the url, or an empty string if it can't be parsed.
+    """
+    try:
+        return urlparse.urlparse(url).netloc.lower()
+    except Exception:
+        return ''
+
+
+def check_urls(urls, max_workers=URL_CHECK_MAX_WORKERS, per_host_limit=URL_CHECK_PER_HOST_LIMIT, use_cache=True):
+    """
+        Checks the availability of several urls concurrently, using existURL for each one of them.
+        * urls {list} URLs to check. Repeated and None values are checked only once or ignored.
+        * max_workers {int} maximum number of urls being checked at the same time.
+        * per_host_limit {int} maximum number of urls of the same host being checked at the same time.
+        * use_cache {boolean} if we want to reuse recent results stored in the url cache, and store the new ones.
+        * {dict} Return the availability (True or False) of each url.
+    """
+    init_logger()
+
+    unique_urls = []
+    seen_urls = set()
+    for url in urls:
+        if url is not None and url not in seen_urls:
+            seen_urls.add(url)
+            unique_urls.append(url)
+    if len(unique_urls) == 0:
+        return {}
+
+    cache = None
+    cached_status = {}
+    if use_cache:
+        cache = url_cache.get_default_cache()
+    if cache is not None:
+        try:
+            cached_status = cache.get_many(unique_urls)
+        except Exception as e:
+            logger.error('Exception reading url cache')
+            logger.error(e)
+        unique_urls = [url for url in unique_urls if url not in cached_status]
+        logger.info('Found '+str(len(cached_status))+' urls in cache, '+str(len(unique_urls))+' to check')
+        metrics.increment('link_cache_hits', len(cached_status))
+    if len(unique_urls) == 0:
+        return cached_status
+
+    # One semaphore per host, so we don't flood a single server with all our workers
+    host_semaphores = {}
+    for url in unique_urls:
+        host = get_url_host(url)
+        if host not in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(max(1, per_host_limit))
+
+    def check_one_url(url):
+        semaphore = host_semaphores[get_url_host(url)]
+        semaphore.acquire()
+        try:
+            with metrics.timer('link_check_seconds'):
+                return (url, existURL(url))
+        finally:
+            semaphore.release()
+
+    pool = ThreadPool(max(1, min(max_workers, len(unique_urls))))
+    try:
+        url_status = dict(pool.map(check_one_url, unique_urls))
+    finally:
+        pool.close()
+        pool.join()
+
+    available = len([url for url in url_status if url_status[url]])
+    logger.info('Checked '+str(len(url_status))+' urls: '+str(available)+' available')
+    metrics.increment('link_checks', len(url_status))
+    metrics.increment('links_available', available)
+
+    if cache is not None:
+        try:
+            cache.set_many(url_status)
+        except Exception as e:
+            logger.error('Exception writing url cache')
+            logger.error(e)
+    url_status.update(cached_status)
+    return url_status
+
+
 ###    ENTRY POINTS
 
        